@@ -0,0 +1,237 @@
+"""
+Semantic cache of the agent's answers, keyed on the user's question.
+
+Paraphrases of a question that was already answered ("ACAMOL users", "who is
+prescribed acamol") would otherwise cost a full LLM turn.  Questions are
+reduced to their content words (stop words dropped, domain synonyms folded,
+light stemming) and embedded as hashed word + character-trigram vectors; no
+model is needed.  The vectors live in one flat `array('f')` with a row per
+cached answer, and a lookup scores only the question's non-zero dimensions
+against every row.
+
+A candidate above the similarity threshold is only returned when both
+questions name the same numbers and every content word of one has a close
+counterpart in the other, so "male patients born 1980" never answers
+"female patients born 1990".  Follow-up questions ("and their tests?") are
+neither answered nor cached.  Entries expire after a TTL and the whole cache
+is dropped when `schema_context.json` changes.  Each answer also keeps the
+data version of the document types its statements read
+(`ResultCache.data_version`), so a write that invalidates those types'
+cached results invalidates the answer too.
+"""
+
+import os
+import re
+import time
+import zlib
+from array import array
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+DIMENSIONS = 512
+WORD_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.5
+
+STOPWORDS = {
+    "a", "all", "an", "and", "any", "are", "by", "can", "could", "did", "do", "does", "for", "from", "get",
+    "give", "has", "have", "how", "i", "in", "is", "it", "list", "me", "of", "on", "please", "show", "tell",
+    "that", "the", "their", "them", "there", "to", "us", "was", "were", "what", "which", "who", "whose",
+    "with", "would", "you", "find", "display", "fetch",
+    # every question is about patients, so the word does not tell questions apart
+    "patient", "patients", "people", "person", "persons",
+}
+# different words for the same thing in this data set, folded before stemming
+SYNONYMS = {
+    "users": "prescribed", "user": "prescribed", "using": "prescribed", "uses": "prescribed", "use": "prescribed",
+    "taking": "prescribed", "takes": "prescribed", "take": "prescribed", "took": "prescribed",
+    "prescriptions": "prescribed", "prescription": "prescribed", "prescribe": "prescribed",
+    "medicine": "medication", "medicines": "medication", "drug": "medication", "drugs": "medication",
+    "men": "male", "man": "male", "women": "female", "woman": "female",
+    "many": "count", "number": "count", "total": "count",
+    "labs": "test", "lab": "test", "results": "test", "result": "test",
+}
+_SUFFIXES = ("ing", "ed", "es", "s")
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+# questions that lean on the conversation so far; their answers depend on more than the text
+_FOLLOW_UP_RE = re.compile(
+    r"^\s*(?:and|also|what about|how about|same)\b|\b(?:they|them|their|those|these|it|its|that one|previous|above)\b",
+    re.IGNORECASE,
+)
+
+
+def _stem(word: str) -> str:
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.isdigit():
+            return word[: -len(suffix)]
+    return word
+
+
+def content_words(question: str) -> List[str]:
+    """The canonical content words of a question, in order."""
+    words = []
+    for word in _WORD_RE.findall(question.lower()):
+        if word in STOPWORDS:
+            continue
+        word = SYNONYMS.get(word, word)
+        words.append(word if word.isdigit() else _stem(word))
+    return words
+
+
+def is_follow_up(question: str) -> bool:
+    """True for questions that refer back to earlier turns and so cannot be cached."""
+    return bool(_FOLLOW_UP_RE.search(question))
+
+
+def _trigrams(word: str) -> List[str]:
+    padded = f"^{word}$"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def embed(words: Sequence[str]) -> Dict[int, float]:
+    """Sparse, L2-normalised hashed feature vector of content words: {dimension: value}."""
+    vector: Dict[int, float] = {}
+
+    def add(feature: str, weight: float):
+        h = zlib.crc32(feature.encode("utf-8"))
+        index = h % DIMENSIONS
+        vector[index] = vector.get(index, 0.0) + (weight if h & 0x80000000 else -weight)
+
+    for word in set(words):
+        add(f"w:{word}", WORD_WEIGHT)
+        if not word.isdigit():
+            for trigram in _trigrams(word):
+                add(f"t:{trigram}", TRIGRAM_WEIGHT)
+    norm = sum(v * v for v in vector.values()) ** 0.5
+    return {i: v / norm for i, v in vector.items() if v} if norm else {}
+
+
+def _similar_words(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if a.isdigit() or b.isdigit():
+        return False
+    ta, tb = set(_trigrams(a)), set(_trigrams(b))
+    return len(ta & tb) / len(ta | tb) >= 0.6
+
+
+def compatible(a: Sequence[str], b: Sequence[str]) -> bool:
+    """True when two questions name the same numbers and the same content words (up to typos)."""
+    if {w for w in a if w.isdigit()} != {w for w in b if w.isdigit()}:
+        return False
+    return all(any(_similar_words(x, y) for y in b) for x in a) and all(any(_similar_words(y, x) for x in a) for y in b)
+
+
+class AnswerCache:
+    """Fixed-capacity vector index of answered questions; the oldest row is overwritten when full."""
+
+    def __init__(self, threshold: float = 0.9, capacity: int = 1000, ttl: float = 3600):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self._vectors = array("f", bytes(4 * DIMENSIONS * capacity))
+        self._entries: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._next = 0
+        self._schema_digest: Optional[str] = None
+        self.stats = Counter()
+
+    def clear(self):
+        self._vectors = array("f", bytes(4 * DIMENSIONS * self.capacity))
+        self._entries = [None] * self.capacity
+        self._next = 0
+
+    def _check_schema(self, schema_digest: Optional[str]):
+        if schema_digest != self._schema_digest:
+            if self._schema_digest is not None:
+                self.stats["schema_resets"] += 1
+            self.clear()
+            self._schema_digest = schema_digest
+
+    def lookup(
+        self,
+        question: str,
+        schema_digest: Optional[str] = None,
+        is_stale: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        The cached entry answering a question like this one, or None.
+        Candidates for which `is_stale(entry)` is true are dropped.
+        """
+        self._check_schema(schema_digest)
+        if is_follow_up(question):
+            return None
+        words = content_words(question)
+        vector = embed(words)
+        best: Tuple[float, int] = (0.0, -1)
+        now = time.time()
+        for row, entry in enumerate(self._entries):
+            if entry is None or entry["expires"] < now:
+                continue
+            base = row * DIMENSIONS
+            score = sum(value * self._vectors[base + index] for index, value in vector.items())
+            if score > best[0] and compatible(words, entry["words"]):
+                if is_stale is not None and is_stale(entry):
+                    self._entries[row] = None
+                    self.stats["stale"] += 1
+                    continue
+                best = (score, row)
+        if best[0] < self.threshold:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return {**self._entries[best[1]], "similarity": round(best[0], 4)}
+
+    def store(
+        self,
+        question: str,
+        answer: str,
+        statements: Sequence[str] = (),
+        schema_digest: Optional[str] = None,
+        data_version: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Caches the final answer to a question together with the queries that
+        produced it and the version of the data they read.
+        """
+        self._check_schema(schema_digest)
+        if is_follow_up(question):
+            return
+        words = content_words(question)
+        vector = embed(words)
+        if not vector:
+            return
+        row = self._next
+        self._next = (row + 1) % self.capacity
+        base = row * DIMENSIONS
+        for index in range(DIMENSIONS):
+            self._vectors[base + index] = vector.get(index, 0.0)
+        self._entries[row] = {
+            "question": question,
+            "words": words,
+            "answer": answer,
+            "statements": list(statements),
+            "schema_digest": schema_digest,
+            "data_version": data_version,
+            "expires": time.time() + self.ttl,
+        }
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+
+_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Returns the process-wide cache, or None when ANSWER_CACHE_ENABLED is false."""
+    global _cache
+    if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    if _cache is None:
+        _cache = AnswerCache(
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.9")),
+            capacity=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000")),
+            ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+        )
+    return _cache
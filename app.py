@@ -1,21 +1,38 @@
 # appv2.py (Corrected version)
 
+import asyncio
 import os
 import chainlit as cl
+from answer_cache import get_answer_cache
+from conversation_memory import get_conversation_memory
 from dapr_agents import Agent
-from dapr_agents.tool.mcp.client import MCPClient
-from dapr_agents.llm.dapr import DaprChatClient
 from dapr_agents.types import LLMChatResponse, UserMessage
 from dotenv import load_dotenv
+from fast_path import get_fast_path
+from kv_lookup import get_documents_by_key
+from llm_admission import AdmittedDaprChatClient, admitted
+from mcp_pool import close_pool, get_pool
+from query_tools import instrument_tools, recording_statements
+from result_cache import get_result_cache
+from schema_registry import get_schema_registry
+from schema_retriever import get_schema_retriever
+from telemetry import ACTIVE_SESSIONS, TURNS, mount_metrics_endpoint, span
+from ui_steps import show_tool_steps, stream_text
 
 load_dotenv()
 
+# Prometheus metrics of the app (stage latencies, cache hit rates, sessions) at /metrics
+mount_metrics_endpoint()
+
 # --- Agent Instructions  ---
 instructions = [
     "You are an expert N1QL (Couchbase) query specialist with 10+ years of experience.",
     "ROLE: Senior N1QL Database Engineer specializing in JSON document querying and optimization.",
     "SESSION BEHAVIOR: Use schema discovery tools only during initialization. For query generation, rely on the provided schema context.",
-    "OPTIMIZATION FOCUS: Generate syntactically correct, performance-optimized SQL++ queries using the established schema knowledge."
+    "OPTIMIZATION FOCUS: Generate syntactically correct, performance-optimized SQL++ queries using the established schema knowledge.",
+    "If a query tool result starts with QUERY NOT EXECUTED, rewrite the query as the message explains and run it again.",
+    "KEY LOOKUPS: To fetch documents by id or key, use the get_documents_by_key tool (keys follow each type's key_pattern) instead of a query.",
+    "QUERY RESULTS: Multi-row results arrive as 'rows: N', 'columns: [...]' and one JSON array per row; only the first page of a SELECT is fetched. When only part of the result was fetched, the header gives the total row count ('rows: N+' if it is unknown) and the aggregates cover only the fetched rows; use COUNT / GROUP BY queries for totals and breakdowns. The user can page through the full result separately."
 ]
 
 @cl.on_chat_start
@@ -25,56 +42,133 @@ async def start():
     """
     
      # ;loading a pre created data schema of the Couchbase content. It is created with cb_discovery.py
+    # The parsed schema is shared by all sessions and reloaded when the file changes
     try:
-        with open('schema_context.json', 'r', encoding='utf-8') as f:
-            schema_context = f.read()
+        get_schema_registry().get()
     except FileNotFoundError:
         await cl.Message(content="Error: `schema_context.json` not found. Please run `cb_discovery.py` script first to generate it.").send()
         return
-    cl.user_session.set("schema_context", schema_context)
 
     # --- שלב 2: התחברות ל-MCP ויצירת Agent של Dapr ---
-    mcp_url = os.getenv("MCP_SERVER_URL")
-    if not mcp_url:
-        await cl.Message(content="Error: MCP_SERVER_URL environment variable not set.").send()
-        return    
-    client = MCPClient(timeout=60.0)
+    # The MCP connection pool and its tool list are shared by every session
+    try:
+        pool = get_pool()
+    except RuntimeError as e:
+        await cl.Message(content=f"Error: {e}").send()
+        return
     try:
-        await client.connect_sse(server_name="couchbase_mcp", url=mcp_url, headers=None)
+        tools = await pool.get_tools()
     except Exception as e:
         await cl.Message(content=f"Failed to connect to MCP Server: {e}").send()
         return
-        
-    tools = client.get_all_tools()
+    # Point lookups by id are served with batched KV gets instead of the query service
+    tools = tools + [get_documents_by_key]
+    # Queries the agent runs go through the query middlewares (result cache, workload log, cost guard, prepared statements)
+    tools = instrument_tools(tools)
+    # Every tool call shows up as a step in the UI while it runs
+    tools = show_tool_steps(tools)
+
     # Create the Agent 
     component_name = os.getenv("DAPR_LLM_COMPONENT_DEFAULT", "openai")
     agent = Agent(
         name="TestAgent",
         role="software architect and expert in Dapr and Dapr agents",
         instructions=instructions,
-        llm=DaprChatClient(component_name=component_name, enable_tool_calls=True),
+        llm=AdmittedDaprChatClient(component_name=component_name, enable_tool_calls=True),  # calls are charged to the shared LLM rate limits
+        # History lives in the conversationstore; the LLM gets a compacted view within a token budget
+        memory=get_conversation_memory(cl.context.session.id),
         tools=tools,     # When I Uncomment it to use MCP tools the agent crashes because he invokes openai with DAPR_LLM_TOOL_FORMAT = dapr 
     #    when i use it without tools the agent uses the DAPR_LLM_TOOL_FORMAT from the env variable - opneai
     )
 
     cl.user_session.set("agent", agent)
+    cl.user_session.set("counted_session", True)
+    ACTIVE_SESSIONS.inc()
 
     # Send a ready message to the user
     await cl.Message(
         content="✅ Couchbase Agent is ready. How can I help?"
     ).send()
 
+@cl.on_chat_end
+async def end():
+    """
+    Keeps the active-sessions gauge current when a chat session ends.
+    """
+    if cl.user_session.get("counted_session"):
+        ACTIVE_SESSIONS.dec()
+
+@cl.on_app_shutdown
+async def shutdown():
+    """
+    Closes the shared MCP connections when the Chainlit server stops.
+    """
+    await close_pool()
+
 @cl.on_message
 async def main(message: cl.Message):
     """
     Handles incoming user messages.
     """
+    # Every turn is traced: one span per stage, timed into the /metrics histograms
+    with span("turn", session_id=cl.context.session.id) as turn:
+        path = await answer_message(message, turn)
+        turn.set(path=path)
+    TURNS.inc(path=path)
+
+async def answer_message(message: cl.Message, turn) -> str:
+    """
+    Answers one message; returns the path that answered it (fast_path, answer_cache, agent or error).
+    """
+    # Recurring question shapes are answered from prepared templates without an LLM round trip
+    fast_path = get_fast_path()
+    if fast_path is not None:
+        with span("fast_path"):
+            answer = await fast_path.answer(message.content)
+        if answer is not None:
+            with span("ui_send"):
+                await cl.Message(content=answer).send()
+            return "fast_path"
+
+    with span("schema_lookup"):
+        schema_context = get_schema_registry().get()
+    # Paraphrases of questions answered before are served from the semantic answer cache
+    answer_cache = get_answer_cache()
+    result_cache = get_result_cache() if answer_cache is not None else None
+    if answer_cache is not None:
+        with span("answer_cache"):
+            # answers go stale with the cached results of the document types they read
+            generations = await result_cache.current_generations() if result_cache is not None else None
+
+            def is_stale(entry) -> bool:
+                version = entry["data_version"]
+                return version is not None and generations is not None and not result_cache.is_current(version, generations)
+
+            cached = answer_cache.lookup(message.content, schema_context.digest, is_stale)
+        if cached is not None:
+            with span("ui_send"):
+                await cl.Message(content=cached["answer"]).send()
+            return "answer_cache"
+
     agent = cl.user_session.get("agent")
-    schema_context = cl.user_session.get("schema_context")    
+    # Only the document types and fields relevant to this question go into the prompt
+    with span("schema_retrieval") as retrieval:
+        relevant_schema = get_schema_retriever(schema_context).render(message.content)
+        retrieval.set(schema_chars=len(relevant_schema or ""))
     prompt = message.content
+    if relevant_schema:
+        prompt = f"SCHEMA CONTEXT (relevant document types and fields):\n{relevant_schema}\n\nQUESTION: {message.content}"
+
+    # Answer placeholder shown right away; tool calls appear as steps until the answer streams in
+    response = cl.Message(content="")
+    await response.send()
 
     try:
-        final_result = await agent.run(prompt)
+        # Turns queue for the shared LLM rate limits instead of all hitting the provider at once
+        async with admitted(cl.context.session.id, prompt):
+            with recording_statements() as statements, span("agent_run") as run:
+                final_result = await agent.run(prompt)
+                run.set(statements=len(statements))
         
         # Handle different response types
         if hasattr(final_result, 'content'):
@@ -82,15 +176,20 @@ async def main(message: cl.Message):
         elif hasattr(final_result, 'message') and hasattr(final_result.message, 'content'):
             response_content = final_result.message.content
         else:
-            response_content = str(final_result)
+            # large results must not stall the event loop while they are stringified
+            response_content = await asyncio.to_thread(str, final_result)
 
-        await cl.Message(
-            content=response_content,
-        ).send()
+        with span("ui_send", chars=len(response_content or "")):
+            await stream_text(response, response_content)
+        # an answer that explains a rejected or failed tool call is not worth repeating
+        if answer_cache is not None and not statements.failures:
+            # versioned as of the start of the turn, so a write during the turn leaves the answer stale
+            data_version = result_cache.data_version(statements, generations) if result_cache is not None else None
+            answer_cache.store(message.content, response_content, statements, schema_context.digest, data_version)
     except Exception as e:
-        print(f"Debug - final_result type: {type(final_result)}")
-        print(f"Debug - final_result attributes: {dir(final_result)}")
-        await cl.Message(
-            content=f"Error: {str(e)}"
-        ).send()
-
+        # the error is recorded on the turn's span
+        turn.fail(e)
+        response.content = f"Error: {str(e)}"
+        await response.update()
+        return "error"
+    return "agent"
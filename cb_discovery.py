@@ -1,9 +1,16 @@
 import os
+import argparse
 import asyncio
+import hashlib
 import json
+import math
+import random
+import re
+import time
 from dapr_agents import Agent
 from dapr_agents.tool.mcp.client import MCPClient
 from dotenv import load_dotenv
+from mcp_pool import decode_tool_result, tool_error
 
 # טעינת משתני סביבה מקובץ .env
 load_dotenv()
@@ -25,6 +32,15 @@ discovery_prompt = (
     "3. Summarize all findings from the previous steps into a final, structured JSON format to be used as context.\n\n"
 )
 
+SCOPES_TOOL = "CouchbaseMcpGetScopesAndCollectionsInBucket"
+SCHEMA_TOOL = "CouchbaseMcpGetSchemaForCollection"
+SCHEMA_FILE = "schema_context.json"
+QUERY_TOOL = "CouchbaseMcpRunSqlPlusPlusQuery"
+SYSTEM_SCOPE = "_system"
+FINGERPRINT_SAMPLE_SIZE = 200
+KEY_SAMPLE_SIZE = 20
+KEY_FIELD = "_key"   # document key attribute in NDJSON dumps (`cbexport json --include-key _key`)
+
 async def run_discovery_test():
     """
     Main function to initialize the agent and run the discovery prompt test.
@@ -93,8 +109,553 @@ async def run_discovery_test():
     except Exception as e:
         print(f"🛑 An error occurred during agent execution: {e}")
 
-        
+
+async def call_mcp_tool(tools, name, **kwargs):
+    """
+    Calls an MCP tool directly (no LLM involved) and decodes its JSON result.
+    Raises RuntimeError when the tool returns an error result.
+    """
+    tool = tools.get(name)
+    if tool is None:
+        raise KeyError(f"MCP server does not expose {name}")
+    # newer MCP server versions take the bucket explicitly
+    fields = getattr(getattr(tool, "args_model", None), "model_fields", {})
+    if "bucket_name" in fields and "bucket_name" not in kwargs:
+        kwargs["bucket_name"] = os.getenv("CB_BUCKET_NAME")
+    result = await tool.arun(**kwargs)
+    error = tool_error(result)
+    if error is not None:
+        raise RuntimeError(error)
+    return decode_tool_result(result)
+
+def parse_scopes_and_collections(payload):
+    """
+    Normalizes the scopes tool output to {scope_name: [collection_name, ...]}.
+    """
+    if isinstance(payload, list) and len(payload) == 1 and isinstance(payload[0], dict):
+        payload = payload[0]
+    scopes = {}
+    if isinstance(payload, dict):
+        for scope, collections in payload.items():
+            if isinstance(collections, dict):
+                collections = list(collections)
+            scopes[scope] = [c["name"] if isinstance(c, dict) else c for c in collections or []]
+    elif isinstance(payload, list):
+        for item in payload:
+            if isinstance(item, dict) and "scope_name" in item:
+                scopes.setdefault(item["scope_name"], []).append(item.get("collection_name") or item.get("name"))
+    else:
+        raise ValueError(f"Unexpected scopes payload: {payload!r}")
+    return scopes
+
+def _clean_property(spec):
+    """
+    Drops INFER bookkeeping keys (`#docs`, `%docs`, `$schema`) from a property spec.
+    """
+    if not isinstance(spec, dict):
+        return spec
+    cleaned = {}
+    for key, value in spec.items():
+        if key.startswith(("#", "%", "$")):
+            continue
+        if key == "properties" and isinstance(value, dict):
+            cleaned[key] = {name: _clean_property(child) for name, child in value.items()}
+        elif key == "items" and isinstance(value, dict):
+            cleaned[key] = _clean_property(value)
+        else:
+            cleaned[key] = value
+    return cleaned
+
+def _flavor_type(flavor, default):
+    type_samples = flavor.get("properties", {}).get("type", {}).get("samples") or []
+    if len(type_samples) == 1:
+        return str(type_samples[0])
+    # `type` as a whole field name, not the tail of e.g. `sample_type`
+    match = re.search(r'(?<![\w`])`?type`?\s*=\s*"([^"]+)"', str(flavor.get("Flavor", "")))
+    return match.group(1) if match else default
+
+def normalize_infer_result(payload, collection_name):
+    """
+    Converts INFER output (a list of flavors) into the `schemas` list of schema_context.json.
+    Flavors that share a document `type` are merged.
+    """
+    flavors = payload
+    while isinstance(flavors, list) and len(flavors) == 1 and isinstance(flavors[0], list):
+        flavors = flavors[0]
+    if isinstance(flavors, dict):
+        flavors = [flavors]
+    schemas = {}
+    for flavor in flavors or []:
+        if not isinstance(flavor, dict):
+            continue
+        doc_type = _flavor_type(flavor, collection_name)
+        properties = {name: _clean_property(spec) for name, spec in flavor.get("properties", {}).items()}
+        schema = schemas.setdefault(doc_type, {"type": doc_type, "properties": {}, "document_count": 0})
+        for name, spec in properties.items():
+            schema["properties"].setdefault(name, spec)
+        schema["document_count"] += flavor.get("#docs", 0)
+    return list(schemas.values())
+
+def write_schema_file(schema_context, path=SCHEMA_FILE):
+    """
+    Writes the schema atomically so a running app never reads a half-written file.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(schema_context, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _key_template(key, doc):
+    """
+    Replaces the first delimited occurrence of each scalar field value in a
+    document key with `{field}`; longer values are matched first.
+    """
+    parts = [key]   # even positions are literal text, odd positions field names
+    values = sorted(
+        ((name, str(value)) for name, value in doc.items()
+         if name != "type" and isinstance(value, (str, int)) and not isinstance(value, bool) and str(value)),
+        key=lambda item: -len(item[1]),
+    )
+    for name, value in values:
+        pattern = re.compile(rf"(?<![A-Za-z0-9]){re.escape(value)}(?![A-Za-z0-9])")
+        for position in range(0, len(parts), 2):
+            match = pattern.search(parts[position])
+            if match:
+                text = parts[position]
+                parts[position:position + 1] = [text[:match.start()], name, text[match.end():]]
+                break
+    template = "".join(part if position % 2 == 0 else f"{{{part}}}" for position, part in enumerate(parts))
+    return template, parts[1::2]
+
+def infer_key_pattern(samples, min_share=0.8):
+    """
+    Derives the key pattern of a document type (e.g. `patient_{id}`) from
+    (key, document) samples; None when keys do not follow one template of
+    document fields.
+    """
+    templates = {}
+    for key, doc in samples:
+        if isinstance(key, str) and isinstance(doc, dict):
+            template, fields = _key_template(key, doc)
+            templates.setdefault((template, tuple(fields)), []).append(key)
+    if not templates:
+        return None
+    (template, fields), keys = max(templates.items(), key=lambda item: len(item[1]))
+    if not fields or len(keys) < min_share * sum(len(k) for k in templates.values()):
+        return None
+    return {"template": template, "fields": list(fields), "examples": keys[:3]}
+
+async def add_key_patterns(tools, scope, collection, schemas, sample_size=KEY_SAMPLE_SIZE):
+    """
+    Samples document keys of every inferred type and stores the derived
+    `key_pattern`, which lets the app fetch documents by key instead of querying.
+    """
+    for schema in schemas:
+        doc_type = schema["type"]
+        where = f"WHERE d.`type` = {json.dumps(doc_type)}" if doc_type != collection else ""
+        rows = await call_mcp_tool(
+            tools, QUERY_TOOL, scope_name=scope,
+            query=f"SELECT META(d).id AS `{KEY_FIELD}`, d AS doc FROM `{collection}` AS d {where} LIMIT {sample_size}",
+        )
+        if isinstance(rows, dict):
+            rows = [rows]
+        pattern = infer_key_pattern([(row.get(KEY_FIELD), row.get("doc")) for row in rows or [] if isinstance(row, dict)])
+        if pattern:
+            schema["key_pattern"] = pattern
+
+def load_schema_file(path=SCHEMA_FILE):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+async def collection_fingerprint(tools, scope, collection, sample_size=FINGERPRINT_SAMPLE_SIZE):
+    """
+    Cheap change detector for one collection: document count, a hash of the
+    field-name sets of a small key-ordered sample (the first keys, so the same
+    documents every run), and the highest CAS in that sample (the most recent
+    mutation it saw). Mutations of documents outside the sample that keep the
+    count unchanged (updates, or a delete plus an insert) are not detected;
+    run a full discovery to pick those up.
+
+    The count comes from the collection statistics and needs no index; the
+    key-ordered sample needs a primary index. Without one the fingerprint is
+    the count alone (`key_set_hash` and `sample_max_cas` are None).
+    """
+    count = await call_mcp_tool(
+        tools, QUERY_TOOL, scope_name=scope,
+        query=f"SELECT RAW COUNT(*) FROM `{collection}`",
+    )
+    if isinstance(count, list):
+        count = count[0] if count else 0
+    try:
+        sample = await call_mcp_tool(
+            tools, QUERY_TOOL, scope_name=scope,
+            query=f"SELECT META(d).cas AS cas, OBJECT_NAMES(d) AS fields FROM `{collection}` AS d "
+                  f"ORDER BY META(d).id LIMIT {sample_size}",
+        )
+    except RuntimeError as e:
+        print(f"⚠️  {scope}.{collection}: fingerprint sample failed, using the document count only ({e})")
+        return {"document_count": count, "key_set_hash": None, "sample_max_cas": None}
+    if isinstance(sample, dict):
+        sample = [sample]
+    key_sets = sorted({",".join(sorted(row.get("fields") or [])) for row in sample or [] if isinstance(row, dict)})
+    return {
+        "document_count": count,
+        "key_set_hash": hashlib.sha1("|".join(key_sets).encode("utf-8")).hexdigest(),
+        "sample_max_cas": max((row.get("cas", 0) for row in sample or [] if isinstance(row, dict)), default=0),
+    }
+
+async def run_direct_discovery(scopes=("_default",), concurrency=8, output=SCHEMA_FILE, incremental=False):
+    """
+    Builds schema_context.json by calling the MCP schema tools directly.
+    Per-collection calls run concurrently, bounded by `concurrency`.
+
+    Every collection's fingerprint is stored next to its schemas. With
+    `incremental`, only collections whose fingerprint changed are re-inferred
+    and the existing file is patched; collections of other scopes are kept.
+    """
+    print("--- Starting Direct Discovery ---")
+
+    mcp_url = os.getenv("MCP_SERVER_URL")
+    if not mcp_url:
+        print("🛑 Error: MCP_SERVER_URL environment variable not set.")
+        return
+
+    started = time.monotonic()
+    previous = load_schema_file(output)
+    client = MCPClient(timeout=120.0)
+    try:
+        print(f"🔗 Connecting to MCP server at {mcp_url}...")
+        await client.connect_sse(server_name="couchbase_mcp", url=mcp_url, headers=None)
+    except Exception as e:
+        print(f"🛑 Failed to connect to MCP Server: {e}")
+        return
+
+    try:
+        tools = {tool.name: tool for tool in client.get_all_tools()}
+        bucket = parse_scopes_and_collections(await call_mcp_tool(tools, SCOPES_TOOL))
+        discovered_scopes = [scope for scope in bucket if scope != SYSTEM_SCOPE and (not scopes or scope in scopes)]
+        targets = [(scope, collection) for scope in discovered_scopes for collection in bucket[scope]]
+        print(f"📚 Found {len(targets)} collections")
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fingerprint(scope, collection):
+            async with semaphore:
+                return await collection_fingerprint(tools, scope, collection)
+
+        async def infer(scope, collection):
+            async with semaphore:
+                payload = await call_mcp_tool(tools, SCHEMA_TOOL, scope_name=scope, collection_name=collection)
+                schemas = normalize_infer_result(payload, collection)
+                try:
+                    await add_key_patterns(tools, scope, collection, schemas)
+                except Exception as e:
+                    print(f"⚠️  {scope}.{collection}: key pattern sampling failed ({e})")
+                return schemas
+
+        fingerprints = await asyncio.gather(*(fingerprint(s, c) for s, c in targets), return_exceptions=True)
+        changed = []
+        for (scope, collection), current in zip(targets, fingerprints):
+            known = previous.get(scope, {}).get(collection, {})
+            if isinstance(current, Exception):
+                # without a fingerprint we cannot prove the collection is unchanged
+                print(f"⚠️  {scope}.{collection}: fingerprint failed ({current})")
+            elif incremental and known.get("fingerprint") == current and "schemas" in known:
+                continue
+            changed.append((scope, collection))
+        print(f"🔍 Inferring {len(changed)} of {len(targets)} collections")
+
+        results = await asyncio.gather(*(infer(s, c) for s, c in changed), return_exceptions=True)
+    finally:
+        await client.close()
+
+    inferred = dict(zip(changed, results))
+    if incremental:
+        schema_context = {scope: dict(collections) for scope, collections in previous.items() if scope not in discovered_scopes}
+    else:
+        schema_context = {}
+    failures = 0
+    for (scope, collection), current in zip(targets, fingerprints):
+        known = previous.get(scope, {}).get(collection)
+        result = inferred.get((scope, collection))
+        if isinstance(result, Exception):
+            failures += 1
+            print(f"⚠️  {scope}.{collection}: {result}")
+            # keep the last known schema rather than dropping the collection
+            if known:
+                schema_context.setdefault(scope, {})[collection] = known
+            continue
+        entry = {"schemas": result if result is not None else known["schemas"]}
+        if not isinstance(current, Exception):
+            entry["fingerprint"] = current
+        schema_context.setdefault(scope, {})[collection] = entry
+
+    if incremental and schema_context == previous:
+        print(f"\n✅ Schema unchanged, {output} left as is ({time.monotonic() - started:.1f}s)")
+        return
+    write_schema_file(schema_context, output)
+    print(f"\n✅ Re-inferred {len(changed) - failures}/{len(changed)} collections ({len(targets)} total), wrote {output} in {time.monotonic() - started:.1f}s")
+
+# --- Local streaming schema inference ---
+
+_JSON_TYPES = {type(None): "null", bool: "boolean", int: "number", float: "number", str: "string", list: "array", dict: "object"}
+
+def _json_type(value):
+    kind = _JSON_TYPES.get(type(value))
+    return kind if kind is not None else type(value).__name__
+
+def _hash64(value):
+    if isinstance(value, (dict, list)):
+        text = json.dumps(value, sort_keys=True, default=str)
+    else:
+        text = f"{_json_type(value)}:{value}"
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+class HyperLogLog:
+    """
+    Fixed-size distinct-count sketch (2**precision one-byte registers).
+    """
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value):
+        h = _hash64(value)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+class FieldStats:
+    """
+    Single-pass statistics for one property path: type union, presence and
+    null rates, an HLL cardinality sketch and a reservoir of sample values.
+    Array elements are tracked by a nested FieldStats (`items`), object
+    members by `properties`.
+    """
+
+    def __init__(self, sample_size, max_fields, rng):
+        self.sample_size = sample_size
+        self.max_fields = max_fields
+        self.rng = rng
+        self.types = {}
+        self.present = 0
+        self.nulls = 0
+        self.hll = HyperLogLog()
+        self.reservoir = []
+        self.seen = 0
+        self._weight = 1.0
+        self._next_sample = 0
+        self.properties = {}
+        self.items = None
+        self.min_items = None
+        self.max_items = None
+
+    def add(self, value):
+        kind = _json_type(value)
+        self.types[kind] = self.types.get(kind, 0) + 1
+        self.present += 1
+        if value is None:
+            self.nulls += 1
+            return
+        if kind == "object":
+            for name, child in value.items():
+                stats = self.properties.get(name)
+                if stats is None:
+                    if len(self.properties) >= self.max_fields:
+                        continue
+                    stats = self.properties[name] = FieldStats(self.sample_size, self.max_fields, self.rng)
+                stats.add(child)
+            return
+        self._sample(value)
+        if kind != "array":
+            self.hll.add(value)
+        else:
+            length = len(value)
+            self.min_items = length if self.min_items is None else min(self.min_items, length)
+            self.max_items = length if self.max_items is None else max(self.max_items, length)
+            if self.items is None:
+                self.items = FieldStats(self.sample_size, self.max_fields, self.rng)
+            for element in value:
+                self.items.add(element)
+
+    def _sample(self, value):
+        # reservoir sampling (algorithm L) keeps memory fixed and skips most values without drawing
+        self.seen += 1
+        if self.seen <= self.sample_size:
+            self.reservoir.append(value)
+            if self.seen == self.sample_size:
+                self._weight = 1.0
+                self._advance()
+        elif self.seen == self._next_sample:
+            self.reservoir[self.rng.randrange(self.sample_size)] = value
+            self._advance()
+
+    def _advance(self):
+        self._weight *= math.exp(math.log(1.0 - self.rng.random()) / self.sample_size)
+        gap = math.floor(math.log(1.0 - self.rng.random()) / math.log(1.0 - self._weight)) if self._weight < 1.0 else 0
+        self._next_sample = self.seen + gap + 1
+
+    def to_schema(self, parent_count):
+        kinds = sorted(self.types, key=lambda kind: -self.types[kind])
+        schema = {"type": kinds[0] if len(kinds) == 1 else kinds}
+        if self.properties:
+            schema["properties"] = {name: stats.to_schema(self.present - self.nulls) for name, stats in self.properties.items()}
+        if self.items is not None:
+            schema["items"] = self.items.to_schema(self.items.present)
+            schema["minItems"] = self.min_items
+            schema["maxItems"] = self.max_items
+        if self.reservoir:
+            samples = {json.dumps(value, sort_keys=True): value for value in self.reservoir}
+            schema["samples"] = [samples[key] for key in sorted(samples)]
+        schema["stats"] = {
+            "present_rate": round(self.present / parent_count, 4) if parent_count else 0.0,
+            "null_rate": round(self.nulls / self.present, 4) if self.present else 0.0,
+        }
+        if any(kind not in ("object", "array", "null") for kind in kinds):
+            schema["stats"]["cardinality"] = self.hll.count()
+        return schema
+
+class StreamingSchemaInference:
+    """
+    Infers schema_context.json schemas from a stream of documents in one pass.
+    Documents are grouped by their `type` field; memory depends on the number
+    of distinct property paths, not on the number of documents. Documents
+    that carry their key in `key_field` also yield a key pattern per type.
+    """
+
+    def __init__(self, sample_size=5, max_fields=1000, seed=0, type_field="type", default_type="unknown", key_field=KEY_FIELD):
+        self.sample_size = sample_size
+        self.max_fields = max_fields
+        self.rng = random.Random(seed)
+        self.type_field = type_field
+        self.default_type = default_type
+        self.key_field = key_field
+        self.by_type = {}
+        self.key_samples = {}
+
+    def add(self, doc):
+        if not isinstance(doc, dict):
+            return
+        key = doc.pop(self.key_field, None) if self.key_field else None
+        doc_type = doc.get(self.type_field)
+        doc_type = str(doc_type) if isinstance(doc_type, (str, int)) else self.default_type
+        stats = self.by_type.get(doc_type)
+        if stats is None:
+            stats = self.by_type[doc_type] = FieldStats(self.sample_size, self.max_fields, self.rng)
+        stats.add(doc)
+        if key is not None:
+            keys = self.key_samples.setdefault(doc_type, [])
+            if len(keys) < KEY_SAMPLE_SIZE:
+                keys.append((key, {name: value for name, value in doc.items() if not isinstance(value, (dict, list))}))
+
+    def consume(self, docs, progress_every=100000):
+        count = 0
+        for doc in docs:
+            self.add(doc)
+            count += 1
+            if progress_every and count % progress_every == 0:
+                print(f"  ... {count} documents processed")
+        return count
+
+    def schemas(self):
+        schemas = []
+        for doc_type, stats in self.by_type.items():
+            schema = {
+                "type": doc_type,
+                "properties": {name: field.to_schema(stats.present) for name, field in stats.properties.items()},
+                "document_count": stats.present,
+            }
+            key_pattern = infer_key_pattern(self.key_samples.get(doc_type, []))
+            if key_pattern:
+                schema["key_pattern"] = key_pattern
+            schemas.append(schema)
+        return schemas
+
+def iter_ndjson(path):
+    """
+    Streams documents from an NDJSON dump (e.g. `cbexport json --format lines`).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def iter_query_documents(scope, collection, batch_size=1000):
+    """
+    Streams every document of a collection through the Couchbase SDK's
+    row iterator, so the result set is never materialised in memory.
+    """
+    from couchbase.auth import PasswordAuthenticator
+    from couchbase.cluster import Cluster
+    from couchbase.options import ClusterOptions, QueryOptions
+
+    auth = PasswordAuthenticator(os.getenv("CB_USERNAME"), os.getenv("CB_PASSWORD"))
+    cluster = Cluster(os.getenv("CB_CONNECTION_STRING", "couchbase://localhost"), ClusterOptions(auth))
+    keyspace = f"`{os.getenv('CB_BUCKET_NAME')}`.`{scope}`.`{collection}`"
+    # the key rides along in KEY_FIELD so key patterns can be inferred
+    result = cluster.query(f"SELECT RAW OBJECT_ADD(d, \"{KEY_FIELD}\", META(d).id) FROM {keyspace} AS d",
+                           QueryOptions(pipeline_batch=batch_size))
+    yield from result.rows()
+
+def run_local_inference(keyspaces, ndjson=None, sample_size=5, output=SCHEMA_FILE):
+    """
+    Builds schema_context.json with the local streaming inference engine,
+    from an NDJSON dump (single keyspace) or by streaming each collection.
+    """
+    print("--- Starting Local Schema Inference ---")
+    started = time.monotonic()
+    schema_context = load_schema_file(output)
+    for scope, collection in keyspaces:
+        engine = StreamingSchemaInference(sample_size=sample_size)
+        source = iter_ndjson(ndjson) if ndjson else iter_query_documents(scope, collection)
+        print(f"📥 Streaming {scope}.{collection} from {ndjson or 'the query service'}...")
+        count = engine.consume(source)
+        schema_context.setdefault(scope, {})[collection] = {"schemas": engine.schemas()}
+        print(f"   {count} documents, {len(engine.by_type)} document types")
+    write_schema_file(schema_context, output)
+    print(f"\n✅ Wrote schema to {output} in {time.monotonic() - started:.1f}s")
+
 # --- נקודת הכניסה להרצת הסקריפט ---
 if __name__ == "__main__":
-    asyncio.run(run_discovery_test())
-# -----------------------------------
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate schema_context.json from the Couchbase MCP server.")
+    parser.add_argument("--mode", choices=["direct", "agent", "local"], default="direct",
+                        help="direct: call the MCP schema tools programmatically; agent: let the LLM agent drive discovery; "
+                             "local: stream documents through the built-in inference engine")
+    parser.add_argument("--scope", action="append", dest="scopes",
+                        help="scope to discover (repeatable, default: _default)")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum concurrent schema inference calls")
+    parser.add_argument("--incremental", action="store_true",
+                        help="direct mode only: re-infer only collections whose fingerprint changed")
+    parser.add_argument("--ndjson", help="local mode only: infer from this NDJSON dump instead of querying")
+    parser.add_argument("--keyspace", action="append", dest="keyspaces",
+                        help="local mode only: scope.collection to infer (repeatable, default: _default._default)")
+    parser.add_argument("--samples", type=int, default=5, help="local mode only: sample values kept per field")
+    args = parser.parse_args()
+
+    if args.mode == "agent":
+        asyncio.run(run_discovery_test())
+    elif args.mode == "local":
+        keyspaces = [tuple(k.split(".", 1)) for k in args.keyspaces or ["_default._default"]]
+        run_local_inference(keyspaces, ndjson=args.ndjson, sample_size=args.samples)
+    else:
+        asyncio.run(run_direct_discovery(scopes=args.scopes or ["_default"], concurrency=args.concurrency,
+                                         incremental=args.incremental))
+# -----------------------------------
\ No newline at end of file
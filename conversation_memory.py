@@ -0,0 +1,184 @@
+"""
+Bounded conversation memory for the agent.
+
+The full chat history of a session is kept in the `conversationstore` Dapr
+state component (`components/conversationmemory.yaml`), but the agent no
+longer sends all of it to the LLM.  `BoundedMemory` wraps the store and hands
+out a compacted history that fits a fixed token budget:
+
+* the current turn is always sent verbatim, so the LLM sees the tool results
+  it is working with;
+* older turns are sent without the schema context their prompt carried, and
+  large tool results are replaced by a short digest (size, row count, hash);
+* turns that still do not fit are folded into a rolling summary: one line per
+  turn with the question and the start of the answer.
+
+The summary is extractive rather than written by the LLM, so compacting never
+costs an extra model call.
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from dapr_agents.memory import ConversationDaprStateMemory, ConversationListMemory, MemoryBase
+from dapr_agents.types import BaseMessage
+
+QUESTION_MARKER = "\n\nQUESTION: "
+SUMMARY_LINE_CHARS = 200
+
+_SHAPED_HEADER_RE = re.compile(r"rows: (\d+).*\ncolumns: \[(.{0,200}?)\]")
+
+
+def estimate_tokens(message: Dict[str, Any]) -> int:
+    """Rough token count of a chat message (about four characters per token)."""
+    text = str(message.get("content") or "") + json.dumps(message.get("tool_calls") or "", default=str)
+    return len(text) // 4 + 4
+
+
+def _as_dict(message: Any) -> Dict[str, Any]:
+    if isinstance(message, BaseMessage):
+        return message.model_dump()
+    return dict(message)
+
+
+def _question(content: str) -> str:
+    """The user's question without the schema context `app.py` prepends to it."""
+    return content.split(QUESTION_MARKER, 1)[1] if QUESTION_MARKER in content else content
+
+
+def digest_tool_result(content: str) -> str:
+    """Short stand-in for a tool result that is too large to send again."""
+    try:
+        rows = json.loads(content)
+    except ValueError:
+        rows = None
+    shape = f"{len(rows)} rows, " if isinstance(rows, list) else ""
+    shaped = _SHAPED_HEADER_RE.match(content)
+    if shaped:
+        # compact encoding of result_shaping.py
+        shape = f"{shaped.group(1)} rows, fields {shaped.group(2)}, "
+    fields = ""
+    if isinstance(rows, list) and rows and isinstance(rows[0], dict):
+        fields = f"fields {', '.join(list(rows[0])[:10])}, "
+    sha = hashlib.sha1(content.encode("utf-8")).hexdigest()[:10]
+    return f"[earlier tool result omitted: {shape}{fields}{len(content)} chars, sha1 {sha}; run the query again if it is needed]"
+
+
+def split_turns(messages: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Groups messages into turns, each starting at a user message (tool calls stay with their results)."""
+    turns: List[List[Dict[str, Any]]] = []
+    for message in messages:
+        if message.get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def compact_turn(turn: List[Dict[str, Any]], tool_result_chars: int) -> List[Dict[str, Any]]:
+    compacted = []
+    for message in turn:
+        content = message.get("content")
+        if isinstance(content, str):
+            if message.get("role") == "user":
+                message = {**message, "content": _question(content)}
+            elif message.get("role") == "tool" and len(content) > tool_result_chars:
+                message = {**message, "content": digest_tool_result(content)}
+        compacted.append(message)
+    return compacted
+
+
+def summary_line(turn: List[Dict[str, Any]]) -> Optional[str]:
+    """`Q: ... -> A: ...` for one turn, from its question and the first line of its final answer."""
+    question = next((_question(str(m.get("content") or "")) for m in turn if m.get("role") == "user"), None)
+    answers = [str(m.get("content")) for m in turn if m.get("role") == "assistant" and m.get("content")]
+    if question is None:
+        return None
+    answer = answers[-1].strip().splitlines()[0] if answers else "(no answer)"
+    return f"- Q: {question.strip()[:SUMMARY_LINE_CHARS]} -> A: {answer[:SUMMARY_LINE_CHARS]}"
+
+
+def compact_history(
+    messages: List[Dict[str, Any]], token_budget: int = 4000, tool_result_chars: int = 1500, summary_tokens: int = 600
+) -> List[Dict[str, Any]]:
+    """The history to send to the LLM: summary of old turns, compacted recent turns, the current turn verbatim."""
+    turns = split_turns(messages)
+    if len(turns) <= 1:
+        return messages
+    current = turns[-1]
+    remaining = token_budget - sum(estimate_tokens(m) for m in current)
+
+    kept: List[List[Dict[str, Any]]] = []
+    older = turns[:-1]
+    while older:
+        turn = compact_turn(older[-1], tool_result_chars)
+        cost = sum(estimate_tokens(m) for m in turn)
+        if cost > remaining - summary_tokens:
+            break
+        kept.insert(0, turn)
+        remaining -= cost
+        older.pop()
+
+    lines: List[str] = []
+    used = 0
+    for position, turn in enumerate(reversed(older)):
+        line = summary_line(turn)
+        if line is None:
+            continue
+        used += len(line) // 4 + 1
+        if used > summary_tokens:
+            lines.insert(0, f"- ({len(older) - position} earlier turns not shown)")
+            break
+        lines.insert(0, line)
+
+    history: List[Dict[str, Any]] = []
+    if lines:
+        history.append({"role": "system", "content": "Summary of the earlier conversation:\n" + "\n".join(lines)})
+    for turn in kept:
+        history.extend(turn)
+    return history + current
+
+
+class BoundedMemory(MemoryBase):
+    """Stores everything in `inner` and returns a history that fits `token_budget`."""
+
+    inner: MemoryBase
+    token_budget: int = 4000
+    tool_result_chars: int = 1500
+    summary_tokens: int = 600
+
+    def add_message(self, message, *args, **kwargs):
+        return self.inner.add_message(message, *args, **kwargs)
+
+    def add_messages(self, messages, *args, **kwargs):
+        return self.inner.add_messages(messages, *args, **kwargs)
+
+    def add_interaction(self, user_message, assistant_message, *args, **kwargs):
+        return self.inner.add_interaction(user_message, assistant_message, *args, **kwargs)
+
+    def get_messages(self, *args, **kwargs) -> List[Dict[str, Any]]:
+        messages = [_as_dict(m) for m in self.inner.get_messages(*args, **kwargs)]
+        return compact_history(messages, self.token_budget, self.tool_result_chars, self.summary_tokens)
+
+    def reset_memory(self, *args, **kwargs):
+        return self.inner.reset_memory(*args, **kwargs)
+
+
+def get_conversation_memory(session_id: str) -> BoundedMemory:
+    """
+    Memory for one chat session: the CONVERSATION_STATE_STORE Dapr state store
+    (in-process list when set to an empty value), bounded by MEMORY_TOKEN_BUDGET.
+    """
+    store_name = os.getenv("CONVERSATION_STATE_STORE", "conversationstore")
+    if store_name:
+        inner = ConversationDaprStateMemory(store_name=store_name, session_id=session_id)
+    else:
+        inner = ConversationListMemory()
+    return BoundedMemory(
+        inner=inner,
+        token_budget=int(os.getenv("MEMORY_TOKEN_BUDGET", "4000")),
+        tool_result_chars=int(os.getenv("MEMORY_TOOL_RESULT_CHARS", "1500")),
+        summary_tokens=int(os.getenv("MEMORY_SUMMARY_TOKENS", "600")),
+    )
@@ -0,0 +1,351 @@
+"""
+Template fast path for recurring questions.
+
+Many questions map exactly onto the shapes of `SAMPLE_QUERIES` (a patient by
+id, a patient's tests or prescriptions, prescriptions of a medicine,
+patients by gender and birth years).  `main()` tries these templates first:
+a regex intent matcher fills the slots, the matching statement runs as a
+named prepared statement with positional parameters (or as a KV get for
+lookups by id), and the rows are rendered directly.  Anything that does not
+match, fails or comes back empty for a free-text slot falls back to the agent.
+"""
+
+import logging
+import os
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from kv_lookup import build_keys, get_kv_store
+from mcp_pool import tool_error
+from query_tools import run_prepared
+from result_pages import markdown_table
+from schema_registry import get_schema_registry
+
+logger = logging.getLogger(__name__)
+
+MAX_RENDERED_ROWS = 20
+# the medicines of the generated test data (tempUtils/generate_test_data1.py)
+DEFAULT_MEDICINES = (
+    "ACAMOL", "ADVIL", "ASPIRIN", "TYLENOL", "IBUPROFEN", "METFORMIN", "LISINOPRIL",
+    "AMLODIPINE", "METOPROLOL", "OMEPRAZOLE", "SIMVASTATIN", "LOSARTAN", "HYDROCHLOROTHIAZIDE",
+    "ATORVASTATIN", "AZITHROMYCIN", "AMOXICILLIN", "PREDNISONE", "GABAPENTIN", "SERTRALINE",
+    "CLOPIDOGREL", "MONTELUKAST", "ROSUVASTATIN", "ESCITALOPRAM", "PANTOPRAZOLE", "WARFARIN",
+)
+
+_PREFIX = (
+    r"^\s*(?:please\s+)?(?:(?:can you\s+|could you\s+)?(?:show|get|find|list|give|display|fetch)(?:\s+me)?\s+"
+    r"|what\s+(?:are|is)\s+)?(?:the\s+|all\s+(?:the\s+)?)?"
+)
+_SUFFIX = r"\s*(?:please)?\s*[?.!]*\s*$"
+_ID = r"(?:id\s+|#\s*|number\s+)?(?P<id>\d{5,12})"
+_YEARS = r"(?:between|from)\s+(?P<start>\d{4})\s+(?:and|to|-)\s+(?P<end>\d{4})"
+_LIMIT_RE = re.compile(r"\bLIMIT\s+(\d+)\s*$", re.IGNORECASE)
+
+
+def _pattern(body: str) -> re.Pattern:
+    return re.compile(_PREFIX + body + _SUFFIX, re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class Template:
+    """One recurring question shape and the statement that answers it."""
+
+    name: str
+    doc_types: Tuple[str, ...]
+    patterns: Tuple[re.Pattern, ...]
+    params: Callable[[Dict[str, str]], Optional[List[Any]]]
+    title: str
+    statement: str = ""          # {doc_type} placeholders become keyspaces; $1.. are parameters
+    kind: str = "rows"           # rows | count | kv
+    fallback_on_empty: bool = False
+
+    @property
+    def limit(self) -> Optional[int]:
+        """The LIMIT the statement ends with, or None."""
+        found = _LIMIT_RE.search(self.statement)
+        return int(found.group(1)) if found else None
+
+
+def known_medicines() -> frozenset:
+    """
+    Upper-cased names the medicine slot accepts: FAST_PATH_MEDICINES (comma
+    separated, default DEFAULT_MEDICINES) plus the `medicine_name` samples of
+    the schema context.
+    """
+    configured = os.getenv("FAST_PATH_MEDICINES")
+    names = {name.strip().upper() for name in configured.split(",")} if configured else set(DEFAULT_MEDICINES)
+    try:
+        snapshot = get_schema_registry().get()
+    except (OSError, ValueError):
+        snapshot = None
+    for entry in snapshot.entries_for_property("medicine_name") if snapshot else ():
+        for path, spec in entry.fields:
+            if path.rsplit(".", 1)[-1] == "medicine_name" and isinstance(spec, Mapping):
+                names.update(str(sample).upper() for sample in spec.get("samples", ()))
+    names.discard("")
+    return frozenset(names)
+
+
+def _medicine(slots: Dict[str, str]) -> Optional[List[Any]]:
+    # a whitelist, so "show me female patients" never reads FEMALE as a medicine
+    medicine = slots["medicine"].upper()
+    return [medicine] if medicine in known_medicines() else None
+
+
+def _gender(value: str) -> str:
+    return {"men": "male", "women": "female"}.get(value.lower(), value.lower())
+
+
+def _years(slots: Dict[str, str]) -> List[Any]:
+    start, end = sorted((int(slots["start"]), int(slots["end"])))
+    params: List[Any] = [start, end]
+    if slots.get("gender"):
+        params.insert(0, _gender(slots["gender"]))
+    return params
+
+
+TEMPLATES: Tuple[Template, ...] = (
+    Template(
+        name="patient_by_id",
+        doc_types=("patient",),
+        patterns=(
+            _pattern(rf"patient\s+(?:with\s+)?{_ID}"),
+            _pattern(rf"(?:details|info(?:rmation)?|record|profile)\s+(?:of|for|about)\s+patient\s+{_ID}"),
+        ),
+        params=lambda slots: [slots["id"]],
+        title="Patient {id}",
+        kind="kv",
+    ),
+    Template(
+        name="patient_tests",
+        doc_types=("test",),
+        patterns=(
+            _pattern(rf"(?:tests?|test results|lab results)\s+(?:of|for)\s+patient\s+{_ID}"),
+            _pattern(rf"patient\s+{_ID}(?:'s|s)?\s+(?:tests?|test results|lab results)"),
+        ),
+        params=lambda slots: [slots["id"]],
+        title="Tests of patient {id}, newest first",
+        statement=(
+            "SELECT t.id, t.test_type, t.result_date, t.results FROM {test} AS t "
+            "WHERE t.`type` = 'test' AND t.patient_id = $1 ORDER BY t.result_date DESC"
+        ),
+    ),
+    Template(
+        name="patient_prescriptions",
+        doc_types=("prescription",),
+        patterns=(
+            _pattern(rf"(?:prescriptions?|medications?|medicines?|drugs)\s+(?:of|for)\s+patient\s+{_ID}"),
+            _pattern(rf"patient\s+{_ID}(?:'s|s)?\s+(?:prescriptions?|medications?|medicines?|drugs)"),
+        ),
+        params=lambda slots: [slots["id"]],
+        title="Prescriptions of patient {id}, newest first",
+        statement=(
+            "SELECT p.medicine_name, p.largo_code, p.quantity, p.valid_from FROM {prescription} AS p "
+            "WHERE p.`type` = 'prescription' AND p.patient_id = $1 ORDER BY p.valid_from DESC"
+        ),
+    ),
+    Template(
+        name="medicine_prescription_count",
+        doc_types=("prescription",),
+        patterns=(
+            re.compile(rf"^\s*how many\s+(?P<medicine>[a-z][\w-]*)\s+(?:prescriptions|users|patients)(?:\s+are there)?{_SUFFIX}", re.IGNORECASE),
+            re.compile(rf"^\s*how many\s+(?:prescriptions|patients|people)\s+(?:for|of|take|use|are (?:prescribed|taking|on))\s+(?P<medicine>[a-z][\w-]*){_SUFFIX}", re.IGNORECASE),
+        ),
+        params=_medicine,
+        title="{medicine} prescriptions",
+        statement=(
+            "SELECT COUNT(*) AS prescriptions, COUNT(DISTINCT p.patient_id) AS patients FROM {prescription} AS p "
+            "WHERE p.`type` = 'prescription' AND p.medicine_name = $1"
+        ),
+        kind="count",
+        fallback_on_empty=True,
+    ),
+    Template(
+        name="medicine_prescriptions",
+        doc_types=("prescription", "patient"),
+        patterns=(
+            _pattern(r"(?:prescriptions|patients)\s+(?:for|of|taking|using|on|prescribed)\s+(?P<medicine>[a-z][\w-]*)"),
+            _pattern(r"(?P<medicine>[a-z][\w-]*)\s+(?:users|prescriptions|patients)"),
+            re.compile(rf"^\s*who\s+(?:is|are)\s+(?:prescribed|taking|using|on)\s+(?P<medicine>[a-z][\w-]*){_SUFFIX}", re.IGNORECASE),
+        ),
+        params=_medicine,
+        title="Patients prescribed {medicine}, newest first",
+        statement=(
+            "SELECT p.patient_id, pt.name, pt.birth_date_year, p.quantity, p.valid_from "
+            "FROM {prescription} AS p JOIN {patient} AS pt ON p.patient_id = pt.id AND pt.`type` = 'patient' "
+            "WHERE p.`type` = 'prescription' AND p.medicine_name = $1 ORDER BY p.valid_from DESC LIMIT 200"
+        ),
+        fallback_on_empty=True,
+    ),
+    Template(
+        name="patients_by_gender_and_years",
+        doc_types=("patient",),
+        patterns=(_pattern(rf"(?P<gender>male|female|men|women)(?:\s+patients)?\s+born\s+{_YEARS}"),),
+        params=_years,
+        title="{gender} patients born {start}-{end}",
+        statement=(
+            "SELECT p.id, p.name, p.birth_date_year FROM {patient} AS p "
+            "WHERE p.`type` = 'patient' AND p.gender = $1 AND p.birth_date_year BETWEEN $2 AND $3 "
+            "ORDER BY p.birth_date_year LIMIT 500"
+        ),
+    ),
+    Template(
+        name="patients_by_years",
+        doc_types=("patient",),
+        patterns=(_pattern(rf"patients\s+born\s+{_YEARS}"),),
+        params=_years,
+        title="Patients born {start}-{end}",
+        statement=(
+            "SELECT p.id, p.name, p.gender, p.birth_date_year FROM {patient} AS p "
+            "WHERE p.`type` = 'patient' AND p.birth_date_year BETWEEN $1 AND $2 "
+            "ORDER BY p.birth_date_year LIMIT 500"
+        ),
+    ),
+    Template(
+        name="patient_count_by_gender_and_years",
+        doc_types=("patient",),
+        patterns=(
+            re.compile(rf"^\s*how many\s+(?P<gender>male|female|men|women)(?:\s+patients)?\s+(?:were\s+|are\s+)?born\s+{_YEARS}{_SUFFIX}", re.IGNORECASE),
+        ),
+        params=_years,
+        title="{gender} patients born {start}-{end}",
+        statement=(
+            "SELECT COUNT(*) AS patients FROM {patient} AS p "
+            "WHERE p.`type` = 'patient' AND p.gender = $1 AND p.birth_date_year BETWEEN $2 AND $3"
+        ),
+        kind="count",
+    ),
+)
+
+
+def render_rows(title: str, rows: Sequence[Dict[str, Any]], limit: Optional[int] = None) -> str:
+    """
+    Markdown table of the first MAX_RENDERED_ROWS rows; `limit` is the LIMIT
+    of the statement, so a result that reached it is shown as incomplete.
+    """
+    if not rows:
+        return f"**{title}**\n\nNo matching documents found."
+    more = "+" if limit is not None and len(rows) >= limit else ""
+    lines = [f"**{title}** ({len(rows)}{more} found)", "", markdown_table(rows[:MAX_RENDERED_ROWS], skip=("type",))]
+    if len(rows) > MAX_RENDERED_ROWS:
+        lines.append(f"\n…and {len(rows) - MAX_RENDERED_ROWS}{more} more.")
+    return "\n".join(lines)
+
+
+class FastPathMetrics:
+    """Hit/miss counters and latency of the fast path."""
+
+    def __init__(self):
+        self.hits: Counter = Counter()
+        self.fallbacks: Counter = Counter()
+        self.misses = 0
+        self.hit_seconds = 0.0
+
+    @property
+    def questions(self) -> int:
+        return sum(self.hits.values()) + sum(self.fallbacks.values()) + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return sum(self.hits.values()) / self.questions if self.questions else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        hits = sum(self.hits.values())
+        return {
+            "questions": self.questions,
+            "hits": hits,
+            "hit_rate": round(self.hit_rate, 4),
+            "mean_hit_ms": round(self.hit_seconds * 1000 / hits, 1) if hits else 0.0,
+            "by_template": dict(self.hits),
+            "fallbacks": dict(self.fallbacks),
+        }
+
+
+class FastPath:
+    """Matches questions against the templates and answers the ones it can."""
+
+    def __init__(self, templates: Sequence[Template] = TEMPLATES):
+        self.templates = templates
+        self.metrics = FastPathMetrics()
+
+    def match(self, question: str) -> Optional[Tuple[Template, Dict[str, str], List[Any]]]:
+        """The first template whose pattern matches the whole question, with its slots and parameters."""
+        for template in self.templates:
+            for pattern in template.patterns:
+                found = pattern.match(question)
+                if not found:
+                    continue
+                slots = {key: value for key, value in found.groupdict().items() if value is not None}
+                params = template.params(slots)
+                if params is not None:
+                    return template, slots, params
+        return None
+
+    async def _execute(self, template: Template, params: List[Any]) -> Optional[list]:
+        snapshot = get_schema_registry().get()
+        if template.kind == "kv":
+            if snapshot.key_pattern(template.doc_types[0]) is None:
+                return None
+            scope, collection, keys = build_keys(snapshot, template.doc_types[0], params)
+            documents = await get_kv_store().get_many(scope, collection, keys)
+            return [doc for doc in documents.values() if doc is not None]
+
+        keyspaces, scopes = {}, set()
+        for doc_type in template.doc_types:
+            entries = snapshot.by_type.get(doc_type)
+            if not entries:
+                return None
+            keyspaces[doc_type] = f"`{entries[0].collection}`"
+            scopes.add(entries[0].scope)
+        if len(scopes) != 1:
+            return None
+        return await run_prepared(scopes.pop(), f"fastpath_{template.name}", template.statement.format(**keyspaces), params)
+
+    async def answer(self, question: str) -> Optional[str]:
+        """The rendered answer, or None when the agent has to handle the question."""
+        matched = self.match(question)
+        if matched is None:
+            self.metrics.misses += 1
+            return None
+        template, slots, params = matched
+        started = time.perf_counter()
+        try:
+            rows = await self._execute(template, params)
+        except Exception as e:
+            logger.warning("Fast path: %s failed, falling back to the agent (%s)", template.name, e)
+            rows = None
+        if rows is not None and not all(isinstance(row, dict) for row in rows):
+            # an error result of the tool (["Error executing tool ..."]) is not rows to render
+            logger.warning("Fast path: %s returned no rows, falling back to the agent (%s)", template.name, tool_error(rows) or rows[:1])
+            rows = None
+        if template.kind == "count" and rows and not any(value for value in rows[0].values()):
+            rows = []
+        if rows is None or (not rows and template.fallback_on_empty):
+            self.metrics.fallbacks[template.name] += 1
+            return None
+
+        elapsed = time.perf_counter() - started
+        self.metrics.hits[template.name] += 1
+        self.metrics.hit_seconds += elapsed
+        logger.debug("Fast path: %s answered in %.0f ms (hit rate %.0f%%)", template.name, elapsed * 1000, self.metrics.hit_rate * 100)
+        title = template.title.format(**{key: value.upper() if key == "medicine" else value for key, value in slots.items()})
+        title = title[:1].upper() + title[1:]
+        if template.kind == "count" and rows:
+            return f"**{title}**: " + ", ".join(f"{value} {key}" for key, value in rows[0].items())
+        return render_rows(title, rows, template.limit)
+
+
+_fast_path: Optional[FastPath] = None
+
+
+def get_fast_path() -> Optional[FastPath]:
+    """Returns the process-wide fast path, or None when FAST_PATH_ENABLED is false."""
+    global _fast_path
+    if os.getenv("FAST_PATH_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    if _fast_path is None:
+        _fast_path = FastPath()
+    return _fast_path
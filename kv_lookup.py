@@ -0,0 +1,180 @@
+"""
+Key-value fast path for direct document lookups.
+
+Documents are stored under deterministic keys (`patient_<id>`, ...) whose
+pattern `cb_discovery.py` records in `schema_context.json`.  The agent tool
+defined here turns ids into keys with that pattern and fetches the documents
+with one batched KV get, skipping the query service (parse, plan, index scan,
+fetch) entirely.  The Couchbase SDK is used when it is installed and
+configured; otherwise the MCP server's get-document tool is called
+concurrently over the shared connection pool.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from dapr_agents import tool
+from pydantic import BaseModel, Field
+
+from mcp_pool import decode_tool_result, get_pool
+from schema_registry import SchemaSnapshot, get_schema_registry
+
+MCP_GET_DOCUMENT_TOOL = "CouchbaseMcpGetDocumentById"
+DEFAULT_SCOPE = "_default"
+DEFAULT_COLLECTION = "_default"
+
+
+def build_keys(snapshot: SchemaSnapshot, doc_type: str, ids: List[str]) -> Tuple[str, str, List[str]]:
+    """Returns (scope, collection, keys) for ids of a document type, using its key pattern."""
+    found = snapshot.key_pattern(doc_type)
+    if found is None:
+        raise ValueError(f"no key pattern is known for document type {doc_type!r}; query it instead")
+    entry, pattern = found
+    fields = list(pattern["fields"])
+    if len(fields) != 1:
+        raise ValueError(
+            f"{doc_type} keys follow {pattern['template']} and need {', '.join(fields)}; pass complete keys instead"
+        )
+    placeholder = f"{{{fields[0]}}}"
+    return entry.scope, entry.collection, [pattern["template"].replace(placeholder, str(value)) for value in ids]
+
+
+class SdkKeyValueStore:
+    """Batched gets through the Couchbase Python SDK (`get_multi`)."""
+
+    def __init__(self, connection_string: str, username: str, password: str, bucket_name: str):
+        self.connection_string = connection_string
+        self.username = username
+        self.password = password
+        self.bucket_name = bucket_name
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    def _get_bucket(self):
+        with self._lock:
+            if self._bucket is None:
+                from couchbase.auth import PasswordAuthenticator
+                from couchbase.cluster import Cluster
+                from couchbase.options import ClusterOptions
+
+                cluster = Cluster(self.connection_string, ClusterOptions(PasswordAuthenticator(self.username, self.password)))
+                self._bucket = cluster.bucket(self.bucket_name)
+            return self._bucket
+
+    def _get_multi(self, scope: str, collection: str, keys: List[str]) -> Dict[str, Any]:
+        result = self._get_bucket().scope(scope).collection(collection).get_multi(keys)
+        # keys that failed (e.g. DocumentNotFound) are only listed in result.exceptions
+        return {key: result.results[key].content_as[dict] if key in result.results else None for key in keys}
+
+    async def get_many(self, scope: str, collection: str, keys: List[str]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._get_multi, scope, collection, keys)
+
+
+class McpKeyValueStore:
+    """Per-key calls to the MCP server's get-document tool, run concurrently over the shared pool."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._extra: Optional[Dict[str, str]] = None
+
+    async def _extra_args(self) -> Dict[str, str]:
+        if self._extra is None:
+            self._extra = {}
+            for agent_tool in await self.pool.get_tools():
+                fields = getattr(getattr(agent_tool, "args_model", None), "model_fields", {})
+                if agent_tool.name == MCP_GET_DOCUMENT_TOOL and "bucket_name" in fields:
+                    # newer MCP server versions take the bucket explicitly
+                    self._extra["bucket_name"] = os.getenv("CB_BUCKET_NAME")
+        return self._extra
+
+    async def get_many(self, scope: str, collection: str, keys: List[str]) -> Dict[str, Any]:
+        extra = await self._extra_args()
+
+        async def get(key: str) -> Any:
+            try:
+                document = decode_tool_result(await self.pool.call_tool(
+                    MCP_GET_DOCUMENT_TOOL, scope_name=scope, collection_name=collection, document_id=key, **extra
+                ))
+            except Exception:
+                return None
+            if isinstance(document, list) and len(document) == 1:
+                # one text block per document: [{...}]
+                document = document[0]
+            # a missing key comes back as an error result, i.e. error text
+            return document if isinstance(document, dict) else None
+
+        documents = await asyncio.gather(*(get(key) for key in keys))
+        return dict(zip(keys, documents))
+
+
+_store = None
+
+
+def get_kv_store():
+    """
+    Returns the process-wide KV store: the SDK when KV_BACKEND is `sdk` (or
+    `auto` with CB_CONNECTION_STRING set and the SDK installed), else MCP.
+    """
+    global _store
+    if _store is None:
+        backend = os.getenv("KV_BACKEND", "auto").lower()
+        if backend == "auto":
+            try:
+                import couchbase  # noqa: F401
+                backend = "sdk" if os.getenv("CB_CONNECTION_STRING") else "mcp"
+            except ImportError:
+                backend = "mcp"
+        if backend == "sdk":
+            _store = SdkKeyValueStore(
+                os.getenv("CB_CONNECTION_STRING", "couchbase://localhost"),
+                os.getenv("CB_USERNAME"),
+                os.getenv("CB_PASSWORD"),
+                os.getenv("CB_BUCKET_NAME"),
+            )
+        else:
+            _store = McpKeyValueStore(get_pool())
+    return _store
+
+
+class GetDocumentsByKeyArgs(BaseModel):
+    keys: List[str] = Field(default_factory=list, description="Complete document keys, e.g. patient_123456789.")
+    doc_type: Optional[str] = Field(None, description="Document type whose key_pattern turns `ids` into keys, e.g. patient.")
+    ids: List[str] = Field(default_factory=list, description="Values of the key field of `doc_type`, e.g. patient ids.")
+    scope_name: Optional[str] = Field(None, description="Scope of `keys` (default _default).")
+    collection_name: Optional[str] = Field(None, description="Collection of `keys` (default _default).")
+
+
+@tool(args_model=GetDocumentsByKeyArgs)
+async def get_documents_by_key(
+    keys: List[str] = (),
+    doc_type: Optional[str] = None,
+    ids: List[str] = (),
+    scope_name: Optional[str] = None,
+    collection_name: Optional[str] = None,
+) -> str:
+    """Fetch documents directly by key, much faster than a query. Use it for lookups by id: pass doc_type and ids (keys are built from the type's key_pattern in the schema context), or complete keys."""
+    keys = list(keys)
+    scope, collection = scope_name or DEFAULT_SCOPE, collection_name or DEFAULT_COLLECTION
+    if ids:
+        if not doc_type:
+            return "Error: doc_type is required when passing ids."
+        try:
+            scope, collection, id_keys = build_keys(get_schema_registry().get(), doc_type, list(ids))
+        except ValueError as e:
+            return f"Error: {e}"
+        keys.extend(id_keys)
+    if not keys:
+        return "Error: pass keys, or doc_type and ids."
+    max_keys = int(os.getenv("KV_MAX_KEYS", "200"))
+    if len(keys) > max_keys:
+        return f"Error: at most {max_keys} keys per call; split the lookup or use a query."
+
+    documents = await get_kv_store().get_many(scope, collection, list(dict.fromkeys(keys)))
+    found = {key: doc for key, doc in documents.items() if doc is not None}
+    return json.dumps(
+        {"documents": found, "missing": [key for key, doc in documents.items() if doc is None]},
+        ensure_ascii=False, default=str,
+    )
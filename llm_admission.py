@@ -0,0 +1,304 @@
+"""
+Process-wide admission control for the LLM behind the agent.
+
+Without it every message starts `agent.run()` at once, so a burst of users is
+a burst against the `openai` conversation component, answered with 429s and
+retries that slow everyone down.  Turns now queue for admission instead:
+
+* two token buckets, requests per minute and LLM tokens per minute, refill
+  continuously; a turn is admitted when both can cover its first call;
+* waiting turns are served short prompts first, and round robin across chat
+  sessions within a priority, so one busy session cannot starve the others;
+* at most LLM_MAX_CONCURRENT_TURNS turns run at once.
+
+`AdmittedDaprChatClient` charges every LLM call of an admitted turn to the
+buckets (the admission reservation covers the first one, the actual token
+usage is charged afterwards) and pauses admissions when the provider still
+answers with a rate-limit error.
+"""
+
+import asyncio
+import os
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional
+
+from dapr_agents.llm.dapr import DaprChatClient
+
+from telemetry import LLM_ADMISSION_WAIT_SECONDS, record_llm_usage, span
+
+SHORT_PRIORITY = 0
+NORMAL_PRIORITY = 1
+RATE_LIMIT_PAUSE_SECONDS = 20
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """Continuously refilled bucket; `take` may go negative so actual usage can be charged after the fact."""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (requests larger than the capacity wait for a full bucket)."""
+        self._refill()
+        needed = min(amount, self.capacity)
+        return max(0.0, (needed - self.tokens) / self.rate) if self.rate > 0 else 0.0
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def drain(self, seconds: float):
+        """Empties the bucket so nothing is admitted for about `seconds`."""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+@dataclass
+class _Waiter:
+    session_id: str
+    tokens: int
+    priority: int
+    future: asyncio.Future
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+# reservation of the turn running in this task: what admission already took from the buckets
+_reservation: ContextVar[Optional[Dict[str, float]]] = ContextVar("llm_reservation", default=None)
+
+
+class AdmissionScheduler:
+    """Fair, rate-limited queue of agent turns."""
+
+    def __init__(
+        self,
+        requests_per_minute: float = 60,
+        tokens_per_minute: float = 90000,
+        max_concurrent_turns: int = 8,
+        short_turn_tokens: int = 500,
+        max_wait: float = 120,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.short_turn_tokens = short_turn_tokens
+        self.max_wait = max_wait
+        self._slots = asyncio.Semaphore(max_concurrent_turns) if max_concurrent_turns > 0 else None
+        # per priority: session id -> that session's waiting turns, in round-robin order
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Waiter]]"] = {SHORT_PRIORITY: OrderedDict(), NORMAL_PRIORITY: OrderedDict()}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.waits: Deque[float] = deque(maxlen=1000)
+        self.stats = Counter()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(not w.future.done() for queue in self._queues.values() for waiters in queue.values() for w in waiters)
+
+    def _head(self) -> Optional[_Waiter]:
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            for session_id in list(queue):
+                waiters = queue[session_id]
+                while waiters and waiters[0].future.done():
+                    waiters.popleft()  # cancelled or timed out while waiting
+                if waiters:
+                    return waiters[0]
+                del queue[session_id]
+        return None
+
+    def _pop(self, waiter: _Waiter):
+        queue = self._queues[waiter.priority]
+        queue[waiter.session_id].popleft()
+        # the session goes to the back of its priority's rotation
+        queue.move_to_end(waiter.session_id)
+        if not queue[waiter.session_id]:
+            del queue[waiter.session_id]
+
+    async def _dispatch(self):
+        while True:
+            if self._head() is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self._slots is not None:
+                await self._slots.acquire()
+            while True:
+                waiter = self._head()
+                if waiter is None:
+                    break
+                delay = max(self.requests.delay(1), self.tokens.delay(waiter.tokens))
+                if delay <= 0:
+                    break
+                # a newly queued, higher-priority turn may become the head meanwhile
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            if waiter is None:
+                if self._slots is not None:
+                    self._slots.release()
+                continue
+            self._pop(waiter)
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            wait = time.monotonic() - waiter.enqueued
+            self.waits.append(wait)
+            LLM_ADMISSION_WAIT_SECONDS.observe(wait, outcome="admitted")
+            self.stats["admitted"] += 1
+            waiter.future.set_result(None)
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    @asynccontextmanager
+    async def admit(self, session_id: str, prompt: str):
+        """Waits until the turn may call the LLM and holds its slot for the duration of the block."""
+        self._ensure_dispatcher()
+        prompt_tokens = estimate_tokens(prompt)
+        priority = SHORT_PRIORITY if prompt_tokens <= self.short_turn_tokens else NORMAL_PRIORITY
+        waiter = _Waiter(session_id, prompt_tokens, priority, asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(session_id, deque()).append(waiter)
+        self.stats["queued"] += 1
+        self._wakeup.set()
+        with span("llm_admission", queue_depth=self.queue_depth, priority=priority):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                if not waiter.future.done():
+                    waiter.future.cancel()
+                    self.stats["timed_out"] += 1
+                    LLM_ADMISSION_WAIT_SECONDS.observe(time.monotonic() - waiter.enqueued, outcome="timed_out")
+                    raise RuntimeError("the assistant is busy right now, please try again in a moment")
+            except asyncio.CancelledError:
+                if not waiter.future.done():
+                    waiter.future.cancel()
+                    raise
+                if self._slots is not None:
+                    self._slots.release()
+                raise
+
+        token = _reservation.set({"requests": 1, "tokens": prompt_tokens})
+        try:
+            yield
+        finally:
+            _reservation.reset(token)
+            if self._slots is not None:
+                self._slots.release()
+            self._wakeup.set()
+
+    def charge(self, tokens: int):
+        """Charges one LLM call; the first call of a turn is covered by its admission reservation."""
+        reservation = _reservation.get()
+        requests = 1
+        if reservation is not None:
+            covered = min(requests, reservation["requests"])
+            reservation["requests"] -= covered
+            requests -= covered
+            covered_tokens = min(tokens, reservation["tokens"])
+            reservation["tokens"] -= covered_tokens
+            tokens -= covered_tokens
+        self.requests.take(requests)
+        self.tokens.take(tokens)
+        self.stats["llm_calls"] += 1
+
+    def rate_limited(self):
+        """The provider refused a call: stop admitting turns for a while instead of piling on."""
+        self.stats["rate_limited"] += 1
+        self.requests.drain(RATE_LIMIT_PAUSE_SECONDS)
+
+    def summary(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+        return {
+            "queue_depth": self.queue_depth,
+            "admitted": self.stats["admitted"],
+            "timed_out": self.stats["timed_out"],
+            "llm_calls": self.stats["llm_calls"],
+            "rate_limited": self.stats["rate_limited"],
+            "wait_p50_s": round(waits[len(waits) // 2], 3) if waits else 0.0,
+            "wait_p95_s": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+            "wait_max_s": round(waits[-1], 3) if waits else 0.0,
+        }
+
+
+_scheduler: Optional[AdmissionScheduler] = None
+
+
+def get_llm_scheduler() -> Optional[AdmissionScheduler]:
+    """Returns the process-wide scheduler, or None when LLM_ADMISSION_ENABLED is false."""
+    global _scheduler
+    if os.getenv("LLM_ADMISSION_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    if _scheduler is None:
+        _scheduler = AdmissionScheduler(
+            requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60")),
+            tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "90000")),
+            max_concurrent_turns=int(os.getenv("LLM_MAX_CONCURRENT_TURNS", "8")),
+            short_turn_tokens=int(os.getenv("LLM_SHORT_TURN_TOKENS", "500")),
+            max_wait=float(os.getenv("LLM_MAX_QUEUE_WAIT", "120")),
+        )
+    return _scheduler
+
+
+@asynccontextmanager
+async def admitted(session_id: str, prompt: str):
+    """`AdmissionScheduler.admit` of the process-wide scheduler; does nothing when admission is disabled."""
+    scheduler = get_llm_scheduler()
+    if scheduler is None:
+        yield
+        return
+    async with scheduler.admit(session_id, prompt):
+        yield
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message or "resource_exhausted" in message
+
+
+def _usage_tokens(response: Any, messages: Any) -> int:
+    """Total tokens of a call as reported by the provider, else estimated from the texts."""
+    metadata = getattr(response, "metadata", None) or {}
+    usage = metadata.get("usage") if isinstance(metadata, dict) else None
+    usage = usage or getattr(response, "usage", None)
+    if isinstance(usage, dict) and usage.get("total_tokens"):
+        return int(usage["total_tokens"])
+    if getattr(usage, "total_tokens", None):
+        return int(usage.total_tokens)
+    return estimate_tokens(str(messages)) + estimate_tokens(str(response))
+
+
+class AdmittedDaprChatClient(DaprChatClient):
+    """DaprChatClient whose calls are charged to (and throttled by) the admission scheduler."""
+
+    def generate(self, messages=None, **kwargs):
+        scheduler = get_llm_scheduler()
+        with span("llm_call", component=self.component_name) as current:
+            try:
+                response = super().generate(messages, **kwargs)
+            except Exception as e:
+                if scheduler is not None and _is_rate_limited(e):
+                    scheduler.rate_limited()
+                raise
+            record_llm_usage(current, response, messages)
+        if scheduler is not None:
+            scheduler.charge(_usage_tokens(response, messages))
+        return response
@@ -0,0 +1,281 @@
+"""
+Process-wide pool of MCP client connections shared by all chat sessions.
+
+Opening an SSE stream and listing the server's tools is the expensive part of
+talking to the Couchbase MCP server, so the app keeps a small, bounded set of
+connections alive and lets every session borrow one per tool call instead of
+owning its own client.  The tool list is fetched once and handed out as proxy
+tools that route each call through the pool.
+
+MCP tools report failures as results flagged `isError` rather than by
+raising, both for errors of the server (a failed query) and, with newer
+dapr-agents versions, for a broken connection; `tool_error` reads such results.
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import re
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dapr_agents.tool.mcp.client import MCPClient
+
+from telemetry import TOOL_CALLS, span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SERVER_NAME = "couchbase_mcp"
+
+# "Error executing tool ...", "ToolError during Tool Call ...", "Error: ..."
+_ERROR_TEXT_RE = re.compile(r"^\s*\w*error\b", re.IGNORECASE)
+# the result the MCP client makes of an exception on its side (the call never got an answer)
+_CLIENT_ERROR_RE = re.compile(r"^\s*\w+ during Tool Call\.")
+
+
+class ToolFeedback(str):
+    """
+    Text a middleware returns to the agent instead of running the tool, e.g.
+    why a query was rejected; it reaches the LLM as the tool result.
+    """
+
+
+def wrap_tool(tool, middleware: Callable[[Dict[str, Any], Callable], Awaitable[Any]]):
+    """
+    Returns a copy of an agent tool whose calls go through `middleware`.
+
+    `middleware(kwargs, call_next)` receives the tool arguments and an async
+    `call_next(kwargs)` that invokes the wrapped tool.  The copy keeps the
+    original name, description and argument model, so the LLM sees the same tool.
+    """
+    inner = tool.func
+
+    async def call_next(kwargs: Dict[str, Any]) -> Any:
+        result = inner(**kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def executor(**kwargs):
+        return await middleware(kwargs, call_next)
+
+    # model_copy keeps the already formatted tool name (re-validating would re-title it)
+    return tool.model_copy(update={"func": executor})
+
+
+def decode_tool_result(result: Any) -> Any:
+    """
+    Turns whatever an MCP tool returned into plain Python data.
+
+    MCP results arrive as text blocks (one JSON document per block for list
+    results), so strings are parsed as JSON when possible and lists of strings
+    are decoded element by element.
+    """
+    if hasattr(result, "content") and not isinstance(result, (str, bytes, dict, list)):
+        result = result.content
+    if isinstance(result, list):
+        return [decode_tool_result(item) for item in result]
+    if hasattr(result, "text") and not isinstance(result, (str, bytes)):
+        result = result.text
+    if isinstance(result, bytes):
+        result = result.decode("utf-8")
+    if isinstance(result, str):
+        text = result.strip()
+        try:
+            return json.loads(text)
+        except ValueError:
+            # several JSON documents separated by newlines
+            lines = [line for line in text.splitlines() if line.strip()]
+            if len(lines) > 1:
+                try:
+                    return [json.loads(line) for line in lines]
+                except ValueError:
+                    pass
+            return result
+    return result
+
+
+def tool_error(result: Any) -> Optional[str]:
+    """
+    The error message of a tool result that reports a failure instead of
+    data, or None.  MCP tools return errors as results flagged `isError`
+    rather than raising; once decoded (or re-encoded as JSON text by a
+    middleware) the flag is gone and only the error text is left, alone or
+    as the single element of a list.
+    """
+    decoded = decode_tool_result(result)
+    if isinstance(decoded, list) and len(decoded) == 1:
+        decoded = decoded[0]
+    if getattr(result, "isError", False) is True:
+        return decoded if isinstance(decoded, str) else json.dumps(decoded, ensure_ascii=False, default=str)
+    if isinstance(decoded, str) and _ERROR_TEXT_RE.match(decoded):
+        return decoded
+    return None
+
+
+def _is_connection_failure(result: Any) -> bool:
+    """True for the error result of a call that failed in the MCP client rather than on the server."""
+    if getattr(result, "isError", False) is not True:
+        return False
+    error = tool_error(result)
+    return error is not None and _CLIENT_ERROR_RE.match(error) is not None
+
+
+class _PooledConnection:
+    """One connected MCPClient plus the tools it exposes."""
+
+    def __init__(self, client: MCPClient):
+        self.client = client
+        self.tools = {tool.name: tool for tool in client.get_all_tools()}
+        self.broken = False
+
+
+class MCPClientPool:
+    """
+    Bounded, lazily initialised pool of SSE connections to one MCP server.
+
+    Connections are only opened when a caller needs one and are reused until
+    a call on them fails in the client (an exception, or the error result the
+    MCP client makes of one); such a connection is dropped and the call is
+    retried once on a fresh connection.  Errors the server reports are
+    returned as they are.
+    """
+
+    def __init__(self, url: str, server_name: str = DEFAULT_SERVER_NAME, size: int = 4, timeout: float = 60.0):
+        self.url = url
+        self.server_name = server_name
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle: List[_PooledConnection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._templates = None
+        self._proxies = None
+        self._tools_lock: Optional[asyncio.Lock] = None
+        self._closed = False
+
+    async def _connect(self) -> _PooledConnection:
+        # persistent: newer dapr-agents versions otherwise open a new session for every call
+        client = MCPClient(timeout=self.timeout, persistent_connections=True)
+        await client.connect_sse(server_name=self.server_name, url=self.url, headers=None)
+        return _PooledConnection(client)
+
+    async def _close_connection(self, conn: _PooledConnection):
+        try:
+            await conn.client.close()
+        except Exception as e:
+            logger.warning("Failed to close MCP connection cleanly: %s", e)
+
+    async def _checkout(self) -> _PooledConnection:
+        if self._idle:
+            return self._idle.pop()
+        return await self._connect()
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Borrows a connection for the duration of the `async with` block."""
+        if self._closed:
+            raise RuntimeError("MCP client pool is closed")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        async with self._slots:
+            conn = await self._checkout()
+            try:
+                yield conn
+            finally:
+                if conn.broken or self._closed:
+                    await self._close_connection(conn)
+                else:
+                    self._idle.append(conn)
+
+    async def call_tool(self, name: str, **kwargs) -> Any:
+        """
+        Calls an MCP tool on a borrowed connection.
+
+        If the call fails in the client (the connection died, e.g. while it
+        was idle), the connection is replaced and the call is retried once.
+        """
+        with span("mcp_tool", tool=name) as current:
+            for attempt in (1, 2):
+                async with self.acquire() as conn:
+                    tool = conn.tools.get(name)
+                    if tool is None:
+                        raise KeyError(f"MCP server does not expose a tool named {name!r}")
+                    try:
+                        result = await tool.arun(**kwargs)
+                    except Exception as e:
+                        conn.broken = True
+                        if attempt == 2:
+                            TOOL_CALLS.inc(tool=name, outcome="error")
+                            raise
+                        logger.warning("MCP call to %s failed, retrying on a new connection: %s", name, e)
+                        current.set(retried=True)
+                        continue
+                    if _is_connection_failure(result):
+                        conn.broken = True
+                        if attempt == 1:
+                            logger.warning("MCP call to %s failed, retrying on a new connection: %s", name, tool_error(result))
+                            current.set(retried=True)
+                            continue
+                    TOOL_CALLS.inc(tool=name, outcome="error" if tool_error(result) is not None else "ok")
+                    return result
+
+    async def get_tools(self) -> list:
+        """
+        Returns the server's tools as pool-backed proxies.
+
+        The tool list is fetched from the first connection and reused for the
+        lifetime of the process.
+        """
+        if self._proxies is not None:
+            return self._proxies
+        if self._tools_lock is None:
+            self._tools_lock = asyncio.Lock()
+        async with self._tools_lock:
+            if self._proxies is None:
+                async with self.acquire() as conn:
+                    self._templates = list(conn.tools.values())
+                self._proxies = [self._proxy(tool) for tool in self._templates]
+        return self._proxies
+
+    def _proxy(self, template):
+        name = template.name
+
+        async def executor(**kwargs):
+            return await self.call_tool(name, **kwargs)
+
+        return template.model_copy(update={"func": executor})
+
+    async def close(self):
+        """Closes idle connections; borrowed ones are closed when returned."""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._close_connection(conn)
+
+
+_pool: Optional[MCPClientPool] = None
+
+
+def get_pool() -> MCPClientPool:
+    """Returns the process-wide pool, creating it from the environment on first use."""
+    global _pool
+    if _pool is None:
+        mcp_url = os.getenv("MCP_SERVER_URL")
+        if not mcp_url:
+            raise RuntimeError("MCP_SERVER_URL environment variable not set.")
+        _pool = MCPClientPool(
+            url=mcp_url,
+            size=int(os.getenv("MCP_POOL_SIZE", "4")),
+            timeout=float(os.getenv("MCP_TIMEOUT", "60")),
+        )
+    return _pool
+
+
+async def close_pool():
+    """Gracefully shuts down the process-wide pool, if one was created."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -0,0 +1,143 @@
+"""
+Named prepared statements for the N1QL the agent and the app run.
+
+Ad-hoc statements are parsed and planned by the query service on every call.
+The cache below parameterises each statement (`workload_log.parameterize_statement`),
+prepares the resulting shape once under a stable name (`cbmcp_<hash>`) and
+runs it with `EXECUTE <name> USING [...]`, so repeated shapes reuse their plan.
+
+Names are kept in a bounded LRU per process; the query service keeps its own
+prepared cache.  When indexes change, `tempUtils/create_indexes.py` deletes
+the `cbmcp_` entries from `system:prepareds`; the next `EXECUTE` then fails
+with "no such prepared statement" and the shape is prepared again against the
+new indexes.  The MCP query tool reports such failures as error results rather
+than by raising, so both are checked.
+"""
+
+import hashlib
+import json
+import os
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple, Union
+
+from mcp_pool import tool_error
+from workload_log import parameterize_statement
+
+PREFIX = "cbmcp_"
+
+_PREPARABLE_RE = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE|MERGE|UPSERT|INSERT)\b", re.IGNORECASE)
+# error 4040, "No such prepared statement: <name>"; a bare "not found" can be a missing document or keyspace
+_MISSING_RE = re.compile(r"\b4040\b|no such prepared", re.IGNORECASE)
+
+
+def statement_name(scope: Optional[str], text: str) -> str:
+    """Stable prepared-statement name of a parameterised statement within a scope."""
+    return PREFIX + hashlib.sha1(f"{scope or ''}\n{text}".encode("utf-8")).hexdigest()[:16]
+
+
+def _is_missing(error: Union[Exception, str]) -> bool:
+    """True when the query service no longer knows the prepared statement (error 4040)."""
+    return _MISSING_RE.search(str(error)) is not None
+
+
+class PreparedStatementCache:
+    """LRU of the statements prepared so far, keyed by (scope, parameterised text)."""
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        # None marks a shape the query service refused to prepare; it runs ad hoc
+        self._names: "OrderedDict[Tuple[Optional[str], str], Optional[str]]" = OrderedDict()
+        self.stats = Counter()
+
+    def _remember(self, key: Tuple[Optional[str], str], name: Optional[str]):
+        self._names[key] = name
+        self._names.move_to_end(key)
+        while len(self._names) > self.capacity:
+            self._names.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def clear(self):
+        self._names.clear()
+
+    async def execute(
+        self,
+        scope: Optional[str],
+        text: str,
+        params: Sequence[Any],
+        run: Callable[[str], Awaitable[Any]],
+        name: Optional[str] = None,
+        fallback: Optional[str] = None,
+    ) -> Any:
+        """
+        Runs `text` (with $1, $2, ... placeholders) as a named prepared
+        statement, preparing it when it is not cached.  `run` executes one
+        statement.  With `fallback` set, a statement that cannot be prepared
+        runs as that ad-hoc statement instead of raising (a PREPARE answered
+        with an error result raises RuntimeError).
+        """
+        key = (scope, text)
+        using = f" USING {json.dumps(list(params), ensure_ascii=False)}" if params else ""
+        if key in self._names:
+            self._names.move_to_end(key)
+            cached = self._names[key]
+            if cached is None:
+                self.stats["ad_hoc"] += 1
+                return await run(fallback)
+            self.stats["hits"] += 1
+            try:
+                result = await run(f"EXECUTE {cached}{using}")
+                missing = _is_missing(tool_error(result) or "")
+            except Exception as e:
+                if not _is_missing(e):
+                    raise
+                missing = True
+            if not missing:
+                return result
+            # dropped by the query service (restart, eviction, index change)
+            self.stats["reprepared"] += 1
+        else:
+            self.stats["misses"] += 1
+
+        name = name or statement_name(scope, text)
+        try:
+            error = tool_error(await run(f"PREPARE {name} FROM {text}"))
+            if error is not None:
+                raise RuntimeError(error)
+        except Exception:
+            if fallback is None:
+                raise
+            self._remember(key, None)
+            self.stats["ad_hoc"] += 1
+            return await run(fallback)
+        self._remember(key, name)
+        return await run(f"EXECUTE {name}{using}")
+
+    async def middleware(self, kwargs: Dict[str, Any], call_next: Callable) -> Any:
+        """Query-tool middleware (see `mcp_pool.wrap_tool`) that runs statements as prepared statements."""
+        statement = kwargs.get("query", "")
+        parameterized = parameterize_statement(statement) if _PREPARABLE_RE.match(statement) else None
+        if parameterized is None:
+            return await call_next(kwargs)
+        text, params = parameterized
+        return await self.execute(
+            kwargs.get("scope_name"), text, params,
+            lambda query: call_next({**kwargs, "query": query}),
+            fallback=statement,
+        )
+
+
+_cache: Optional[PreparedStatementCache] = None
+
+
+def prepared_statements_enabled() -> bool:
+    """False when PREPARED_STATEMENTS_ENABLED turns preparing the agent's statements off."""
+    return os.getenv("PREPARED_STATEMENTS_ENABLED", "true").lower() not in ("0", "false", "no")
+
+
+def get_prepared_cache() -> PreparedStatementCache:
+    """Returns the process-wide cache, sized by PREPARED_CACHE_SIZE."""
+    global _cache
+    if _cache is None:
+        _cache = PreparedStatementCache(int(os.getenv("PREPARED_CACHE_SIZE", "256")))
+    return _cache
@@ -0,0 +1,156 @@
+"""
+Pre-execution cost guard for the N1QL the agent generates.
+
+Before a statement reaches the cluster the guard runs `EXPLAIN` for it
+through the same MCP query tool and inspects the plan.  Primary scans, large
+or unbounded scans without a LIMIT and plans whose optimizer cost exceeds the
+configured threshold are not executed; the agent gets the reason back as the
+tool result so it can regenerate the query.
+"""
+
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from mcp_pool import ToolFeedback, decode_tool_result
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_SCAN_OPERATORS = {"PrimaryScan", "PrimaryScan3"}
+INDEX_SCAN_OPERATORS = {"IndexScan", "IndexScan2", "IndexScan3"}
+GROUP_OPERATORS = {"InitialGroup", "IntermediateGroup", "FinalGroup"}
+
+_GUARDED_RE = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE|MERGE|UPSERT|INSERT)\b", re.IGNORECASE)
+_SELECT_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_LIMIT_RE = re.compile(r"\bLIMIT\s+\S+(\s+OFFSET\s+\S+)?\s*;?\s*$", re.IGNORECASE)
+
+
+def iter_operators(node: Any) -> Iterator[Dict[str, Any]]:
+    """Yields every operator ("#operator") of an EXPLAIN plan, depth first."""
+    if isinstance(node, dict):
+        if "#operator" in node:
+            yield node
+        for value in node.values():
+            yield from iter_operators(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from iter_operators(item)
+
+
+def extract_plan(explain_result: Any) -> Optional[Dict[str, Any]]:
+    """Finds the plan in a decoded EXPLAIN tool result, or None if it holds something else (e.g. an error)."""
+    if isinstance(explain_result, list):
+        explain_result = explain_result[0] if len(explain_result) == 1 else None
+    if isinstance(explain_result, dict):
+        plan = explain_result.get("plan", explain_result)
+        if isinstance(plan, dict) and "#operator" in plan:
+            return plan
+    return None
+
+
+def _is_unbounded(scan: Dict[str, Any]) -> bool:
+    """True when the leading key of an index scan has neither a low nor a high bound."""
+    for span in scan.get("spans") or ():
+        ranges = span.get("range") or ()
+        if not ranges:
+            return True
+        leading = ranges[0]
+        if leading.get("low") in (None, "null") and leading.get("high") is None:
+            return True
+    return False
+
+
+class QueryGuard:
+    """Plan checks applied to every statement before it runs."""
+
+    def __init__(self, max_cost: Optional[float] = None, max_rows: int = 1000, auto_limit: int = 0):
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.auto_limit = auto_limit
+
+    def check(self, statement: str, plan: Dict[str, Any]) -> List[str]:
+        """Returns the reasons the plan must not run; an empty list means it may."""
+        operators = list(iter_operators(plan))
+        names = {op["#operator"] for op in operators}
+        reasons = []
+
+        for op in operators:
+            if op["#operator"] in PRIMARY_SCAN_OPERATORS:
+                keyspace = op.get("as") or op.get("keyspace", "?")
+                joined = " inside a JOIN" if {"NestedLoopJoin", "HashJoin", "Join"} & names else ""
+                reasons.append(
+                    f"it uses a primary scan (full keyspace scan) on `{keyspace}`{joined}; filter on indexed "
+                    f"fields such as `type` plus a selective field, or use USE KEYS"
+                )
+
+        bounded = "Limit" in names or bool(GROUP_OPERATORS & names) or not _SELECT_RE.match(statement)
+        if not bounded:
+            for op in operators:
+                if op["#operator"] not in INDEX_SCAN_OPERATORS:
+                    continue
+                cardinality = (op.get("optimizer_estimates") or {}).get("cardinality")
+                if _is_unbounded(op):
+                    reasons.append(f"it scans index `{op.get('index')}` without bounds and has no LIMIT; add a LIMIT of at most {self.max_rows}")
+                elif cardinality is not None and cardinality > self.max_rows:
+                    reasons.append(f"it is estimated to return about {int(cardinality)} rows and has no LIMIT; add a LIMIT of at most {self.max_rows}")
+
+        if self.max_cost is not None:
+            costs = [(op.get("optimizer_estimates") or {}).get("cost") for op in operators]
+            cost = max((c for c in costs if isinstance(c, (int, float))), default=None)
+            if cost is not None and cost > self.max_cost:
+                reasons.append(f"its estimated cost {cost:.0f} exceeds the limit of {self.max_cost:.0f}; narrow the filters or project fewer fields")
+        return reasons
+
+    def add_limit(self, statement: str) -> Optional[str]:
+        """Returns the statement with the automatic LIMIT appended, or None when that is not possible."""
+        if not self.auto_limit or not _SELECT_RE.match(statement) or _LIMIT_RE.search(statement):
+            return None
+        return f"{statement.strip().rstrip(';')} LIMIT {self.auto_limit}"
+
+    async def middleware(self, kwargs: Dict[str, Any], call_next: Callable) -> Any:
+        """Query-tool middleware (see `mcp_pool.wrap_tool`) that explains the statement before running it."""
+        statement = kwargs.get("query", "")
+        if not _GUARDED_RE.match(statement):
+            return await call_next(kwargs)
+        try:
+            explained = await call_next({**kwargs, "query": f"EXPLAIN {statement.strip().rstrip(';')}"})
+        except Exception:
+            # the statement itself will fail with the more useful error
+            return await call_next(kwargs)
+        plan = extract_plan(decode_tool_result(explained))
+        if plan is None:
+            return await call_next(kwargs)
+
+        reasons = self.check(statement, plan)
+        if reasons and all("has no LIMIT" in reason for reason in reasons):
+            limited = self.add_limit(statement)
+            if limited:
+                logger.info("Query guard: added LIMIT %d to an unbounded query", self.auto_limit)
+                return await call_next({**kwargs, "query": limited})
+        if reasons:
+            logger.warning("Query guard: rejected query (%s)", "; ".join(reasons))
+            return ToolFeedback(
+                "QUERY NOT EXECUTED - rejected by the cost guard because "
+                + "; ".join(reasons)
+                + ". Rewrite the query accordingly and call the tool again."
+            )
+        return await call_next(kwargs)
+
+
+_guard: Optional[QueryGuard] = None
+
+
+def get_query_guard() -> Optional[QueryGuard]:
+    """Returns the process-wide guard, or None when QUERY_GUARD_ENABLED is false."""
+    global _guard
+    if os.getenv("QUERY_GUARD_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    if _guard is None:
+        max_cost = os.getenv("QUERY_GUARD_MAX_COST")
+        _guard = QueryGuard(
+            max_cost=float(max_cost) if max_cost else None,
+            max_rows=int(os.getenv("QUERY_GUARD_MAX_ROWS", "1000")),
+            auto_limit=int(os.getenv("QUERY_GUARD_AUTO_LIMIT", "0")),
+        )
+    return _guard
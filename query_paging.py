@@ -0,0 +1,209 @@
+"""
+Page-by-page execution of the SELECT statements the agent writes.
+
+A result is never fetched whole: the agent's tool call gets the first page,
+and the chat fetches the next ones on demand.  How a statement is paged
+depends on its shape:
+
+* `keyset` - a plain `SELECT ... FROM <keyspace> [alias] [WHERE ...]` is
+  ordered by the document key and each page continues after the last key
+  seen (`WHERE ... AND META(alias).id > "<key>"`), so no page re-reads the
+  rows before it;
+* `ordered` - a statement with its own ORDER BY keeps that order and pages
+  with LIMIT / OFFSET within its own LIMIT / OFFSET;
+* `sorted` - anything else (joins, GROUP BY, UNION, ...) is wrapped, with its
+  own LIMIT / OFFSET, as
+  `SELECT RAW q FROM (<statement>) AS q ORDER BY q LIMIT n OFFSET m`;
+  ordering by the whole row keeps pages from repeating or skipping rows.
+
+Ordered and sorted pages re-run the statement, so they are only planned for
+statements bounded by a literal LIMIT of their own.  Without one every page
+would read (and sort) the whole result, and the LIMIT of the page would hide
+the unbounded scan from the cost guard; such statements run as written.
+The cost guard itself checks the statement as the agent wrote it, before
+its first page runs (see `query_tools.query_middlewares`).
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+PAGE_KEY = "__page_key"
+
+Cursor = Union[None, int, str]
+
+_PAGEABLE_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_TOKEN_RE = re.compile(
+    r"`[^`]*`|'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|[A-Za-z_][\w$]*|\d+(?:\.\d+)?|\S",
+    re.DOTALL,
+)
+_INT_RE = re.compile(r"^\d+$")
+_NAME_RE = re.compile(r"^(`[^`]*`|[A-Za-z_][\w$]*)$")
+_AGGREGATE_RE = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX|ARRAY_AGG|MEAN|MEDIAN|STDDEV|VARIANCE)\s*\(", re.IGNORECASE)
+# top-level words that make a statement more than a single-keyspace filter
+_NOT_KEYSET = {
+    "JOIN", "UNNEST", "NEST", "LET", "LETTING", "GROUP", "HAVING", "ORDER", "LIMIT", "OFFSET", "UNION",
+    "INTERSECT", "EXCEPT", "WITH", "USE", "RAW", "ELEMENT", "VALUE", "DISTINCT", "WINDOW",
+}
+
+
+@dataclass(frozen=True)
+class PagePlan:
+    """How one statement is paged; built by `plan_pages`."""
+
+    statement: str
+    kind: str
+    # keyset: projection, FROM clause, META() expression and WHERE condition of the statement
+    projection: str = ""
+    source: str = ""
+    meta: str = "META()"
+    where: Optional[str] = None
+    # ordered: the statement without its LIMIT / OFFSET; sorted: the whole statement
+    body: str = ""
+    limit: Optional[int] = None
+    offset: int = 0
+
+
+def _top_level(statement: str) -> List[Tuple[str, int, int]]:
+    """
+    (token, start, end) of the tokens outside parentheses, brackets and braces;
+    words are upper-cased, except field names after a dot (`p.order`), which
+    are kept as `.order` so they never read as keywords.
+    """
+    tokens: List[Tuple[str, int, int]] = []
+    depth = 0
+    previous = ""
+    for match in _TOKEN_RE.finditer(statement):
+        text = match.group()
+        if text in "([{":
+            depth += 1
+        elif text in ")]}":
+            depth -= 1
+        elif depth == 0:
+            tokens.append((f".{text}" if previous == "." else text.upper(), match.start(), match.end()))
+        previous = text
+    return tokens
+
+
+def _keyset_plan(statement: str, tokens: List[Tuple[str, int, int]]) -> Optional[PagePlan]:
+    words = [word for word, _, _ in tokens]
+    if words.count("SELECT") != 1 or words[0] != "SELECT" or "FROM" not in words or _NOT_KEYSET & set(words):
+        return None
+    from_index = words.index("FROM")
+    where_index = words.index("WHERE") if "WHERE" in words else len(words)
+    if words.count("WHERE") > 1 or where_index < from_index:
+        return None
+    projection = statement[tokens[0][2]:tokens[from_index][1]].strip()
+    if not projection or _AGGREGATE_RE.search(projection):
+        return None
+    # FROM <keyspace path> [[AS] alias], nothing else
+    source = tokens[from_index + 1:where_index]
+    texts = [statement[start:end] for _, start, end in source]
+    if not texts or not _NAME_RE.match(texts[0]):
+        return None
+    position = 1
+    while position + 1 < len(texts) and texts[position] == "." and _NAME_RE.match(texts[position + 1]):
+        position += 2
+    rest = texts[position:]
+    if rest and rest[0].upper() == "AS":
+        rest = rest[1:]
+    if len(rest) > 1 or (rest and not _NAME_RE.match(rest[0])):
+        return None
+    alias = rest[0] if rest else None
+    source_end = tokens[where_index][1] if where_index < len(tokens) else len(statement)
+    source = statement[tokens[from_index][2]:source_end].strip()
+    where = statement[tokens[where_index][2]:].strip() if where_index < len(tokens) else None
+    return PagePlan(
+        statement=statement,
+        kind="keyset",
+        projection=projection,
+        source=source,
+        meta=f"META({alias})" if alias else "META()",
+        where=where or None,
+    )
+
+
+def plan_pages(statement: str) -> Optional[PagePlan]:
+    """The paging plan of a SELECT / WITH statement, or None when it cannot be paged."""
+    statement = statement.strip().rstrip(";").strip()
+    if not _PAGEABLE_RE.match(statement):
+        return None
+    tokens = _top_level(statement)
+    keyset = _keyset_plan(statement, tokens)
+    if keyset is not None:
+        return keyset
+
+    words = [word for word, _, _ in tokens]
+    limit: Optional[int] = None
+    offset = 0
+    cut = len(statement)
+    # trailing LIMIT / OFFSET (either order) with literal values
+    while len(words) >= 2 and words[-2] in ("LIMIT", "OFFSET"):
+        if not _INT_RE.match(words[-1]):
+            return None
+        if words[-2] == "LIMIT":
+            limit = int(words[-1])
+        else:
+            offset = int(words[-1])
+        cut = tokens[-2][1]
+        tokens, words = tokens[:-2], words[:-2]
+    if "LIMIT" in words or "OFFSET" in words or limit is None:
+        return None
+    if "ORDER" in words:
+        return PagePlan(statement=statement, kind="ordered", body=statement[:cut].strip(), limit=limit, offset=offset)
+    # the statement's own LIMIT / OFFSET stay inside the wrapped query
+    return PagePlan(statement=statement, kind="sorted", body=statement, limit=limit)
+
+
+def page_query(plan: PagePlan, size: int, cursor: Cursor = None) -> Optional[str]:
+    """
+    The statement for the page of at most `size` rows after `cursor` (None: the
+    first page; the last key for keyset plans, the rows already read otherwise).
+    Returns None when the statement's own LIMIT is already used up.
+    """
+    if plan.kind == "keyset":
+        conditions = [f"({plan.where})"] if plan.where else []
+        if cursor is not None:
+            conditions.append(f"{plan.meta}.id > {json.dumps(cursor)}")
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return (
+            f"SELECT {plan.projection}, {plan.meta}.id AS {PAGE_KEY} FROM {plan.source}{where} "
+            f"ORDER BY {plan.meta}.id LIMIT {size}"
+        )
+    read = int(cursor or 0)
+    if plan.limit is not None:
+        size = min(size, plan.limit - read)
+        if size <= 0:
+            return None
+    if plan.kind == "ordered":
+        return f"{plan.body} LIMIT {size} OFFSET {plan.offset + read}"
+    return f"SELECT RAW q FROM ({plan.body}) AS q ORDER BY q LIMIT {size} OFFSET {read}"
+
+
+def count_query(plan: PagePlan) -> str:
+    """The statement counting all rows of a paged statement (one number), for results larger than a page."""
+    if plan.kind == "keyset":
+        where = f" WHERE {plan.where}" if plan.where else ""
+        return f"SELECT RAW COUNT(*) FROM {plan.source}{where}"
+    return f"SELECT RAW COUNT(*) FROM ({plan.statement}) AS q"
+
+
+def split_keys(plan: PagePlan, rows: Sequence[Any]) -> Tuple[List[Any], List[Any]]:
+    """The rows without the page key a keyset query adds, and the keys (empty for other plans)."""
+    if plan.kind != "keyset":
+        return list(rows), []
+    keys = []
+    stripped = []
+    for row in rows:
+        row = dict(row) if isinstance(row, dict) else {"value": row}
+        keys.append(row.pop(PAGE_KEY, None))
+        stripped.append(row)
+    return stripped, keys
+
+
+def cursor_after(plan: PagePlan, cursor: Cursor, keys: Sequence[Any], count: int) -> Cursor:
+    """The cursor of the page that follows `count` rows read from `cursor`."""
+    if plan.kind == "keyset":
+        return keys[count - 1] if count else cursor
+    return int(cursor or 0) + count
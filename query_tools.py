@@ -0,0 +1,201 @@
+"""
+Interception layer between the agent and the MCP query tool.
+
+The agent's tools come from the MCP pool unchanged except for the SQL++ query
+tool, which is wrapped (see `mcp_pool.wrap_tool`) in a chain of middlewares.
+Each middleware receives the tool arguments and the next step of the chain,
+so they can inspect, rewrite, short-circuit or time the query.  Every tool
+also records whether its calls failed, so a turn built on an error is not
+cached as an answer.
+
+`run_query` and `run_prepared` run trusted statements of the app itself
+(not the agent's) on the same pooled tool, without the middlewares.  Agent
+statements and `run_prepared` share one prepared-statement cache
+(`prepared_statements.py`) and one result cache (`result_cache.py`).
+`run_checked` runs statements derived from the agent's (further pages,
+exports) through the middlewares, so they are guarded like the original.
+"""
+
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from mcp_pool import ToolFeedback, decode_tool_result, get_pool, tool_error, wrap_tool
+from prepared_statements import PREFIX, get_prepared_cache, prepared_statements_enabled
+from query_guard import get_query_guard
+from result_cache import cache_key, get_result_cache, statement_types
+from result_shaping import get_result_shaper
+from telemetry import metrics_enabled, n1ql_middleware
+from workload_log import get_workload_log
+
+QUERY_TOOL = "CouchbaseMcpRunSqlPlusPlusQuery"
+
+
+class RecordedStatements(list):
+    """The statements of a `recording_statements` block, and how many tool calls of the block failed."""
+
+    def __init__(self):
+        super().__init__()
+        self.failures = 0
+
+
+_statements: ContextVar[Optional[RecordedStatements]] = ContextVar("agent_statements", default=None)
+
+
+@contextmanager
+def recording_statements() -> Iterator[RecordedStatements]:
+    """Collects the statements the agent issues inside the block (e.g. during one turn)."""
+    statements = RecordedStatements()
+    token = _statements.set(statements)
+    try:
+        yield statements
+    finally:
+        _statements.reset(token)
+
+
+def is_failure(result: Any) -> bool:
+    """
+    True for a tool result that is not data: middleware feedback, or an error
+    result of a tool (flagged `isError`, or its error text, also re-encoded as JSON).
+    """
+    return isinstance(result, ToolFeedback) or tool_error(result) is not None
+
+
+async def record_outcome(kwargs: Dict[str, Any], call_next: Callable) -> Any:
+    """Tool middleware that counts failed calls in the enclosing `recording_statements` block."""
+    statements = _statements.get()
+    try:
+        result = await call_next(kwargs)
+    except Exception:
+        if statements is not None:
+            statements.failures += 1
+        raise
+    if statements is not None and is_failure(result):
+        statements.failures += 1
+    return result
+
+
+async def record_statement(kwargs: Dict[str, Any], call_next: Callable) -> Any:
+    """Query-tool middleware that adds the statement to the enclosing `recording_statements` block."""
+    statements = _statements.get()
+    if statements is not None:
+        statements.append(kwargs.get("query", ""))
+    return await call_next(kwargs)
+
+
+def query_middlewares(agent: bool = True, cached: bool = True) -> List[Callable]:
+    """
+    The configured middlewares, outermost first.  `agent=False` leaves out
+    the statement recording, the workload log and the result shaper (for the
+    pages and exports the app fetches itself), `cached=False` the result cache.
+    """
+    middlewares = []
+    shaper = get_result_shaper()
+    guard = get_query_guard()
+    workload_log = get_workload_log()
+    if agent:
+        middlewares.append(record_statement)
+    if agent and workload_log is not None:
+        # the statement as the agent wrote it, not the pages and counts the shaper runs for it
+        middlewares.append(workload_log.middleware)
+    if agent and guard is not None:
+        # outside the shaper: the guard explains the statement the agent wrote, not its
+        # first page, whose LIMIT would hide an unbounded scan
+        middlewares.append(guard.middleware)
+    if agent and shaper is not None:
+        # results reach the LLM compactly encoded; everything inside works on the raw rows
+        middlewares.append(shaper.middleware)
+    result_cache = get_result_cache()
+    if cached and result_cache is not None:
+        # for the app's own pages and exports, a hit skips the guard's EXPLAIN too
+        middlewares.append(result_cache.middleware)
+    if not agent and guard is not None:
+        middlewares.append(guard.middleware)
+    if prepared_statements_enabled():
+        # innermost, so the guard explains (and may rewrite) the statement as written
+        middlewares.append(get_prepared_cache().middleware)
+    if metrics_enabled():
+        # innermost: times every round trip to the query service (EXPLAIN, PREPARE, EXECUTE) as an n1ql span
+        middlewares.append(n1ql_middleware)
+    return middlewares
+
+
+def chain(middlewares: List[Callable]) -> Callable:
+    """Composes middlewares into one, the first being the outermost."""
+
+    async def run(kwargs, call_next):
+        async def step(index: int, current_kwargs) -> Any:
+            if index == len(middlewares):
+                return await call_next(current_kwargs)
+            return await middlewares[index](current_kwargs, lambda next_kwargs: step(index + 1, next_kwargs))
+
+        return await step(0, kwargs)
+
+    return run
+
+
+def instrument_tools(tools: list) -> list:
+    """
+    Returns the agent's tools with the query tool routed through the
+    middleware chain and the outcome of every call recorded.
+    """
+    middleware = chain([record_outcome] + query_middlewares())
+    return [wrap_tool(tool, middleware if tool.name == QUERY_TOOL else record_outcome) for tool in tools]
+
+
+def as_rows(result: Any) -> list:
+    """Decoded query tool output as a list of rows (one row arrives as a bare object)."""
+    if isinstance(result, list):
+        return result
+    return [] if result is None or result == "" else [result]
+
+
+async def _query_kwargs(scope: str, statement: str) -> Dict[str, Any]:
+    kwargs = {"scope_name": scope, "query": statement}
+    for tool in await get_pool().get_tools():
+        if tool.name == QUERY_TOOL and "bucket_name" in getattr(tool.args_model, "model_fields", {}):
+            # newer MCP server versions take the bucket explicitly
+            kwargs["bucket_name"] = os.getenv("CB_BUCKET_NAME")
+    return kwargs
+
+
+async def run_query(scope: str, statement: str) -> list:
+    """Runs a statement through the pooled MCP query tool and returns the decoded rows."""
+    kwargs = await _query_kwargs(scope, statement)
+    return as_rows(decode_tool_result(await get_pool().call_tool(QUERY_TOOL, **kwargs)))
+
+
+async def run_checked(scope: str, statement: str, cached: bool = True) -> list:
+    """
+    Runs a statement derived from one the agent wrote (a further page, an
+    export) through the same middlewares as the agent's own queries - cost
+    guard, prepared statements and (unless `cached` is false) the result
+    cache - and returns the decoded rows.  Raises RuntimeError
+    with the guard's explanation when the statement is not executed.
+    """
+    kwargs = await _query_kwargs(scope, statement)
+    result = await chain(query_middlewares(agent=False, cached=cached))(
+        kwargs, lambda next_kwargs: get_pool().call_tool(QUERY_TOOL, **next_kwargs)
+    )
+    if isinstance(result, ToolFeedback):
+        raise RuntimeError(str(result))
+    return as_rows(decode_tool_result(result))
+
+
+async def run_prepared(scope: str, name: str, statement: str, params: Sequence[Any] = ()) -> list:
+    """
+    Executes `statement` as the prepared statement `cbmcp_<name>` with
+    positional parameters ($1, $2, ...), preparing it on first use.
+    Results are served from the result cache when it is enabled.
+    """
+
+    async def execute() -> list:
+        return await get_prepared_cache().execute(
+            scope, statement, params, lambda query: run_query(scope, query), name=PREFIX + name
+        )
+
+    result_cache = get_result_cache()
+    if result_cache is None:
+        return await execute()
+    return await result_cache.cached(cache_key(scope, statement, params), statement_types(statement), execute)
@@ -0,0 +1,300 @@
+"""
+Result cache for the N1QL the agent and the fast path run.
+
+Users keep asking the same questions, which become the same statements.
+Results are cached by scope + normalised statement + parameters in a bounded
+in-process LRU (entry count and total size), each with a TTL.  Setting
+QUERY_CACHE_STATE_STORE to a Dapr state store (e.g. the Redis
+`conversationstore`) backs the LRU with that store so replicas share results.
+
+Entries are tagged with the document types their statement filters on
+(`type = "patient"`).  Every type has a generation; a write through the agent
+(or `python result_cache.py <type> [<type> ...]`, `--all` for every type) replaces the generation of
+the types it touches, which invalidates their entries.  Statements without a
+type filter depend on every type.
+
+Only successful results are cached, as decoded rows: the in-process LRU and
+the state store (which round-trips values through JSON) then hand back the
+same data, and error text the tool returned is never replayed.  The
+middleware returns rows to the agent as JSON text, like the tool itself.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional, Sequence
+
+from mcp_pool import ToolFeedback, decode_tool_result, tool_error
+from workload_log import parameterize_statement
+
+ALL_TYPES = "*"
+KEY_PREFIX = "query-cache-"
+GENERATIONS_KEY = KEY_PREFIX + "generations"
+
+_READ_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_WRITE_RE = re.compile(r"^\s*(UPDATE|DELETE|MERGE|UPSERT|INSERT)\b", re.IGNORECASE)
+_TYPE_RE = re.compile(
+    r"(?:^|[\s.(])`?type`?\s*(?:==?\s*(?P<one>\"[^\"]*\"|'[^']*')|IN\s*\[(?P<many>[^\]]*)\])", re.IGNORECASE
+)
+_LITERAL_RE = re.compile(r"\"([^\"]*)\"|'([^']*)'")
+_MISS = object()
+
+
+def statement_types(statement: str) -> FrozenSet[str]:
+    """Document types a statement filters on, or {ALL_TYPES} when it has no type filter."""
+    types = set()
+    for match in _TYPE_RE.finditer(statement):
+        for literal in _LITERAL_RE.finditer(match.group("one") or match.group("many") or ""):
+            types.add(literal.group(1) if literal.group(1) is not None else literal.group(2))
+    return frozenset(types) or frozenset([ALL_TYPES])
+
+
+def cache_key(scope: Optional[str], statement: str, params: Sequence[Any] = ()) -> str:
+    """Key of a statement's result: the same shape with the same values maps to the same key."""
+    parameterized = parameterize_statement(statement)
+    text, values = parameterized if parameterized is not None else (statement.strip(), [])
+    payload = json.dumps([scope or "", text, values + list(params)], ensure_ascii=False, default=str)
+    return KEY_PREFIX + hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class DaprStateStore:
+    """Shared backing store: a Dapr state component, written with a TTL."""
+
+    def __init__(self, store_name: str):
+        self.store_name = store_name
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            from dapr.clients import DaprClient
+
+            self._client = DaprClient()
+        return self._client
+
+    def _get(self, key: str) -> Optional[Any]:
+        data = self._get_client().get_state(self.store_name, key).data
+        return json.loads(data) if data else None
+
+    def _save(self, key: str, value: Any, ttl: Optional[int]):
+        metadata = {"ttlInSeconds": str(ttl)} if ttl else {}
+        self._get_client().save_state(self.store_name, key, json.dumps(value, ensure_ascii=False, default=str), state_metadata=metadata)
+
+    async def get(self, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def save(self, key: str, value: Any, ttl: Optional[int] = None):
+        await asyncio.to_thread(self._save, key, value, ttl)
+
+
+class ResultCache:
+    """Bounded LRU of query results with TTL and per-type invalidation."""
+
+    def __init__(
+        self,
+        ttl: float = 300,
+        max_entries: int = 512,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_result_bytes: int = 1024 * 1024,
+        store: Optional[DaprStateStore] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_result_bytes = max_result_bytes
+        self.store = store
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._generations: Dict[str, str] = {}
+        self.stats = Counter()
+
+    async def current_generations(self) -> Dict[str, str]:
+        """The current generation of every invalidated document type (shared through the state store, if any)."""
+        if self.store is not None:
+            try:
+                self._generations = await self.store.get(GENERATIONS_KEY) or {}
+            except Exception as e:
+                print(f"Warning: could not read query cache generations: {e}")
+        return self._generations
+
+    @staticmethod
+    def _snapshot(types: FrozenSet[str], generations: Dict[str, str]) -> Dict[str, str]:
+        if ALL_TYPES in types:
+            return dict(generations)
+        return {t: generations.get(t, "0") for t in types | {ALL_TYPES}}
+
+    @staticmethod
+    def _is_current(entry: Dict[str, Any], generations: Dict[str, str]) -> bool:
+        if entry["expires"] < time.time():
+            return False
+        if ALL_TYPES in entry["types"]:
+            return entry["generations"] == generations
+        return all(generations.get(t, "0") == g for t, g in entry["generations"].items())
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        self._drop(key)
+        self._entries[key] = entry
+        self._bytes += entry["size"]
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            self.stats["evicted"] += 1
+
+    async def get(self, key: str) -> Any:
+        """The cached result for `key`, or `_MISS`."""
+        generations = await self.current_generations()
+        entry = self._entries.get(key)
+        if entry is None and self.store is not None:
+            try:
+                entry = await self.store.get(key)
+            except Exception as e:
+                print(f"Warning: could not read the query cache: {e}")
+            if entry is not None:
+                entry["types"] = frozenset(entry["types"])
+                entry["size"] = len(json.dumps(entry["value"], ensure_ascii=False, default=str))
+                self._remember(key, entry)
+        if entry is None or not self._is_current(entry, generations):
+            self._drop(key)
+            self.stats["misses"] += 1
+            return _MISS
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry["value"]
+
+    async def put(self, key: str, types: FrozenSet[str], value: Any):
+        size = len(json.dumps(value, ensure_ascii=False, default=str))
+        if size > self.max_result_bytes:
+            self.stats["too_large"] += 1
+            return
+        entry = {
+            "value": value,
+            "types": types,
+            "generations": self._snapshot(types, self._generations),
+            "expires": time.time() + self.ttl,
+            "size": size,
+        }
+        self._remember(key, entry)
+        if self.store is not None:
+            shared = {k: v for k, v in entry.items() if k != "size"}
+            try:
+                await self.store.save(key, {**shared, "types": sorted(types)}, int(self.ttl))
+            except Exception as e:
+                print(f"Warning: could not write the query cache: {e}")
+
+    async def invalidate(self, types: Iterable[str]):
+        """Invalidates the entries of the given document types (ALL_TYPES: every entry)."""
+        generations = dict(await self.current_generations())
+        for doc_type in types:
+            generations[doc_type] = uuid.uuid4().hex[:12]
+        self._generations = generations
+        self.stats["invalidations"] += 1
+        if self.store is not None:
+            await self.store.save(GENERATIONS_KEY, generations)
+
+    def data_version(self, statements: Sequence[str], generations: Dict[str, str]) -> Dict[str, Any]:
+        """
+        The `generations` (see `current_generations`) of the document types
+        `statements` read, or of every type when there are none, for data
+        derived from their results such as an answer of the agent; see `is_current`.
+        """
+        types = frozenset().union(*map(statement_types, statements)) or frozenset([ALL_TYPES])
+        return {"types": sorted(types), "generations": self._snapshot(types, generations)}
+
+    @classmethod
+    def is_current(cls, version: Dict[str, Any], generations: Dict[str, str]) -> bool:
+        """False once a type of a `data_version` has been invalidated since."""
+        entry = {"expires": float("inf"), "types": frozenset(version["types"]), "generations": version["generations"]}
+        return cls._is_current(entry, generations)
+
+    async def cached(self, key: str, types: FrozenSet[str], compute: Callable) -> Any:
+        """
+        Returns the cached rows for `key`, else awaits `compute()` and returns
+        its result decoded; only row results (a list, or one object) are cached.
+        """
+        value = await self.get(key)
+        if value is not _MISS:
+            return value
+        value = await compute()
+        if isinstance(value, ToolFeedback):
+            return value
+        rows = decode_tool_result(value)
+        if not isinstance(rows, (list, dict)) or tool_error(value) is not None:
+            # an error result or error text of the tool (or anything else that is not rows)
+            self.stats["not_cached"] += 1
+            return value
+        await self.put(key, types, rows)
+        return rows
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    async def middleware(self, kwargs: Dict[str, Any], call_next: Callable) -> Any:
+        """Query-tool middleware (see `mcp_pool.wrap_tool`) that answers repeated reads from the cache."""
+        statement = kwargs.get("query", "")
+        if _WRITE_RE.match(statement):
+            result = await call_next(kwargs)
+            await self.invalidate(statement_types(statement))
+            return result
+        if not _READ_RE.match(statement):
+            return await call_next(kwargs)
+        result = await self.cached(
+            cache_key(kwargs.get("scope_name"), statement), statement_types(statement), lambda: call_next(kwargs)
+        )
+        if isinstance(result, (list, dict)):
+            # the agent framework passes tool results on as str(); rows must stay JSON
+            return json.dumps(result, ensure_ascii=False, default=str)
+        return result
+
+
+_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Returns the process-wide cache, or None when QUERY_CACHE_ENABLED is false."""
+    global _cache
+    if os.getenv("QUERY_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    if _cache is None:
+        store_name = os.getenv("QUERY_CACHE_STATE_STORE")
+        _cache = ResultCache(
+            ttl=float(os.getenv("QUERY_CACHE_TTL", "300")),
+            max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "512")),
+            max_bytes=int(os.getenv("QUERY_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+            max_result_bytes=int(os.getenv("QUERY_CACHE_MAX_RESULT_BYTES", str(1024 * 1024))),
+            store=DaprStateStore(store_name) if store_name else None,
+        )
+    return _cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Invalidate cached query results shared through the Dapr state store.")
+    parser.add_argument("types", nargs="*", help="document types whose results are stale (e.g. patient prescription)")
+    parser.add_argument("--all", action="store_true", help="invalidate every cached result")
+    args = parser.parse_args()
+
+    store_name = os.getenv("QUERY_CACHE_STATE_STORE")
+    if not store_name:
+        print("❌ QUERY_CACHE_STATE_STORE is not set; an in-process cache only expires by TTL or restart")
+        return 1
+    if not args.types and not args.all:
+        parser.error("pass document types or --all")
+    types = [ALL_TYPES] if args.all else args.types
+    asyncio.run(ResultCache(store=DaprStateStore(store_name)).invalidate(types))
+    print(f"✅ Invalidated cached results for {', '.join(types)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Paged display and download of large query results in the Chainlit UI.
+
+The agent's query tool fetches only the first page of a SELECT (see
+`result_shaping.py` and `query_paging.py`).  The user gets those rows as a
+table right away, with buttons for the next page and for CSV / NDJSON
+downloads.  Further pages are fetched only when asked for, continuing after
+the last document key shown (or at the next offset of an enforced order), and
+a download reads the result the same way, page by page, writing each page to
+the file before fetching the next.  Both go through the same middlewares as
+the agent's queries, so the cost guard applies to every page too.
+"""
+
+import csv
+import json
+import os
+import tempfile
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+import chainlit as cl
+
+from query_paging import Cursor, PagePlan, cursor_after, page_query, split_keys
+from query_tools import run_checked
+from result_shaping import ShapedResult
+
+MAX_PAGERS_PER_SESSION = 20
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def page_size() -> int:
+    return int(os.getenv("RESULT_PAGE_SIZE", "20"))
+
+
+def export_page_size() -> int:
+    return int(os.getenv("RESULT_EXPORT_PAGE_SIZE", "500"))
+
+
+def cell(value: Any) -> str:
+    """Markdown table cell for a JSON value."""
+    if isinstance(value, list):
+        if all(isinstance(item, dict) and len(item) == 2 for item in value):
+            # e.g. test results: [{"result_id": ..., "result_value": ...}] -> "id=value, ..."
+            return ", ".join("=".join(str(v) for v in item.values()) for item in value)
+        return ", ".join(cell(item) for item in value)
+    if isinstance(value, dict):
+        return ", ".join(f"{key}: {cell(item)}" for key, item in value.items())
+    return "" if value is None else str(value).replace("|", "\\|")
+
+
+def markdown_table(rows: Sequence[Any], skip: Sequence[str] = ()) -> str:
+    """Markdown table of rows; objects get one column per key, other values a single `value` column."""
+    rows = [row if isinstance(row, dict) else {"value": row} for row in rows]
+    columns: List[str] = []
+    for row in rows:
+        columns.extend(column for column in row if column not in columns and column not in skip)
+    lines = ["| " + " | ".join(columns) + " |", "|" + " --- |" * len(columns)]
+    for row in rows:
+        lines.append("| " + " | ".join(cell(row.get(column)) for column in columns) + " |")
+    return "\n".join(lines)
+
+
+async def fetch_page(scope: str, plan: PagePlan, cursor: Cursor, size: Optional[int] = None, cached: bool = True) -> Dict[str, Any]:
+    """The page of rows after `cursor`, whether more follow and the cursor of the next page."""
+    size = size or page_size()
+    statement = page_query(plan, size + 1, cursor)
+    if statement is None:
+        return {"rows": [], "has_more": False, "next": cursor}
+    rows, keys = split_keys(plan, await run_checked(scope, statement, cached=cached))
+    return {"rows": rows[:size], "has_more": len(rows) > size, "next": cursor_after(plan, cursor, keys, min(size, len(rows)))}
+
+
+class _RowWriter:
+    """Writes rows as CSV (columns of the first row) or NDJSON."""
+
+    def __init__(self, f, fmt: str):
+        self.f = f
+        self.fmt = fmt
+        self.writer: Optional[csv.DictWriter] = None
+
+    def write(self, row: Any):
+        if self.fmt == "ndjson":
+            self.f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+            return
+        row = row if isinstance(row, dict) else {"value": row}
+        if self.writer is None:
+            # columns of the first row; later extra keys are dropped from the CSV
+            self.writer = csv.DictWriter(self.f, fieldnames=list(row), extrasaction="ignore")
+            self.writer.writeheader()
+        self.writer.writerow({key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+                              for key, value in row.items()})
+
+
+async def export_result(scope: str, plan: Optional[PagePlan], fmt: str, rows: Sequence[Any] = ()) -> str:
+    """
+    Writes all rows of a result to a temporary CSV or NDJSON file and returns
+    its path.  A paged statement is read `export_page_size()` rows at a time,
+    each page written before the next is fetched, so memory stays at one page
+    whatever the size of the result; without a plan, `rows` are the whole result.
+    """
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}", prefix="query_result_")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            writer = _RowWriter(f, fmt)
+            cursor: Cursor = None
+            page = {"rows": rows, "has_more": plan is not None}
+            while True:
+                for row in page["rows"]:
+                    writer.write(row)
+                if not page["has_more"]:
+                    break
+                # not cached: an export is a one-off and its pages would only crowd out the cache
+                page = await fetch_page(scope, plan, cursor, export_page_size(), cached=False)
+                cursor = page["next"]
+        return path
+    except BaseException:
+        os.remove(path)
+        raise
+
+
+def _pagers() -> Dict[str, Dict[str, Any]]:
+    pagers = cl.user_session.get("result_pagers")
+    if pagers is None:
+        pagers = {}
+        cl.user_session.set("result_pagers", pagers)
+    return pagers
+
+
+async def _send_page(pager_id: str, rows: list, first_row: int, next_page: Optional[Dict[str, Any]]):
+    title = f"**Rows {first_row + 1}–{first_row + len(rows)}**" if rows else "**No more rows**"
+    actions = []
+    if next_page is not None:
+        actions.append(cl.Action(name="result_next_page", payload={"pager": pager_id, **next_page}, label="Next page"))
+    for fmt in EXPORT_FORMATS:
+        actions.append(cl.Action(name="result_download", payload={"pager": pager_id, "format": fmt}, label=f"Download {fmt.upper()}"))
+    content = f"{title}\n\n{markdown_table(rows)}" if rows else title
+    await cl.Message(content=content, actions=actions).send()
+
+
+async def show_result(scope: str, statement: str, result: ShapedResult):
+    """Sends the first page of a query result the agent fetched, with paging and download buttons."""
+    pagers = _pagers()
+    while len(pagers) >= MAX_PAGERS_PER_SESSION:
+        pagers.pop(next(iter(pagers)))
+    pager_id = uuid.uuid4().hex[:12]
+    size = page_size()
+    rows = result.rows[:size]
+    next_page = None
+    if result.plan is None:
+        # not paged (bounded by its own LIMIT): the rows the agent got are the whole result
+        pagers[pager_id] = {"scope": scope, "statement": statement, "rows": result.rows}
+        if len(result.rows) > size:
+            next_page = {"offset": size}
+    else:
+        pagers[pager_id] = {"scope": scope, "statement": statement, "plan": result.plan}
+        if len(result.rows) > size or result.has_more:
+            next_page = {"offset": size, "cursor": cursor_after(result.plan, None, result.keys, len(rows))}
+    await _send_page(pager_id, rows, 0, next_page)
+
+
+@cl.action_callback("result_next_page")
+async def on_next_page(action: cl.Action):
+    pager = _pagers().get(action.payload["pager"])
+    if pager is None:
+        await cl.Message(content="This result is no longer available; ask the question again.").send()
+        return
+    await action.remove()
+    offset = int(action.payload["offset"])
+    size = page_size()
+    if "rows" in pager:
+        rows = pager["rows"][offset:offset + size]
+        next_page = {"offset": offset + size} if len(pager["rows"]) > offset + size else None
+    else:
+        try:
+            page = await fetch_page(pager["scope"], pager["plan"], action.payload.get("cursor"), size)
+        except Exception as e:
+            await cl.Message(content=f"Could not fetch the next page: {e}").send()
+            return
+        rows = page["rows"]
+        next_page = {"offset": offset + len(rows), "cursor": page["next"]} if page["has_more"] else None
+    await _send_page(action.payload["pager"], rows, offset, next_page)
+
+
+@cl.action_callback("result_download")
+async def on_download(action: cl.Action):
+    pager = _pagers().get(action.payload["pager"])
+    fmt = action.payload.get("format")
+    if pager is None or fmt not in EXPORT_FORMATS:
+        await cl.Message(content="This result is no longer available; ask the question again.").send()
+        return
+    try:
+        path = await export_result(pager["scope"], pager.get("plan"), fmt, pager.get("rows", ()))
+    except Exception as e:
+        await cl.Message(content=f"Could not export the result: {e}").send()
+        return
+    try:
+        await cl.Message(
+            content=f"Full result ({fmt.upper()})",
+            elements=[cl.File(name=f"query_result.{fmt}", path=path, mime=EXPORT_FORMATS[fmt], display="inline")],
+        ).send()
+    finally:
+        os.remove(path)
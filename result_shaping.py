@@ -0,0 +1,202 @@
+"""
+Compact encoding of query results before they go back to the LLM.
+
+The MCP query tool returns one JSON object per row, so every row repeats
+every key (and `test` documents repeat the keys of their nested `results`
+too).  The agent only needs enough of a result to answer, so results of
+several rows are re-encoded as:
+
+    rows: 1200 (first 50 shown)
+    columns: ["id","name","gender"]
+    ["1","Dana","F"]
+    ...
+    aggregates: {"gender":{"top":{"F":610,"M":590}}}
+
+Keys are written once per column (nested arrays of objects are encoded the
+same way), long strings are cut, only the first rows are sent, and simple
+aggregates over all rows are computed locally so the LLM does not need the
+rows it was not shown.  The rows stay attached to the result
+(`ShapedResult.rows`) for the UI.
+
+SELECT statements are not fetched whole: the shaper runs only their first
+page (see `query_paging.py`), so time to first row and memory stay at about
+one page.  When more rows exist, the total in the header comes from a
+server-side `COUNT(*)` of the statement, and the aggregates are marked as
+covering the fetched rows only.
+"""
+
+import json
+import os
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from mcp_pool import ToolFeedback, decode_tool_result, tool_error
+from query_paging import PagePlan, count_query, page_query, plan_pages, split_keys
+
+MAX_DISTINCT_FOR_TOP = 10
+
+
+class ShapedResult(str):
+    """
+    The compact text the LLM receives, carrying the decoded rows for display
+    and, for a paged statement, its plan, the page keys and whether more rows exist.
+    """
+
+    rows: List[Any]
+    plan: Optional[PagePlan]
+    keys: List[Any]
+    has_more: bool
+
+    def __new__(cls, text: str, rows: List[Any], plan: Optional[PagePlan] = None, keys: Sequence[Any] = (), has_more: bool = False):
+        shaped = super().__new__(cls, text)
+        shaped.rows = rows
+        shaped.plan = plan
+        shaped.keys = list(keys)
+        shaped.has_more = has_more
+        return shaped
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _columns(rows: List[Dict[str, Any]]) -> List[str]:
+    columns: Dict[str, None] = {}
+    for row in rows:
+        for key in row:
+            columns.setdefault(key, None)
+    return list(columns)
+
+
+def _compact_value(value: Any, max_cell_chars: int) -> Any:
+    if isinstance(value, str) and len(value) > max_cell_chars:
+        return value[:max_cell_chars] + "..."
+    if isinstance(value, list) and len(value) > 1 and all(isinstance(item, dict) for item in value):
+        columns = _columns(value)
+        return {"columns": columns, "rows": [[_compact_value(item.get(c), max_cell_chars) for c in columns] for item in value]}
+    if isinstance(value, list):
+        return [_compact_value(item, max_cell_chars) for item in value]
+    if isinstance(value, dict):
+        return {key: _compact_value(item, max_cell_chars) for key, item in value.items()}
+    return value
+
+
+def aggregates(rows: List[Dict[str, Any]], columns: List[str]) -> Dict[str, Dict[str, Any]]:
+    """min/max/avg of numeric columns and value counts of low-cardinality text columns, over all rows."""
+    result: Dict[str, Dict[str, Any]] = {}
+    for column in columns:
+        values = [row.get(column) for row in rows if row.get(column) is not None]
+        if not values:
+            continue
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            result[column] = {"min": min(values), "max": max(values), "avg": round(sum(values) / len(values), 3)}
+        elif all(isinstance(v, (str, bool)) for v in values):
+            counts = Counter(values)
+            if 1 < len(counts) <= MAX_DISTINCT_FOR_TOP:
+                result[column] = {"top": dict(counts.most_common())}
+    return result
+
+
+def encode_rows(
+    rows: List[Any], max_rows: int = 50, max_cell_chars: int = 200, has_more: bool = False, total: Optional[int] = None
+) -> str:
+    """
+    Columnar text encoding of rows for the LLM (values that are not objects
+    form a `value` column).  `has_more` marks rows that are only the first
+    page of a larger result of `total` rows (None: unknown).
+    """
+    rows = [row if isinstance(row, dict) else {"value": row} for row in rows]
+    columns = _columns(rows)
+    shown = rows[:max_rows]
+    if has_more and total is not None:
+        header = f"rows: {total} (only the first {len(rows)} were fetched)"
+    elif has_more:
+        header = f"rows: {len(rows)}+ (only the first {len(rows)} were fetched; more rows exist)"
+    else:
+        header = f"rows: {len(rows)}" + (f" (first {len(shown)} shown)" if len(shown) < len(rows) else "")
+    lines = [header, "columns: " + _dumps(columns)]
+    lines.extend(_dumps([_compact_value(row.get(c), max_cell_chars) for c in columns]) for row in shown)
+    if len(rows) > 1:
+        summary = aggregates(rows, columns)
+        if summary:
+            label = f"aggregates of the first {len(rows)} rows only: " if has_more else "aggregates: "
+            lines.append(label + _dumps(summary))
+    return "\n".join(lines)
+
+
+class ResultShaper:
+    """Query-tool middleware that re-encodes multi-row results compactly."""
+
+    def __init__(self, max_rows: int = 50, max_cell_chars: int = 200):
+        self.max_rows = max_rows
+        self.max_cell_chars = max_cell_chars
+
+    def shape(self, result: Any, plan: Optional[PagePlan] = None) -> Any:
+        """
+        The result for the LLM; with a `plan`, `result` is the first page of
+        the statement, fetched with one row more than is kept to learn whether
+        more rows exist.
+        """
+        if isinstance(result, ToolFeedback) or tool_error(result) is not None:
+            # passed on as is, so the error still reads as one
+            return result
+        rows = decode_tool_result(result)
+        if plan is None:
+            if not isinstance(rows, list) or len(rows) < 2 or not all(isinstance(row, dict) for row in rows):
+                # single values and aggregates are already small
+                return result
+            return ShapedResult(encode_rows(rows, self.max_rows, self.max_cell_chars), rows)
+        if not isinstance(rows, list):
+            rows = [] if rows is None or rows == "" else [rows]
+        rows, keys = split_keys(plan, rows)
+        has_more = len(rows) > self.max_rows
+        rows, keys = rows[:self.max_rows], keys[:self.max_rows]
+        if not has_more and (len(rows) < 2 or not all(isinstance(row, dict) for row in rows)):
+            return _dumps(rows)
+        return ShapedResult(encode_rows(rows, self.max_rows, self.max_cell_chars, has_more), rows, plan, keys, has_more)
+
+    async def middleware(self, kwargs: Dict[str, Any], call_next: Callable) -> Any:
+        """Query-tool middleware (see `mcp_pool.wrap_tool`) that runs SELECTs as their first page."""
+        plan = plan_pages(kwargs.get("query", ""))
+        if plan is not None and plan.limit is not None and plan.limit <= self.max_rows:
+            # already bounded to one page by its own LIMIT: runs as written
+            plan = None
+        if plan is None:
+            return self.shape(await call_next(kwargs))
+        first_page = page_query(plan, self.max_rows + 1)
+        shaped = self.shape(await call_next({**kwargs, "query": first_page}), plan)
+        if isinstance(shaped, ShapedResult) and shaped.has_more:
+            total = await self.count(plan, kwargs, call_next)
+            if total is not None:
+                text = encode_rows(shaped.rows, self.max_rows, self.max_cell_chars, True, total)
+                shaped = ShapedResult(text, shaped.rows, plan, shaped.keys, True)
+        return shaped
+
+    async def count(self, plan: PagePlan, kwargs: Dict[str, Any], call_next: Callable) -> Optional[int]:
+        """The number of rows of the whole statement, or None when the count is refused or fails."""
+        try:
+            counted = decode_tool_result(await call_next({**kwargs, "query": count_query(plan)}))
+        except Exception:
+            return None
+        if isinstance(counted, list) and len(counted) == 1:
+            counted = counted[0]
+        if isinstance(counted, dict) and len(counted) == 1:
+            # a count that came back as {"$1": n}
+            counted = next(iter(counted.values()))
+        return counted if isinstance(counted, int) and not isinstance(counted, bool) else None
+
+
+_shaper: Optional[ResultShaper] = None
+
+
+def get_result_shaper() -> Optional[ResultShaper]:
+    """Returns the process-wide shaper, or None when RESULT_SHAPING_ENABLED is false."""
+    global _shaper
+    if os.getenv("RESULT_SHAPING_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    if _shaper is None:
+        _shaper = ResultShaper(
+            max_rows=int(os.getenv("RESULT_MAX_ROWS", "50")),
+            max_cell_chars=int(os.getenv("RESULT_MAX_CELL_CHARS", "200")),
+        )
+    return _shaper
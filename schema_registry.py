@@ -0,0 +1,200 @@
+"""
+Process-wide registry for the Couchbase schema produced by cb_discovery.py.
+
+`schema_context.json` is parsed once per process into a read-only snapshot
+that every chat session shares.  The snapshot indexes the schema by scope,
+collection, document `type` and property path, and the registry swaps in a new
+snapshot only when the file on disk actually changes.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+DEFAULT_SCHEMA_PATH = "schema_context.json"
+
+
+def freeze(value: Any) -> Any:
+    """Returns a read-only deep copy of parsed JSON (dicts become mapping proxies, lists tuples)."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def to_json(value: Any, **kwargs) -> str:
+    """Serialises frozen schema data back to JSON."""
+    return json.dumps(value, default=dict, ensure_ascii=False, **kwargs)
+
+
+def flatten_properties(properties: Mapping[str, Any], prefix: str = "") -> List[Tuple[str, Mapping[str, Any]]]:
+    """
+    Lists every property of a schema as (path, spec) pairs.
+
+    Nested objects use dotted paths and array items use `[]`, so the test
+    results array yields `results`, `results[].result_id` and `results[].result_value`.
+    """
+    fields = []
+    for name, spec in properties.items():
+        path = f"{prefix}{name}"
+        fields.append((path, spec))
+        if not isinstance(spec, Mapping):
+            continue
+        if isinstance(spec.get("properties"), Mapping):
+            fields.extend(flatten_properties(spec["properties"], prefix=f"{path}."))
+        items = spec.get("items")
+        if isinstance(items, Mapping) and isinstance(items.get("properties"), Mapping):
+            fields.extend(flatten_properties(items["properties"], prefix=f"{path}[]."))
+    return fields
+
+
+@dataclass(frozen=True)
+class SchemaEntry:
+    """One document type found in one collection."""
+
+    scope: str
+    collection: str
+    doc_type: str
+    properties: Mapping[str, Any]
+    document_count: Optional[int]
+    fields: Tuple[Tuple[str, Mapping[str, Any]], ...]
+    key_pattern: Optional[Mapping[str, Any]] = None
+
+    @property
+    def keyspace(self) -> Tuple[str, str]:
+        return (self.scope, self.collection)
+
+
+class SchemaSnapshot:
+    """An immutable, indexed view of one version of `schema_context.json`."""
+
+    def __init__(self, path: str, text: str, mtime: float, digest: str):
+        self.path = path
+        self.text = text
+        self.mtime = mtime
+        self.digest = digest
+        self.data = freeze(json.loads(text))
+        self.entries = tuple(self._entries())
+
+        by_scope: Dict[str, list] = {}
+        by_collection: Dict[Tuple[str, str], list] = {}
+        by_type: Dict[str, list] = {}
+        by_property: Dict[str, list] = {}
+        for entry in self.entries:
+            by_scope.setdefault(entry.scope, []).append(entry)
+            by_collection.setdefault(entry.keyspace, []).append(entry)
+            by_type.setdefault(entry.doc_type, []).append(entry)
+            names = set()
+            for field_path, _ in entry.fields:
+                names.add(field_path)
+                names.add(field_path.rsplit(".", 1)[-1])
+            for name in names:
+                by_property.setdefault(name, []).append(entry)
+
+        def index(groups):
+            return MappingProxyType({key: tuple(items) for key, items in groups.items()})
+
+        self.by_scope = index(by_scope)
+        self.by_collection = index(by_collection)
+        self.by_type = index(by_type)
+        self.by_property = index(by_property)
+
+    def _entries(self):
+        for scope, collections in self.data.items():
+            if not isinstance(collections, Mapping):
+                continue
+            for collection, details in collections.items():
+                if not isinstance(details, Mapping):
+                    continue
+                for schema in details.get("schemas", ()):
+                    properties = schema.get("properties", MappingProxyType({}))
+                    yield SchemaEntry(
+                        scope=scope,
+                        collection=collection,
+                        doc_type=str(schema.get("type", collection)),
+                        properties=properties,
+                        document_count=schema.get("document_count"),
+                        fields=tuple(flatten_properties(properties)),
+                        key_pattern=schema.get("key_pattern"),
+                    )
+
+    def key_pattern(self, doc_type: str) -> Optional[Tuple[SchemaEntry, Mapping[str, Any]]]:
+        """The first entry of a document type that has a key pattern, with that pattern."""
+        for entry in self.by_type.get(doc_type, ()):
+            if entry.key_pattern:
+                return entry, entry.key_pattern
+        return None
+
+    def entries_for_property(self, name: str) -> Tuple[SchemaEntry, ...]:
+        """Document types that have a property with this path or leaf name."""
+        return self.by_property.get(name, ())
+
+
+class SchemaRegistry:
+    """
+    Loads `schema_context.json` lazily and hot-reloads it when it changes.
+
+    The file is stat'ed at most once per `check_interval` seconds; a changed
+    mtime or size triggers a re-read, and a new snapshot is only built (and
+    swapped in atomically) when the content hash differs from the current one.
+    """
+
+    def __init__(self, path: str = DEFAULT_SCHEMA_PATH, check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot: Optional[SchemaSnapshot] = None
+        self._stat: Optional[Tuple[float, int]] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> SchemaSnapshot:
+        """Returns the current snapshot, raising FileNotFoundError if the file was never generated."""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snapshot
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                if self._snapshot is None:
+                    raise
+                # keep serving the last good schema while the file is being replaced
+                return self._snapshot
+            signature = (stat.st_mtime, stat.st_size)
+            if self._snapshot is None or signature != self._stat:
+                self._reload(signature)
+            return self._snapshot
+
+    def _reload(self, signature: Tuple[float, int]):
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        self._stat = signature
+        if self._snapshot is not None and self._snapshot.digest == digest:
+            return
+        try:
+            snapshot = SchemaSnapshot(self.path, raw.decode("utf-8"), signature[0], digest)
+        except ValueError as e:
+            if self._snapshot is None:
+                raise
+            print(f"Warning: ignoring unreadable {self.path}: {e}")
+            return
+        self._snapshot = snapshot
+
+
+_registry: Optional[SchemaRegistry] = None
+
+
+def get_schema_registry() -> SchemaRegistry:
+    """Returns the process-wide registry for the configured schema file."""
+    global _registry
+    if _registry is None:
+        _registry = SchemaRegistry(os.getenv("SCHEMA_CONTEXT_PATH", DEFAULT_SCHEMA_PATH))
+    return _registry
@@ -0,0 +1,200 @@
+"""
+Local schema retrieval for prompt construction.
+
+Instead of shipping the whole of `schema_context.json` with every question,
+the app scores each document type and each field against the question with
+BM25 over type names, property paths and sample values, and injects only the
+best matches that fit in a token budget.  Everything runs in-process; no
+embedding model or network call is involved.
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from schema_registry import SchemaEntry, SchemaSnapshot
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_MAX_SAMPLE_TOKENS = 50
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cases, splits on anything that isn't a letter or digit and strips plural endings."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if len(token) > 4 and token.endswith("ies"):
+            token = token[:-3] + "y"
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (about four characters per token for JSON-ish text)."""
+    return (len(text) + 3) // 4
+
+
+def _sample_tokens(spec: Any) -> List[str]:
+    if not hasattr(spec, "get"):
+        return []
+    samples = spec.get("samples") or ()
+    text = " ".join(json.dumps(sample, default=dict) if not isinstance(sample, str) else sample for sample in samples)
+    return tokenize(text)[:_MAX_SAMPLE_TOKENS]
+
+
+def _key_pattern(entry: SchemaEntry) -> Dict[str, str]:
+    return {"key_pattern": entry.key_pattern["template"]} if entry.key_pattern else {}
+
+
+class BM25:
+    """Okapi BM25 over a fixed list of tokenised documents."""
+
+    def __init__(self, documents: Sequence[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(doc) for doc in documents]
+        self.lengths = [len(doc) for doc in documents]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        doc_freq = Counter()
+        for freqs in self.term_freqs:
+            doc_freq.update(freqs.keys())
+        count = len(documents)
+        self.idf = {term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def scores(self, query: List[str]) -> List[float]:
+        terms = [term for term in set(query) if term in self.idf]
+        results = []
+        for freqs, length in zip(self.term_freqs, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length) if self.avg_length else self.k1
+            for term in terms:
+                tf = freqs.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            results.append(score)
+        return results
+
+
+class SchemaRetriever:
+    """Ranks the document types and fields of one schema snapshot against a question."""
+
+    def __init__(self, snapshot: SchemaSnapshot, top_k: int = 3, token_budget: int = 800, max_samples: int = 3):
+        self.snapshot = snapshot
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.max_samples = max_samples
+        self.entries = snapshot.entries
+
+        type_docs = []
+        self.field_index: List[BM25] = []
+        for entry in self.entries:
+            # the type and keyspace names are repeated so a direct mention outweighs a sample value hit
+            name_tokens = tokenize(f"{entry.doc_type} {entry.collection}") * 3
+            field_docs = [tokenize(path) + _sample_tokens(spec) for path, spec in entry.fields]
+            type_docs.append(name_tokens + [token for doc in field_docs for token in doc])
+            self.field_index.append(BM25(field_docs))
+        self.type_index = BM25(type_docs)
+
+    def rank(self, question: str) -> List[Tuple[SchemaEntry, float, List[Tuple[str, float]]]]:
+        """Returns up to `top_k` matching document types, each with its fields ranked by relevance."""
+        query = tokenize(question)
+        ranked = sorted(zip(self.entries, self.type_index.scores(query), self.field_index), key=lambda item: -item[1])
+        results = []
+        for entry, score, field_index in ranked[: self.top_k]:
+            if score <= 0:
+                break
+            field_scores = field_index.scores(query)
+            fields = sorted(
+                ((path, field_score) for (path, _), field_score in zip(entry.fields, field_scores)),
+                key=lambda item: -item[1],
+            )
+            results.append((entry, score, fields))
+        return results
+
+    def _field_summary(self, spec: Any) -> Dict[str, Any]:
+        summary = {"type": spec.get("type")}
+        items = spec.get("items")
+        if hasattr(items, "get") and items.get("properties"):
+            # nested fields are listed separately, so skip the bulky array samples
+            summary["items"] = "object"
+        elif spec.get("samples"):
+            summary["samples"] = list(spec["samples"][: self.max_samples])
+        return summary
+
+    def render(self, question: str) -> str:
+        """
+        Builds the schema block for a question within the token budget.
+
+        Matching types get their matching fields first and then the rest of
+        their fields while the budget allows; when nothing matches, only the
+        type names and field paths are listed.
+        """
+        ranked = self.rank(question)
+        if not ranked:
+            overview = [
+                {
+                    "keyspace": f"{entry.scope}.{entry.collection}",
+                    "type": entry.doc_type,
+                    **_key_pattern(entry),
+                    "fields": [path for path, _ in entry.fields],
+                }
+                for entry in self.entries
+            ]
+            return self._trim(overview)
+
+        blocks = []
+        for entry, _, fields in ranked:
+            blocks.append({
+                "keyspace": f"{entry.scope}.{entry.collection}",
+                "type": entry.doc_type,
+                **_key_pattern(entry),
+                "document_count": entry.document_count,
+                "fields": {},
+            })
+        specs = [dict(entry.fields) for entry, _, _ in ranked]
+        used = estimate_tokens(json.dumps(blocks, default=dict))
+
+        # fill matched fields across all types before unmatched ones
+        queue = []
+        for position, (_, _, fields) in enumerate(ranked):
+            for rank, (path, score) in enumerate(fields):
+                queue.append((score <= 0, rank, position, path))
+        for _, _, position, path in sorted(queue):
+            field_json = json.dumps({path: self._field_summary(specs[position][path])}, default=dict)
+            cost = estimate_tokens(field_json)
+            if used + cost > self.token_budget:
+                continue
+            blocks[position]["fields"][path] = self._field_summary(specs[position][path])
+            used += cost
+        return json.dumps(blocks, default=dict, ensure_ascii=False)
+
+    def _trim(self, overview: List[Dict[str, Any]]) -> str:
+        while overview:
+            text = json.dumps(overview, ensure_ascii=False)
+            if estimate_tokens(text) <= self.token_budget:
+                return text
+            widest = max(overview, key=lambda block: len(block["fields"]))
+            if not widest["fields"]:
+                overview.pop()
+            else:
+                widest["fields"].pop()
+        return ""
+
+
+_retriever: Optional[SchemaRetriever] = None
+
+
+def get_schema_retriever(snapshot: SchemaSnapshot) -> SchemaRetriever:
+    """Returns the retriever for a snapshot, rebuilding it only when the schema changed."""
+    global _retriever
+    if _retriever is None or _retriever.snapshot.digest != snapshot.digest:
+        _retriever = SchemaRetriever(
+            snapshot,
+            top_k=int(os.getenv("SCHEMA_TOP_K", "3")),
+            token_budget=int(os.getenv("SCHEMA_TOKEN_BUDGET", "800")),
+        )
+    return _retriever
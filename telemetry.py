@@ -0,0 +1,399 @@
+"""
+Per-turn tracing and metrics.
+
+Every stage of a chat turn runs inside `span(stage)`:
+
+* `turn` - the whole message, with the path that answered it (`fast_path`,
+  `answer_cache`, `agent` or `error`);
+* `fast_path`, `schema_lookup`, `answer_cache`, `schema_retrieval`,
+  `agent_run` and `ui_send`;
+* `llm_admission` and `llm_call` (with prompt / completion token counts);
+* `mcp_tool` for every MCP tool call, and `n1ql` for every statement the
+  agent runs (wall time; the MCP query tool returns rows only, without the
+  query service's metrics).  Spans carry the normalised statement, never
+  its literals.
+
+Each span is timed into the `cbmcp_stage_seconds` histogram, labelled by
+stage.  When the OpenTelemetry SDK is installed and
+OTEL_EXPORTER_OTLP_ENDPOINT is set, spans are also exported over OTLP, nested
+per turn (the OTel context follows the asyncio task, like the other
+context variables of the app).
+
+The metrics are served in the Prometheus text format at `/metrics` of the
+Chainlit server: stage histograms, LLM tokens, N1QL times, turns by path,
+active sessions, cache hit rates and the LLM admission queue (depth, outcomes
+and wait times).
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def metrics_enabled() -> bool:
+    return os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """One metric family with a fixed set of label names."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class CounterMetric(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class GaugeMetric(CounterMetric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class HistogramMetric(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = STAGE_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # per label set: cumulative bucket counts, sum, count
+        self._series: Dict[Tuple, List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        lines = []
+        for key, counts, total, count in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {bucket_count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """The app's metrics plus collectors that read other modules' statistics at scrape time."""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], List[Metric]]] = []
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> CounterMetric:
+        metric = CounterMetric(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> GaugeMetric:
+        metric = GaugeMetric(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = STAGE_BUCKETS) -> HistogramMetric:
+        metric = HistogramMetric(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        metrics = list(self.metrics)
+        for collect in self.collectors:
+            try:
+                metrics.extend(collect())
+            except Exception as e:
+                print(f"Warning: metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("cbmcp_stage_seconds", "Duration of each stage of a chat turn.", ("stage",))
+TURNS = REGISTRY.counter("cbmcp_turns_total", "Chat turns by the path that answered them.", ("path",))
+LLM_TOKENS = REGISTRY.counter("cbmcp_llm_tokens_total", "LLM tokens used, by kind (prompt or completion).", ("kind",))
+N1QL_SECONDS = REGISTRY.histogram(
+    "cbmcp_n1ql_seconds",
+    "Wall-clock execution time of agent statements by statement kind.",
+    ("kind",),
+)
+TOOL_CALLS = REGISTRY.counter("cbmcp_mcp_tool_calls_total", "MCP tool calls by tool and outcome.", ("tool", "outcome"))
+ACTIVE_SESSIONS = REGISTRY.gauge("cbmcp_active_sessions", "Chat sessions currently open.")
+LLM_ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "cbmcp_llm_admission_wait_seconds",
+    "Time agent turns waited in the LLM admission queue, by outcome (admitted or timed_out).",
+    ("outcome",),
+)
+
+
+def cache_metrics() -> List[Metric]:
+    """Lookups and hit rates of the fast path, the answer cache, the result cache and the prepared-statement cache."""
+    from answer_cache import get_answer_cache
+    from fast_path import get_fast_path
+    from prepared_statements import get_prepared_cache, prepared_statements_enabled
+    from result_cache import get_result_cache
+
+    lookups = CounterMetric("cbmcp_cache_lookups_total", "Cache lookups by cache and outcome.", ("cache", "outcome"))
+    hit_rate = GaugeMetric("cbmcp_cache_hit_ratio", "Share of lookups served from the cache since start.", ("cache",))
+
+    def add(cache: str, hits: int, misses: int):
+        lookups.inc(hits, cache=cache, outcome="hit")
+        lookups.inc(misses, cache=cache, outcome="miss")
+        hit_rate.set(hits / (hits + misses) if hits + misses else 0.0, cache=cache)
+
+    fast_path = get_fast_path()
+    if fast_path is not None:
+        hits = sum(fast_path.metrics.hits.values())
+        add("fast_path", hits, fast_path.metrics.questions - hits)
+    for name, cache in (("answer", get_answer_cache()), ("result", get_result_cache())):
+        if cache is not None:
+            add(name, cache.stats["hits"], cache.stats["misses"])
+    if prepared_statements_enabled():
+        stats = get_prepared_cache().stats
+        add("prepared", stats["hits"], stats["misses"] + stats["reprepared"])
+    return [lookups, hit_rate]
+
+
+def admission_metrics() -> List[Metric]:
+    """Queue depth and outcomes of the LLM admission scheduler (its wait times are observed as they happen)."""
+    from llm_admission import get_llm_scheduler
+
+    scheduler = get_llm_scheduler()
+    if scheduler is None:
+        return []
+    depth = GaugeMetric("cbmcp_llm_queue_depth", "Agent turns waiting for LLM admission.")
+    depth.set(scheduler.queue_depth)
+    turns = CounterMetric("cbmcp_llm_admissions_total", "Agent turns by admission outcome.", ("outcome",))
+    for outcome in ("admitted", "timed_out", "rate_limited"):
+        turns.inc(scheduler.stats[outcome], outcome=outcome)
+    return [depth, turns]
+
+
+REGISTRY.collectors.extend([cache_metrics, admission_metrics])
+
+
+_tracer: Any = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Optional[Any]:
+    """
+    The OpenTelemetry tracer, or None when opentelemetry is not installed.
+
+    When the SDK and the OTLP exporter are installed and
+    OTEL_EXPORTER_OTLP_ENDPOINT is set, spans are exported there (service name
+    from OTEL_SERVICE_NAME); otherwise the tracer of an already configured
+    provider is used, which is a no-op unless something else set one up.
+    """
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = _create_tracer() or False
+    return _tracer or None
+
+
+def _create_tracer() -> Optional[Any]:
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+            provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "cbmcp-agent")}))
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+            trace.set_tracer_provider(provider)
+        except ImportError as e:
+            print(f"Warning: OTEL_EXPORTER_OTLP_ENDPOINT is set but the OpenTelemetry SDK is not installed ({e})")
+    return trace.get_tracer("cbmcp")
+
+
+class Span:
+    """Handle of a running stage; attributes are forwarded to the OpenTelemetry span, if any."""
+
+    def __init__(self, stage: str, otel_span: Any = None):
+        self.stage = stage
+        self.otel_span = otel_span
+        self.attributes: Dict[str, Any] = {}
+
+    def set(self, **attributes):
+        for key, value in attributes.items():
+            if value is None:
+                continue
+            self.attributes[key] = value
+            if self.otel_span is not None:
+                self.otel_span.set_attribute(f"cbmcp.{key}", value if isinstance(value, (str, bool, int, float)) else str(value))
+
+    def fail(self, error: BaseException):
+        """Marks the stage as failed with an error that was handled inside it (raised errors are recorded anyway)."""
+        self.set(error=f"{type(error).__name__}: {error}")
+        if self.otel_span is not None:
+            from opentelemetry.trace import Status, StatusCode
+
+            self.otel_span.record_exception(error)
+            self.otel_span.set_status(Status(StatusCode.ERROR, str(error)))
+
+
+@contextmanager
+def span(stage: str, **attributes) -> Iterator[Span]:
+    """Times the block into the stage histogram and, with OpenTelemetry, runs it as a span named `stage`."""
+    tracer = get_tracer()
+    started = time.perf_counter()
+    if tracer is None:
+        current = Span(stage)
+        current.set(**attributes)
+        try:
+            yield current
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+        return
+    with tracer.start_as_current_span(stage) as otel_span:
+        current = Span(stage, otel_span)
+        current.set(**attributes)
+        try:
+            yield current
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+async def n1ql_middleware(kwargs: Dict[str, Any], call_next: Callable) -> Any:
+    """Query-tool middleware (see `mcp_pool.wrap_tool`) that times the statement as an `n1ql` span."""
+    statement = kwargs.get("query", "")
+    # EXPLAIN, PREPARE and EXECUTE round trips of the inner middlewares are told apart by their first keyword
+    kind = (statement.split(None, 1) or ["?"])[0].upper()
+    from workload_log import normalize_statement
+
+    # the shape only: literals (patient ids, names) must not reach the trace backend
+    with span("n1ql", statement=normalize_statement(statement)[:500], kind=kind, scope=kwargs.get("scope_name")) as current:
+        started = time.perf_counter()
+        result = await call_next(kwargs)
+        wall = time.perf_counter() - started
+        N1QL_SECONDS.observe(wall, kind=kind)
+        current.set(wall_ms=round(wall * 1000, 1))
+        return result
+
+
+def record_llm_usage(current: Span, response: Any, messages: Any):
+    """Adds the prompt / completion token counts of an LLM response to its span and the token counter."""
+    metadata = getattr(response, "metadata", None) or {}
+    usage = metadata.get("usage") if isinstance(metadata, dict) else None
+    usage = usage or getattr(response, "usage", None)
+    if usage is not None and not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, "model_dump") else vars(usage)
+    prompt_tokens = (usage or {}).get("prompt_tokens")
+    completion_tokens = (usage or {}).get("completion_tokens")
+    if prompt_tokens is None:
+        # the provider did not report usage; estimate like llm_admission does
+        from llm_admission import estimate_tokens
+
+        prompt_tokens = estimate_tokens(str(messages))
+        completion_tokens = estimate_tokens(str(response))
+        current.set(tokens_estimated=True)
+    LLM_TOKENS.inc(int(prompt_tokens), kind="prompt")
+    LLM_TOKENS.inc(int(completion_tokens or 0), kind="completion")
+    current.set(prompt_tokens=int(prompt_tokens), completion_tokens=int(completion_tokens or 0))
+
+
+def mount_metrics_endpoint(path: str = "/metrics"):
+    """
+    Serves `REGISTRY.render()` at `path` of the Chainlit server (no-op when
+    METRICS_ENABLED is false).  Safe to call again when `chainlit run -w`
+    re-imports the app: the endpoint then serves the re-imported registry.
+    """
+    if not metrics_enabled():
+        return
+    from chainlit.server import app as server
+    from fastapi.responses import PlainTextResponse
+
+    # a reload re-imports this module with a new registry; the middleware reads it from the app state
+    server.state.cbmcp_metrics_registry = REGISTRY
+    if getattr(server.state, "cbmcp_metrics_path", None) is not None:
+        return
+    if server.middleware_stack is not None:
+        # Starlette refuses middleware once the app has started
+        logging.getLogger(__name__).warning("Metrics: the server is already running, %s is not served", path)
+        return
+
+    # Routes match in registration order, and importing chainlit.server already
+    # included its router, which ends with the frontend's GET /{full_path:path}
+    # catch-all: a route added now would never be reached.  An HTTP middleware
+    # runs before routing, so /metrics is answered whatever Chainlit registers.
+    @server.middleware("http")
+    async def metrics(request, call_next):
+        if request.method == "GET" and request.url.path == path:
+            registry = server.state.cbmcp_metrics_registry
+            return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+        return await call_next(request)
+
+    server.state.cbmcp_metrics_path = path
@@ -0,0 +1,158 @@
+import argparse
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from couchbase.options import QueryOptions
+
+from create_indexes import BUCKET_NAME, SAMPLE_QUERIES, connect_to_couchbase
+
+# Repeatable benchmark for SAMPLE_QUERIES. Results are written as JSON so two
+# runs (e.g. before and after an index change) can be compared with --compare.
+
+DEFAULT_ITERATIONS = 20
+DEFAULT_WARMUP = 3
+DEFAULT_CONCURRENCY = [1, 4]
+REGRESSION_THRESHOLD = 0.20   # flag a query when its p95 grows by more than 20%
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def run_once(cluster, query, adhoc=True):
+    """Execute a query once, streaming its rows, and return client and server-side measurements"""
+    started = time.perf_counter()
+    result = cluster.query(query, QueryOptions(metrics=True, adhoc=adhoc))
+    rows = sum(1 for _ in result.rows())
+    wall = time.perf_counter() - started
+    sample = {"wall_ms": wall * 1000, "rows": rows}
+    metrics = result.metadata().metrics() if result.metadata() else None
+    if metrics:
+        sample["elapsed_ms"] = metrics.elapsed_time().total_seconds() * 1000
+        sample["execution_ms"] = metrics.execution_time().total_seconds() * 1000
+        sample["result_size"] = metrics.result_size()
+    return sample
+
+def summarize(samples, wall_seconds):
+    """Aggregate per-execution samples into latency percentiles and throughput"""
+    latencies = [s["wall_ms"] for s in samples]
+    total_rows = sum(s["rows"] for s in samples)
+    summary = {
+        "executions": len(samples),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "max_ms": round(max(latencies), 3),
+        "qps": round(len(samples) / wall_seconds, 2) if wall_seconds else 0.0,
+        "rows_per_execution": total_rows / len(samples),
+        "rows_per_s": round(total_rows / wall_seconds, 1) if wall_seconds else 0.0,
+    }
+    for key in ("elapsed_ms", "execution_ms", "result_size"):
+        values = [s[key] for s in samples if key in s]
+        if values:
+            summary[f"server_{key}_p50"] = round(percentile(values, 50), 3)
+            summary[f"server_{key}_p95"] = round(percentile(values, 95), 3)
+    return summary
+
+def benchmark_query(cluster, query, iterations, warmup, concurrency, adhoc=True):
+    """Warm up, then run `iterations` executions spread over `concurrency` threads"""
+    for _ in range(warmup):
+        run_once(cluster, query, adhoc)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(lambda _: run_once(cluster, query, adhoc), range(iterations)))
+    return summarize(samples, time.perf_counter() - started)
+
+def run_benchmark(cluster, query_names, iterations, warmup, concurrency_levels, adhoc=True):
+    """Benchmark every selected query at every concurrency level"""
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "bucket": BUCKET_NAME,
+            "iterations": iterations,
+            "warmup": warmup,
+            "concurrency": concurrency_levels,
+            "adhoc": adhoc,
+        },
+        "results": {},
+    }
+    for name in query_names:
+        report["results"][name] = {}
+        for concurrency in concurrency_levels:
+            try:
+                summary = benchmark_query(cluster, SAMPLE_QUERIES[name], iterations, warmup, concurrency, adhoc)
+            except Exception as e:
+                summary = {"error": str(e)}
+                print(f"  {name:<30} c={concurrency:<3} Error: {e}")
+            else:
+                print(f"  {name:<30} c={concurrency:<3} p50 {summary['p50_ms']:>8.1f} ms  "
+                      f"p95 {summary['p95_ms']:>8.1f} ms  p99 {summary['p99_ms']:>8.1f} ms  "
+                      f"{summary['qps']:>7.1f} q/s  {summary['rows_per_s']:>9.1f} rows/s")
+            report["results"][name][str(concurrency)] = summary
+    return report
+
+def compare_reports(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Print p95 changes against a baseline report and return the list of regressions"""
+    regressions = []
+    print(f"\n=== Comparison against baseline ({baseline['meta'].get('timestamp', '?')}) ===")
+    for name, levels in current["results"].items():
+        for concurrency, summary in levels.items():
+            before = baseline.get("results", {}).get(name, {}).get(concurrency)
+            if not before or "p95_ms" not in before or "p95_ms" not in summary:
+                continue
+            change = (summary["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+            flag = "REGRESSION" if change > threshold else ""
+            print(f"  {name:<30} c={concurrency:<3} p95 {before['p95_ms']:>8.1f} -> {summary['p95_ms']:>8.1f} ms "
+                  f"({change:+.0%}) {flag}")
+            if flag:
+                regressions.append((name, concurrency, change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SAMPLE_QUERIES against Couchbase.")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="timed executions per query and concurrency level")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP, help="untimed executions before measuring")
+    parser.add_argument("--concurrency", default=",".join(map(str, DEFAULT_CONCURRENCY)),
+                        help="comma-separated concurrency levels, e.g. 1,4,16")
+    parser.add_argument("--query", action="append", dest="queries", choices=sorted(SAMPLE_QUERIES),
+                        help="query to run (repeatable, default: all)")
+    parser.add_argument("--prepared", action="store_true", help="run as prepared statements (adhoc=False)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="baseline JSON report to diff against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="p95 growth flagged as a regression")
+    args = parser.parse_args()
+
+    cluster, _ = connect_to_couchbase()
+    if not cluster:
+        print("Failed to connect to Couchbase. Please check your configuration.")
+        return 2
+
+    concurrency_levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    print("=== Couchbase Query Benchmark ===")
+    print(f"Target bucket: {BUCKET_NAME}, {args.iterations} iterations after {args.warmup} warm-up runs")
+    report = run_benchmark(cluster, args.queries or list(SAMPLE_QUERIES), args.iterations, args.warmup,
+                           concurrency_levels, adhoc=not args.prepared)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
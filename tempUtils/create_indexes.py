@@ -2,13 +2,24 @@ from couchbase.cluster import Cluster
 from couchbase.auth import PasswordAuthenticator
 from couchbase.options import ClusterOptions
 from couchbase.management.queries import QueryIndexManager
+from couchbase.management.options import CreateQueryIndexOptions
+from datetime import timedelta
+from urllib.parse import urlparse
+import argparse
+import base64
+import json
 import time
+import urllib.request
+
+from index_advisor import advise, explain_queries, format_report, load_workload
 
 # Couchbase connection configuration
 COUCHBASE_CONNECTION_STRING = "couchbase://localhost"
 COUCHBASE_USERNAME = "CBuser"  # Adjust as needed
 COUCHBASE_PASSWORD = "CBpass"       # Adjust as needed
 BUCKET_NAME = "test-bucket1"
+CLUSTER_MANAGER_PORT = 8091   # serves /indexStatus with per-index build progress
+PREPARED_STATEMENT_PREFIX = "cbmcp_"  # names the app prepares (prepared_statements.py)
 
 # Index definitions for optimal query performance
 INDEX_DEFINITIONS = [
@@ -168,19 +179,37 @@ def get_existing_indexes(query_manager):
         print(f"Error getting existing indexes: {e}")
         return []
 
-def create_index(query_manager, index_def):
-    """Create a single index"""
+def get_index_states(query_manager):
+    """Get {index name: state} for the bucket (online, deferred, building, ...)"""
+    try:
+        return {idx.name: idx.state for idx in query_manager.get_all_indexes(BUCKET_NAME)}
+    except Exception as e:
+        print(f"Error getting index states: {e}")
+        return {}
+
+def create_index(query_manager, index_def, deferred=False):
+    """Create a single index (only defined, not built, when deferred)"""
     try:
         fields_str = ", ".join(index_def["fields"])
         
-        print(f"Creating index: {index_def['name']}")
+        print(f"Creating index: {index_def['name']}{' (deferred)' if deferred else ''}")
         print(f"  Fields: {fields_str}")
+        if index_def.get("where"):
+            print(f"  Where: {index_def['where']}")
         print(f"  Description: {index_def['description']}")
         
+        options = {"deferred": deferred, "ignore_if_exists": True}
+        if index_def.get("collection"):
+            options["scope_name"] = index_def["scope"]
+            options["collection_name"] = index_def["collection"]
+        if index_def.get("where"):
+            # partial index, e.g. "`type` = 'test'"
+            options["condition"] = index_def["where"]
         query_manager.create_index(
-            bucket_name=BUCKET_NAME,
-            index_name=index_def["name"],
-            fields=index_def["fields"]
+            BUCKET_NAME,
+            index_def["name"],
+            index_def["fields"],
+            CreateQueryIndexOptions(**options)
         )
         
         return True
@@ -211,6 +240,56 @@ def wait_for_indexes(query_manager, index_names):
     print("Warning: Timeout waiting for indexes to build")
     return False
 
+def get_index_progress():
+    """Get {index name: (status, percent built)} from the cluster manager's /indexStatus endpoint"""
+    host = urlparse(COUCHBASE_CONNECTION_STRING.replace("couchbase://", "http://").replace("couchbases://", "https://")).hostname
+    request = urllib.request.Request(f"http://{host}:{CLUSTER_MANAGER_PORT}/indexStatus")
+    token = base64.b64encode(f"{COUCHBASE_USERNAME}:{COUCHBASE_PASSWORD}".encode()).decode()
+    request.add_header("Authorization", f"Basic {token}")
+    with urllib.request.urlopen(request, timeout=10) as response:
+        status = json.load(response)
+    return {
+        idx["index"]: (idx.get("status", "unknown"), idx.get("progress", 0))
+        for idx in status.get("indexes", [])
+        if idx.get("bucket") == BUCKET_NAME
+    }
+
+def build_deferred_indexes(query_manager):
+    """Build every deferred index of the bucket with a single BUILD INDEX, so the indexer shares one scan"""
+    print("Issuing a single BUILD INDEX for all deferred indexes...")
+    query_manager.build_deferred_indexes(BUCKET_NAME)
+
+def watch_index_build(query_manager, index_names, max_wait_time=3600, poll_interval=5):
+    """Wait for indexes to come online, printing the percent built per index"""
+    print(f"\nWatching {len(index_names)} indexes...")
+    start_time = time.time()
+    progress_available = True
+    
+    while time.time() - start_time < max_wait_time:
+        states = get_index_states(query_manager)
+        pending = [name for name in index_names if states.get(name) != "online"]
+        if not pending:
+            print("All indexes are online!")
+            return True
+        
+        progress = {}
+        if progress_available:
+            try:
+                progress = get_index_progress()
+            except Exception as e:
+                print(f"  (per-index progress unavailable: {e})")
+                progress_available = False
+        
+        elapsed = int(time.time() - start_time)
+        for name in pending:
+            status, percent = progress.get(name, (states.get(name, "unknown"), None))
+            percent_str = f"{percent:>3}%" if percent is not None else "   ?"
+            print(f"  [{elapsed:>5}s] {name:<32} {percent_str}  {status}")
+        time.sleep(poll_interval)
+    
+    print("Warning: Timeout waiting for indexes to build")
+    return False
+
 def create_primary_index(query_manager):
     """Create primary index if it doesn't exist"""
     try:
@@ -225,6 +304,17 @@ def create_primary_index(query_manager):
             print(f"Error creating primary index: {e}")
             return False
 
+def invalidate_prepared_statements(cluster):
+    """Drop the app's prepared statements so they are re-planned against the new indexes"""
+    try:
+        result = cluster.query(
+            f'DELETE FROM system:prepareds WHERE name LIKE "{PREPARED_STATEMENT_PREFIX}%" RETURNING RAW name'
+        )
+        dropped = list(result.rows())
+        print(f"Dropped {len(dropped)} prepared statements; the app re-prepares them on next use")
+    except Exception as e:
+        print(f"Warning: could not drop prepared statements: {e}")
+
 def test_sample_queries(cluster):
     """Test sample queries to verify index performance"""
     print("\n=== Testing Sample Queries ===")
@@ -245,50 +335,21 @@ def test_sample_queries(cluster):
         except Exception as e:
             print(f"  Error: {e}")
 
-def generate_index_analysis():
-    """Generate index usage analysis and recommendations"""
-    analysis = """
-=== INDEX USAGE ANALYSIS ===
-
-HIGH PRIORITY INDEXES:
-1. idx_document_type - Essential for all type-based filtering
-2. idx_patient_id_composite - Fast patient lookups by ID
-3. idx_patient_relationships - Core relationship queries (tests/prescriptions by patient)
-4. idx_test_type_date - Medical analytics and reporting
-5. idx_test_patient_date - Patient timeline queries
-6. idx_prescription_patient_date - Medication history
-
-MEDIUM PRIORITY INDEXES:
-- idx_patient_demographics - Population health analytics
-- idx_patient_name_search - User search functionality
-- idx_prescription_medicine - Drug utilization studies
-- idx_prescription_validity - Active medication tracking
+def generate_index_analysis(cluster, workload_path=None):
+    """Verify the EXPLAIN plan of every sample (and logged workload) query and recommend index changes"""
+    queries, scopes = dict(SAMPLE_QUERIES), {}
+    if workload_path:
+        workload_queries, scopes = load_workload(workload_path)
+        print(f"Including {len(workload_queries)} query shapes from the agent workload ({workload_path})")
+        queries.update(workload_queries)
+    plans = explain_queries(cluster, queries, scopes, BUCKET_NAME)
+    return advise(queries, plans, INDEX_DEFINITIONS, scopes)
 
-LOW PRIORITY INDEXES:
-- idx_largo_code - Administrative lookups
-
-QUERY PATTERNS SUPPORTED:
-✓ Find patient by ID
-✓ Get all tests for a patient
-✓ Get all prescriptions for a patient
-✓ Find tests by type and date range
-✓ Demographics-based patient searches
-✓ Medication-specific queries
-✓ Active prescription tracking
-✓ Complex joins for complete patient profiles
-
-PERFORMANCE RECOMMENDATIONS:
-- Use covering indexes for frequently accessed fields
-- Monitor query performance and adjust indexes based on usage patterns
-- Consider partitioned indexes for very large datasets
-- Use array indexing for test results if complex result queries are needed
-"""
-    return analysis
-
-def main():
+def main(build_mode="deferred", workload_path=None, apply_recommendations=False):
     """Main function to create all indexes"""
     print("=== Couchbase Index Creation Tool ===")
     print(f"Target bucket: {BUCKET_NAME}")
+    print(f"Build mode: {build_mode}")
     
     # Connect to Couchbase
     cluster, query_manager = connect_to_couchbase()
@@ -302,26 +363,37 @@ def main():
     
     # Get existing indexes
     print("\n2. Checking Existing Indexes...")
-    existing_indexes = get_existing_indexes(query_manager)
+    index_states = get_index_states(query_manager)
+    existing_indexes = list(index_states)
     print(f"Found {len(existing_indexes)} existing indexes: {existing_indexes}")
     
     # Create secondary indexes
+    deferred = build_mode == "deferred"
     print(f"\n3. Creating {len(INDEX_DEFINITIONS)} Secondary Indexes...")
     created_indexes = []
     skipped_indexes = []
     
     for index_def in INDEX_DEFINITIONS:
         if index_def["name"] in existing_indexes:
-            print(f"Skipping existing index: {index_def['name']}")
+            print(f"Skipping existing index: {index_def['name']} ({index_states[index_def['name']]})")
             skipped_indexes.append(index_def["name"])
         else:
-            if create_index(query_manager, index_def):
+            if create_index(query_manager, index_def, deferred=deferred):
                 created_indexes.append(index_def["name"])
     
-    # Wait for indexes to build
-    if created_indexes:
+    # Build and wait for indexes
+    if deferred:
+        # also pick up indexes left deferred by an earlier, interrupted run
+        to_build = created_indexes + [name for name in skipped_indexes if index_states.get(name) == "deferred"]
+        if to_build:
+            print(f"\n4. Building {len(to_build)} deferred indexes in one pass...")
+            build_deferred_indexes(query_manager)
+            watch_index_build(query_manager, to_build)
+            invalidate_prepared_statements(cluster)
+    elif created_indexes:
         print(f"\n4. Waiting for {len(created_indexes)} new indexes to build...")
         wait_for_indexes(query_manager, created_indexes)
+        invalidate_prepared_statements(cluster)
     
     # Test sample queries
     print("\n5. Testing Query Performance...")
@@ -329,12 +401,24 @@ def main():
     
     # Print analysis
     print("\n6. Index Analysis and Recommendations...")
-    print(generate_index_analysis())
+    report = generate_index_analysis(cluster, workload_path)
+    print(format_report(report, BUCKET_NAME))
+    
+    applied_indexes = []
+    if apply_recommendations and report["recommendations"]:
+        print(f"\n7. Creating {len(report['recommendations'])} Recommended Indexes...")
+        for index_def in report["recommendations"]:
+            if create_index(query_manager, index_def):
+                applied_indexes.append(index_def["name"])
+        if applied_indexes:
+            invalidate_prepared_statements(cluster)
     
     # Summary
     print("\n=== SUMMARY ===")
     print(f"Created indexes: {len(created_indexes)}")
     print(f"Skipped (already exist): {len(skipped_indexes)}")
+    if apply_recommendations:
+        print(f"Created from recommendations: {len(applied_indexes)}")
     print(f"Total indexes: {len(existing_indexes) + len(created_indexes)}")
     
     if created_indexes:
@@ -345,4 +429,12 @@ def main():
     print(f"\nYour bucket '{BUCKET_NAME}' is now optimized for medical data queries!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create the secondary indexes used by the medical data queries.")
+    parser.add_argument("--build-mode", choices=["deferred", "immediate"], default="deferred",
+                        help="deferred: define all missing indexes, then build them with one BUILD INDEX; "
+                             "immediate: build each index as it is created")
+    parser.add_argument("--workload", help="query shapes exported by workload_log.py --export to include in the analysis")
+    parser.add_argument("--apply-recommendations", action="store_true",
+                        help="create the indexes recommended by the analysis")
+    args = parser.parse_args()
+    main(build_mode=args.build_mode, workload_path=args.workload, apply_recommendations=args.apply_recommendations)
\ No newline at end of file
@@ -1,8 +1,21 @@
+import argparse
+import multiprocessing
+import os
 import random
+import threading
+import time
 import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
+from multiprocessing.util import Finalize
 from couchbase.cluster import Cluster
 from couchbase.auth import PasswordAuthenticator
+from couchbase.exceptions import (
+    AmbiguousTimeoutException,
+    ServiceUnavailableException,
+    TemporaryFailException,
+    UnAmbiguousTimeoutException,
+)
 from couchbase.options import ClusterOptions
 import json
 
@@ -12,6 +25,17 @@ COUCHBASE_USERNAME = "CBuser"  # Adjust as needed
 COUCHBASE_PASSWORD = "CBpass"       # Adjust as needed
 BUCKET_NAME = "test-bucket1"
 
+# Bulk loader defaults
+BATCH_SIZE = 500        # documents per insert_multi call
+MAX_IN_FLIGHT = 8       # concurrent batches
+MAX_RETRIES = 5         # retries for temporary failures, with exponential backoff
+RETRYABLE_ERRORS = (
+    TemporaryFailException,
+    AmbiguousTimeoutException,
+    UnAmbiguousTimeoutException,
+    ServiceUnavailableException,
+)
+
 # Sample data pools for realistic generation
 FIRST_NAMES = [
     "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda",
@@ -41,26 +65,26 @@ TEST_TYPES = [
 
 TEST_RESULTS = {
     "blood_test": [
-        {"result_id": "hemoglobin", "result_value": lambda: f"{random.uniform(12.0, 16.0):.1f}"},
-        {"result_id": "white_blood_cells", "result_value": lambda: f"{random.randint(4000, 11000)}"},
-        {"result_id": "platelets", "result_value": lambda: f"{random.randint(150000, 450000)}"}
+        {"result_id": "hemoglobin", "result_value": lambda rng: f"{rng.uniform(12.0, 16.0):.1f}"},
+        {"result_id": "white_blood_cells", "result_value": lambda rng: f"{rng.randint(4000, 11000)}"},
+        {"result_id": "platelets", "result_value": lambda rng: f"{rng.randint(150000, 450000)}"}
     ],
     "urine_test": [
-        {"result_id": "protein", "result_value": lambda: random.choice(["negative", "trace", "positive"])},
-        {"result_id": "glucose", "result_value": lambda: random.choice(["negative", "positive"])},
-        {"result_id": "bacteria", "result_value": lambda: random.choice(["few", "moderate", "many"])}
+        {"result_id": "protein", "result_value": lambda rng: rng.choice(["negative", "trace", "positive"])},
+        {"result_id": "glucose", "result_value": lambda rng: rng.choice(["negative", "positive"])},
+        {"result_id": "bacteria", "result_value": lambda rng: rng.choice(["few", "moderate", "many"])}
     ],
     "x_ray": [
-        {"result_id": "findings", "result_value": lambda: random.choice(["normal", "abnormal", "fracture detected", "no abnormalities"])}
+        {"result_id": "findings", "result_value": lambda rng: rng.choice(["normal", "abnormal", "fracture detected", "no abnormalities"])}
     ],
     "thyroid_function": [
-        {"result_id": "tsh", "result_value": lambda: f"{random.uniform(0.4, 4.0):.2f}"},
-        {"result_id": "t4", "result_value": lambda: f"{random.uniform(4.5, 12.0):.1f}"}
+        {"result_id": "tsh", "result_value": lambda rng: f"{rng.uniform(0.4, 4.0):.2f}"},
+        {"result_id": "t4", "result_value": lambda rng: f"{rng.uniform(4.5, 12.0):.1f}"}
     ],
     "cholesterol_panel": [
-        {"result_id": "total_cholesterol", "result_value": lambda: f"{random.randint(150, 300)}"},
-        {"result_id": "hdl", "result_value": lambda: f"{random.randint(30, 80)}"},
-        {"result_id": "ldl", "result_value": lambda: f"{random.randint(70, 200)}"}
+        {"result_id": "total_cholesterol", "result_value": lambda rng: f"{rng.randint(150, 300)}"},
+        {"result_id": "hdl", "result_value": lambda rng: f"{rng.randint(30, 80)}"},
+        {"result_id": "ldl", "result_value": lambda rng: f"{rng.randint(70, 200)}"}
     ]
 }
 
@@ -71,43 +95,76 @@ MEDICINES = [
     "CLOPIDOGREL", "MONTELUKAST", "ROSUVASTATIN", "ESCITALOPRAM", "PANTOPRAZOLE", "WARFARIN"
 ]
 
-def generate_patient_id():
+def generate_patient_id(rng=random):
     """Generate a unique 9-digit patient ID"""
-    return f"{random.randint(100000000, 999999999)}"
+    return f"{rng.randint(100000000, 999999999)}"
 
-def generate_birth_year():
+def generate_birth_year(rng=random, today=None):
     """Generate realistic birth year (ages 18-90)"""
-    current_year = datetime.now().year
-    return random.randint(current_year - 90, current_year - 18)
+    current_year = (today or datetime.now()).year
+    return rng.randint(current_year - 90, current_year - 18)
 
-def generate_test_date():
+def generate_test_date(rng=random, today=None):
     """Generate test date within the last 2 years"""
-    end_date = datetime.now()
+    end_date = today or datetime.now()
     start_date = end_date - timedelta(days=730)
-    random_date = start_date + timedelta(days=random.randint(0, 730))
+    random_date = start_date + timedelta(days=rng.randint(0, 730))
     return random_date.strftime("%Y-%m-%d")
 
-def generate_prescription_date():
+def generate_prescription_date(rng=random, today=None):
     """Generate prescription date within the last year"""
-    end_date = datetime.now()
+    end_date = today or datetime.now()
     start_date = end_date - timedelta(days=365)
-    random_date = start_date + timedelta(days=random.randint(0, 365))
+    random_date = start_date + timedelta(days=rng.randint(0, 365))
     return random_date.strftime("%Y-%m-%d")
 
-def generate_test_results(test_type):
+def generate_test_results(test_type, rng=random):
     """Generate realistic test results based on test type"""
     if test_type in TEST_RESULTS:
         results = []
         for result_template in TEST_RESULTS[test_type]:
             result = {
                 "result_id": result_template["result_id"],
-                "result_value": result_template["result_value"]() if callable(result_template["result_value"]) else result_template["result_value"]
+                "result_value": result_template["result_value"](rng) if callable(result_template["result_value"]) else result_template["result_value"]
             }
             results.append(result)
         return results
     else:
         # Default result for test types not in our predefined list
-        return [{"result_id": "status", "result_value": random.choice(["normal", "abnormal", "pending"])}]
+        return [{"result_id": "status", "result_value": rng.choice(["normal", "abnormal", "pending"])}]
+
+def build_patient(patient_id, rng=random, today=None):
+    """Build a single patient document"""
+    return {
+        "type": "patient",
+        "id": patient_id,
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "gender": rng.choice(["male", "female"]),
+        "birth_date_year": generate_birth_year(rng, today)
+    }
+
+def build_test(patient_id, test_id, rng=random, today=None):
+    """Build a single test document"""
+    test_type = rng.choice(TEST_TYPES)
+    return {
+        "type": "test",
+        "id": test_id,
+        "patient_id": patient_id,
+        "test_type": test_type,
+        "result_date": generate_test_date(rng, today),
+        "results": generate_test_results(test_type, rng)
+    }
+
+def build_prescription(patient_id, rng=random, today=None):
+    """Build a single prescription document"""
+    return {
+        "type": "prescription",
+        "largo_code": f"{rng.randint(10000, 99999)}",
+        "patient_id": patient_id,
+        "medicine_name": rng.choice(MEDICINES),
+        "quantity": rng.choice([10, 20, 30, 60, 90]),
+        "valid_from": generate_prescription_date(rng, today)
+    }
 
 def generate_patients(count=100):
     """Generate patient documents"""
@@ -121,14 +178,7 @@ def generate_patients(count=100):
             patient_id = generate_patient_id()
         used_ids.add(patient_id)
         
-        patient = {
-            "type": "patient",
-            "id": patient_id,
-            "name": f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}",
-            "gender": random.choice(["male", "female"]),
-            "birth_date_year": generate_birth_year()
-        }
-        patients.append(patient)
+        patients.append(build_patient(patient_id))
     
     return patients
 
@@ -141,16 +191,8 @@ def generate_tests(patients):
         num_tests = random.randint(0, 5)
         
         for i in range(num_tests):
-            test_type = random.choice(TEST_TYPES)
-            test = {
-                "type": "test",
-                "id": f"t{uuid.uuid4().hex[:8]}",  # Generate unique test ID
-                "patient_id": patient["id"],
-                "test_type": test_type,
-                "result_date": generate_test_date(),
-                "results": generate_test_results(test_type)
-            }
-            tests.append(test)
+            # Generate unique test ID
+            tests.append(build_test(patient["id"], f"t{uuid.uuid4().hex[:8]}"))
     
     return tests
 
@@ -163,20 +205,300 @@ def generate_prescriptions(patients):
         num_prescriptions = random.randint(0, 3)
         
         for i in range(num_prescriptions):
-            prescription = {
-                "type": "prescription",
-                "largo_code": f"{random.randint(10000, 99999)}",
-                "patient_id": patient["id"],
-                "medicine_name": random.choice(MEDICINES),
-                "quantity": random.choice([10, 20, 30, 60, 90]),
-                "valid_from": generate_prescription_date()
-            }
-            prescriptions.append(prescription)
+            prescriptions.append(build_prescription(patient["id"]))
     
     return prescriptions
 
+# --- Scale-factor generation ---
+#
+# Patients are numbered 0..N-1 and split into fixed-size shards. Each shard
+# has its own seed, so the output does not depend on how many worker
+# processes generate it, and patient/test IDs are derived from the patient
+# number through bijections, so no "used IDs" set is needed.
+
+PATIENTS_PER_SCALE_FACTOR = 100000
+SHARD_SIZE = 10000
+PATIENT_ID_MIN = 100000000
+PATIENT_ID_SPAN = 900000000     # 9-digit IDs
+PATIENT_ID_STRIDE = 387420503   # coprime with PATIENT_ID_SPAN, so index -> ID is a permutation
+TEST_ID_BITS = 40
+TEST_ID_STRIDE = 0x9E3779B97F   # odd, so index -> ID is a permutation mod 2**40
+MAX_TESTS_PER_PATIENT = 5
+
+def scaled_patient_id(index):
+    """Unique 9-digit patient ID for patient number `index`"""
+    return f"{PATIENT_ID_MIN + (index * PATIENT_ID_STRIDE) % PATIENT_ID_SPAN}"
+
+def scaled_test_id(patient_index, test_number):
+    """Unique test ID for the n-th test of patient number `patient_index`"""
+    sequence = patient_index * (MAX_TESTS_PER_PATIENT + 1) + test_number
+    return f"t{(sequence * TEST_ID_STRIDE) % (1 << TEST_ID_BITS):010x}"
+
+def shard_seed(seed, shard):
+    return seed * 1000003 + shard
+
+def generate_shard(shard, patient_count, seed=0, today=None):
+    """
+    Stream the documents of one shard (patients, then their tests and
+    prescriptions) without keeping them in memory.
+    """
+    rng = random.Random(shard_seed(seed, shard))
+    first = shard * SHARD_SIZE
+    for index in range(first, min(first + SHARD_SIZE, patient_count)):
+        patient_id = scaled_patient_id(index)
+        yield build_patient(patient_id, rng, today)
+        for test_number in range(rng.randint(0, MAX_TESTS_PER_PATIENT)):
+            yield build_test(patient_id, scaled_test_id(index, test_number), rng, today)
+        for _ in range(rng.randint(0, 3)):
+            yield build_prescription(patient_id, rng, today)
+
+# --- Vectorized (NumPy) backend ---
+#
+# Draws whole columns per shard instead of calling Python lambdas per field.
+# NumPy is only needed when --backend numpy is selected.
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+# Column samplers mirroring TEST_RESULTS: (result_id, kind, args)
+VECTOR_TEST_RESULTS = {
+    "blood_test": [
+        ("hemoglobin", "uniform", (12.0, 16.0, "{:.1f}")),
+        ("white_blood_cells", "randint", (4000, 11000)),
+        ("platelets", "randint", (150000, 450000)),
+    ],
+    "urine_test": [
+        ("protein", "choice", (["negative", "trace", "positive"],)),
+        ("glucose", "choice", (["negative", "positive"],)),
+        ("bacteria", "choice", (["few", "moderate", "many"],)),
+    ],
+    "x_ray": [
+        ("findings", "choice", (["normal", "abnormal", "fracture detected", "no abnormalities"],)),
+    ],
+    "thyroid_function": [
+        ("tsh", "uniform", (0.4, 4.0, "{:.2f}")),
+        ("t4", "uniform", (4.5, 12.0, "{:.1f}")),
+    ],
+    "cholesterol_panel": [
+        ("total_cholesterol", "randint", (150, 300)),
+        ("hdl", "randint", (30, 80)),
+        ("ldl", "randint", (70, 200)),
+    ],
+}
+DEFAULT_RESULT = ("status", "choice", (["normal", "abnormal", "pending"],))
+
+# (first age, last age, share of patients), roughly an adult population pyramid
+AGE_PYRAMID = [
+    (18, 29, 0.20), (30, 39, 0.18), (40, 49, 0.17), (50, 59, 0.16),
+    (60, 69, 0.14), (70, 79, 0.10), (80, 90, 0.05),
+]
+# defaults of --test-skew / --medicine-zipf
+TEST_TYPE_SKEW = 0.8    # Zipf exponent over TEST_TYPES (0 = uniform, like the Python backend)
+MEDICINE_ZIPF = 1.1     # Zipf exponent over MEDICINES (ACAMOL most prescribed)
+
+def zipf_weights(count, exponent):
+    """Normalized Zipf weights 1/k**s for ranks 1..count"""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+def _draw_values(rng, kind, args, size):
+    if kind == "uniform":
+        low, high, fmt = args
+        return [fmt.format(v) for v in rng.uniform(low, high, size).tolist()]
+    if kind == "randint":
+        low, high = args
+        return [str(v) for v in rng.integers(low, high + 1, size).tolist()]
+    options = args[0]
+    return [options[i] for i in rng.integers(0, len(options), size).tolist()]
+
+def _date_table(today, days):
+    return [(today - timedelta(days=days - offset)).strftime("%Y-%m-%d") for offset in range(days + 1)]
+
+def generate_shard_numpy(shard, patient_count, seed=0, today=None, test_skew=TEST_TYPE_SKEW, medicine_zipf=MEDICINE_ZIPF):
+    """
+    Vectorized equivalent of generate_shard(): every field is drawn as a
+    column for the whole shard, then documents are assembled from the arrays.
+    """
+    if np is None:
+        raise RuntimeError("The numpy backend requires numpy (pip install numpy)")
+    today = today or datetime.now()
+    rng = np.random.default_rng(shard_seed(seed, shard))
+    first = shard * SHARD_SIZE
+    indices = np.arange(first, min(first + SHARD_SIZE, patient_count), dtype=np.int64)
+    n = len(indices)
+
+    # patients
+    patient_ids = [str(v) for v in (PATIENT_ID_MIN + (indices * PATIENT_ID_STRIDE) % PATIENT_ID_SPAN).tolist()]
+    first_names = rng.integers(0, len(FIRST_NAMES), n).tolist()
+    last_names = rng.integers(0, len(LAST_NAMES), n).tolist()
+    genders = rng.integers(0, 2, n).tolist()
+    bands = rng.choice(len(AGE_PYRAMID), n, p=[share for _, _, share in AGE_PYRAMID])
+    low = np.array([band[0] for band in AGE_PYRAMID])[bands]
+    high = np.array([band[1] for band in AGE_PYRAMID])[bands]
+    birth_years = (today.year - rng.integers(low, high + 1)).tolist()
+
+    # tests
+    test_counts = rng.integers(0, MAX_TESTS_PER_PATIENT + 1, n)
+    total_tests = int(test_counts.sum())
+    test_offsets = np.concatenate(([0], np.cumsum(test_counts)))
+    test_numbers = np.arange(total_tests) - np.repeat(test_offsets[:-1], test_counts)
+    sequences = (np.repeat(indices, test_counts) * (MAX_TESTS_PER_PATIENT + 1) + test_numbers).astype(np.uint64)
+    # uint64 multiplication wraps mod 2**64, which preserves the value mod 2**40
+    test_ids = [f"t{v:010x}" for v in ((sequences * np.uint64(TEST_ID_STRIDE)) & np.uint64((1 << TEST_ID_BITS) - 1)).tolist()]
+    test_types = rng.choice(len(TEST_TYPES), total_tests, p=zipf_weights(len(TEST_TYPES), test_skew))
+    test_dates_table = _date_table(today, 730)
+    test_dates = rng.integers(0, 731, total_tests).tolist()
+    results = [None] * total_tests
+    for type_index, test_type in enumerate(TEST_TYPES):
+        positions = np.flatnonzero(test_types == type_index).tolist()
+        if not positions:
+            continue
+        columns = [
+            (result_id, _draw_values(rng, kind, args, len(positions)))
+            for result_id, kind, args in VECTOR_TEST_RESULTS.get(test_type, [DEFAULT_RESULT])
+        ]
+        for row, position in enumerate(positions):
+            results[position] = [{"result_id": result_id, "result_value": values[row]} for result_id, values in columns]
+    test_types = test_types.tolist()
+
+    # prescriptions
+    prescription_counts = rng.integers(0, 4, n)
+    total_prescriptions = int(prescription_counts.sum())
+    prescription_offsets = np.concatenate(([0], np.cumsum(prescription_counts)))
+    largo_codes = rng.integers(10000, 100000, total_prescriptions).tolist()
+    medicines = rng.choice(len(MEDICINES), total_prescriptions, p=zipf_weights(len(MEDICINES), medicine_zipf)).tolist()
+    quantities = rng.choice([10, 20, 30, 60, 90], total_prescriptions).tolist()
+    prescription_dates_table = _date_table(today, 365)
+    prescription_dates = rng.integers(0, 366, total_prescriptions).tolist()
+
+    test_offsets = test_offsets.tolist()
+    prescription_offsets = prescription_offsets.tolist()
+    for i in range(n):
+        patient_id = patient_ids[i]
+        yield {
+            "type": "patient",
+            "id": patient_id,
+            "name": f"{FIRST_NAMES[first_names[i]]} {LAST_NAMES[last_names[i]]}",
+            "gender": "male" if genders[i] == 0 else "female",
+            "birth_date_year": birth_years[i]
+        }
+        for t in range(test_offsets[i], test_offsets[i + 1]):
+            yield {
+                "type": "test",
+                "id": test_ids[t],
+                "patient_id": patient_id,
+                "test_type": TEST_TYPES[test_types[t]],
+                "result_date": test_dates_table[test_dates[t]],
+                "results": results[t]
+            }
+        for p in range(prescription_offsets[i], prescription_offsets[i + 1]):
+            yield {
+                "type": "prescription",
+                "largo_code": str(largo_codes[p]),
+                "patient_id": patient_id,
+                "medicine_name": MEDICINES[medicines[p]],
+                "quantity": quantities[p],
+                "valid_from": prescription_dates_table[prescription_dates[p]]
+            }
+
+def shard_documents(shard, patient_count, seed, today, backend="python", test_skew=TEST_TYPE_SKEW, medicine_zipf=MEDICINE_ZIPF):
+    """Document stream of one shard from the selected backend (the skews only apply to numpy)"""
+    if backend == "numpy":
+        return generate_shard_numpy(shard, patient_count, seed, today, test_skew, medicine_zipf)
+    return generate_shard(shard, patient_count, seed, today)
+
+def write_shard_ndjson(shard, patient_count, seed, today, out_dir, backend="python", test_skew=TEST_TYPE_SKEW,
+                       medicine_zipf=MEDICINE_ZIPF):
+    """Write one shard as per-type NDJSON files for cbimport; returns per-type counts"""
+    counts = {"patient": 0, "test": 0, "prescription": 0}
+    files = {}
+    try:
+        for doc_type in counts:
+            os.makedirs(os.path.join(out_dir, doc_type), exist_ok=True)
+            files[doc_type] = open(os.path.join(out_dir, doc_type, f"shard-{shard:05d}.ndjson"), "w", encoding="utf-8")
+        for doc in shard_documents(shard, patient_count, seed, today, backend, test_skew, medicine_zipf):
+            files[doc["type"]].write(json.dumps(doc) + "\n")
+            counts[doc["type"]] += 1
+    finally:
+        for f in files.values():
+            f.close()
+    return counts
+
+_worker_collection = None
+
+def _connect_worker():
+    """Pool initializer: one Couchbase connection per worker process, closed when the worker exits"""
+    global _worker_collection
+    cluster, _worker_collection = connect_to_couchbase()
+    if cluster is not None:
+        Finalize(cluster, cluster.close, exitpriority=10)
+
+def load_shard(shard, patient_count, seed, today, batch_size, max_in_flight, backend="python", test_skew=TEST_TYPE_SKEW,
+               medicine_zipf=MEDICINE_ZIPF):
+    """Generate one shard and stream it into Couchbase over the worker's connection; returns (success, errors)"""
+    if _worker_collection is None:
+        raise RuntimeError("Failed to connect to Couchbase")
+    documents = shard_documents(shard, patient_count, seed, today, backend, test_skew, medicine_zipf)
+    return bulk_insert_documents(_worker_collection, documents, None,
+                                 batch_size=batch_size, max_in_flight=max_in_flight, report_every=0)
+
+def _run_shard(task):
+    kind, args = task
+    return write_shard_ndjson(*args) if kind == "ndjson" else load_shard(*args)
+
+def generate_scaled_dataset(patient_count, output="couchbase", out_dir="dataset", seed=0, today=None,
+                            workers=None, batch_size=BATCH_SIZE, max_in_flight=MAX_IN_FLIGHT, backend="python",
+                            test_skew=TEST_TYPE_SKEW, medicine_zipf=MEDICINE_ZIPF):
+    """
+    Generate `patient_count` patients (plus their tests and prescriptions)
+    across a process pool, either loading them directly or writing NDJSON.
+    """
+    today = today or datetime.now()
+    shards = (patient_count + SHARD_SIZE - 1) // SHARD_SIZE
+    workers = min(workers or os.cpu_count() or 1, max(shards, 1))
+    print(f"Generating {patient_count} patients in {shards} shards with {workers} worker processes "
+          f"({backend} backend, seed {seed})...")
+    skews = (test_skew, medicine_zipf)
+    if output == "ndjson":
+        tasks = [("ndjson", (shard, patient_count, seed, today, out_dir, backend, *skews)) for shard in range(shards)]
+    else:
+        tasks = [("couchbase", (shard, patient_count, seed, today, batch_size, max_in_flight, backend, *skews))
+                 for shard in range(shards)]
+
+    started = time.perf_counter()
+    totals = {}
+    initializer = _connect_worker if output == "couchbase" else None
+    with multiprocessing.Pool(workers, initializer=initializer) as pool:
+        for done, result in enumerate(pool.imap_unordered(_run_shard, tasks), start=1):
+            if output == "ndjson":
+                for doc_type, count in result.items():
+                    totals[doc_type] = totals.get(doc_type, 0) + count
+            else:
+                totals["inserted"] = totals.get("inserted", 0) + result[0]
+                totals["errors"] = totals.get("errors", 0) + result[1]
+            elapsed = time.perf_counter() - started
+            documents = sum(v for k, v in totals.items() if k != "errors")
+            print(f"  shard {done}/{shards} done: {documents:,} documents ({documents / elapsed:,.0f} docs/s)")
+        # let the workers exit normally (not terminate()) so their connections are closed
+        pool.close()
+        pool.join()
+
+    print("\n=== Summary ===")
+    for name, count in totals.items():
+        print(f"{name}: {count:,}")
+    if output == "ndjson":
+        print(f"\nNDJSON written to {out_dir}/<type>/shard-*.ndjson. Import with, e.g.:")
+        key_patterns = {"patient": "patient_%id%", "test": "test_%id%",
+                        "prescription": "prescription_%patient_id%_%largo_code%_%valid_from%"}
+        for doc_type, pattern in key_patterns.items():
+            print(f"  for f in {out_dir}/{doc_type}/*.ndjson; do cbimport json -c {COUCHBASE_CONNECTION_STRING} "
+                  f"-u {COUCHBASE_USERNAME} -p <password> -b {BUCKET_NAME} -f lines -d file://$f -g '{pattern}'; done")
+    return totals
+
 def connect_to_couchbase():
-    """Establish connection to Couchbase"""
+    """Establish connection to Couchbase; returns (cluster, default collection), or (None, None)"""
     try:
         # Configure authentication
         auth = PasswordAuthenticator(COUCHBASE_USERNAME, COUCHBASE_PASSWORD)
@@ -188,78 +510,113 @@ def connect_to_couchbase():
         bucket = cluster.bucket(BUCKET_NAME)
         collection = bucket.default_collection()
         
-        return collection
+        return cluster, collection
     except Exception as e:
         print(f"Error connecting to Couchbase: {e}")
-        return None
+        return None, None
 
-def insert_documents(collection, documents, doc_type):
-    """Insert documents into Couchbase collection"""
-    success_count = 0
-    error_count = 0
-    
-    print(f"Inserting {len(documents)} {doc_type} documents...")
-    
-    for doc in documents:
-        try:
-            # Use the document ID as the key
-            key = f"{doc_type}_{doc['id']}"
-            collection.insert(key, doc)
-            success_count += 1
-            
-            if success_count % 10 == 0:
-                print(f"Inserted {success_count} {doc_type} documents...")
-                
-        except Exception as e:
-            print(f"Error inserting {doc_type} document {doc['id']}: {e}")
-            error_count += 1
-    
-    print(f"Completed {doc_type} insertion: {success_count} successful, {error_count} errors")
-    return success_count, error_count
-
-def generate_and_insert_test_data():
-    """Main function to generate and insert all test data"""
-    print("=== Couchbase Test Data Generator ===")
-    print(f"Target bucket: {BUCKET_NAME}")
-    print(f"Generating data for 100 patients...")
-    
-    # Connect to Couchbase
-    collection = connect_to_couchbase()
-    if not collection:
-        print("Failed to connect to Couchbase. Please check your configuration.")
-        return
-    
-    # Generate data
-    print("\n1. Generating patients...")
-    patients = generate_patients(100)
-    print(f"Generated {len(patients)} patients")
-    
-    print("\n2. Generating tests...")
-    tests = generate_tests(patients)
-    print(f"Generated {len(tests)} tests")
-    
-    print("\n3. Generating prescriptions...")
-    prescriptions = generate_prescriptions(patients)
-    print(f"Generated {len(prescriptions)} prescriptions")
-    
-    # Insert data into Couchbase
-    print("\n=== Inserting Data into Couchbase ===")
-    
-    # Insert patients
-    patient_success, patient_errors = insert_documents(collection, patients, "patient")
-    
-    # Insert tests
-    test_success, test_errors = insert_documents(collection, tests, "test")
-    
-    # Insert prescriptions
-    prescription_success, prescription_errors = insert_documents(collection, prescriptions, "prescription")
-    
-    # Summary
-    print("\n=== Summary ===")
-    print(f"Patients: {patient_success} inserted, {patient_errors} errors")
-    print(f"Tests: {test_success} inserted, {test_errors} errors")
-    print(f"Prescriptions: {prescription_success} inserted, {prescription_errors} errors")
-    print(f"Total documents: {patient_success + test_success + prescription_success}")
+def document_key(doc, doc_type):
+    """Deterministic document key; prescriptions have no id, so they are keyed by patient, largo code and date"""
+    if "id" in doc:
+        return f"{doc_type}_{doc['id']}"
+    return f"{doc_type}_{doc['patient_id']}_{doc['largo_code']}_{doc['valid_from']}"
+
+class LoadStats:
+    """
+    Throughput and latency counters for the bulk loader. Latencies are per
+    insert_multi call (the SDK does not time the inserts inside it), so they
+    are an upper bound on the latency of each insert of the batch.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.success = 0
+        self.errors = 0
+        self.retries = 0
+        self.batch_latencies = []
+        self._lock = threading.Lock()
+
+    def record(self, success=0, errors=0, retries=0, latency=None):
+        with self._lock:
+            self.success += success
+            self.errors += errors
+            self.retries += retries
+            if latency is not None:
+                self.batch_latencies.append(latency)
+
+    def percentile(self, pct):
+        if not self.batch_latencies:
+            return 0.0
+        ordered = sorted(self.batch_latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.success / elapsed if elapsed else 0.0
+        return (f"{self.success} ok, {self.errors} errors, {self.retries} retried in {elapsed:.1f}s "
+                f"({rate:,.0f} docs/s, latency per insert_multi batch p50 {self.percentile(50) * 1000:.1f} ms / "
+                f"p99 {self.percentile(99) * 1000:.1f} ms)")
+
+def insert_batch(collection, batch, stats, max_retries=MAX_RETRIES):
+    """Insert one batch with insert_multi, retrying only the keys that failed temporarily"""
+    pending = batch
+    for attempt in range(max_retries + 1):
+        started = time.perf_counter()
+        result = collection.insert_multi(pending)
+        latency = time.perf_counter() - started
+        failures = {} if result.all_ok else result.exceptions
+        retry = {key: pending[key] for key, exc in failures.items() if isinstance(exc, RETRYABLE_ERRORS)}
+        for key, exc in failures.items():
+            if key not in retry:
+                print(f"Error inserting document {key}: {exc}")
+        final_attempt = attempt == max_retries
+        stats.record(
+            success=len(pending) - len(failures),
+            errors=len(failures) - (0 if final_attempt else len(retry)),
+            retries=0 if final_attempt else len(retry),
+            latency=latency,
+        )
+        if not retry or final_attempt:
+            return
+        time.sleep(min(0.05 * 2 ** attempt, 2.0))
+        pending = retry
+
+def bulk_insert_documents(collection, documents, doc_type, batch_size=BATCH_SIZE, max_in_flight=MAX_IN_FLIGHT,
+                          report_every=100000, stats=None):
+    """
+    Insert documents with batched insert_multi calls, keeping up to
+    `max_in_flight` batches running concurrently. `documents` may be any
+    iterable (including a generator), so it is never materialised in memory.
+    With `doc_type=None` each document's own `type` field is used for its key.
+    """
+    stats = stats or LoadStats()
+    label = doc_type or "all"
+    print(f"Bulk inserting {label} documents (batch {batch_size}, {max_in_flight} in flight)...")
+    next_report = report_every
+    in_flight = set()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        batch = {}
+        for doc in documents:
+            batch[document_key(doc, doc_type or doc["type"])] = doc
+            if len(batch) < batch_size:
+                continue
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            in_flight.add(executor.submit(insert_batch, collection, batch, stats))
+            batch = {}
+            if report_every and stats.success + stats.errors >= next_report:
+                print(f"  {label}: {stats.summary()}")
+                next_report += report_every
+        if batch:
+            in_flight.add(executor.submit(insert_batch, collection, batch, stats))
+        for future in in_flight:
+            future.result()
+
+    print(f"Completed {label} bulk insertion: {stats.summary()}")
+    return stats.success, stats.errors
 
 def preview_sample_data():
     """Preview sample data without inserting into database"""
@@ -279,8 +636,34 @@ def preview_sample_data():
     print(json.dumps(sample_data, indent=2))
 
 if __name__ == "__main__":
-    # Uncomment the line below to preview sample data
-    # preview_sample_data()
-    
-    # Generate and insert test data
-    generate_and_insert_test_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate medical test data and load it into Couchbase.")
+    parser.add_argument("--preview", action="store_true", help="print a small sample instead of inserting")
+    parser.add_argument("--scale-factor", type=float, default=0.001,
+                        help=f"dataset size; 1.0 = {PATIENTS_PER_SCALE_FACTOR:,} patients (default 0.001 = 100 patients)")
+    parser.add_argument("--patients", type=int, help="exact number of patients (overrides --scale-factor)")
+    parser.add_argument("--output", choices=["couchbase", "ndjson"], default="couchbase",
+                        help="load directly into Couchbase or write NDJSON files for cbimport")
+    parser.add_argument("--out-dir", default="dataset", help="directory for --output ndjson")
+    parser.add_argument("--seed", type=int, default=0, help="base seed; each shard derives its own seed from it")
+    parser.add_argument("--anchor-date", help="YYYY-MM-DD used as 'today' for generated dates (default: today)")
+    parser.add_argument("--workers", type=int, help="generator processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="documents per insert_multi call")
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT, help="concurrent batches per process")
+    parser.add_argument("--backend", choices=["python", "numpy"], default="python",
+                        help="numpy draws whole columns per shard with skewed, realistic distributions")
+    parser.add_argument("--test-skew", type=float, default=TEST_TYPE_SKEW,
+                        help="Zipf exponent of test types for the numpy backend (0 = uniform)")
+    parser.add_argument("--medicine-zipf", type=float, default=MEDICINE_ZIPF,
+                        help="Zipf exponent of prescribed medicines for the numpy backend (0 = uniform)")
+    args = parser.parse_args()
+
+    if args.preview:
+        preview_sample_data()
+    else:
+        patient_count = args.patients if args.patients is not None else round(args.scale_factor * PATIENTS_PER_SCALE_FACTOR)
+        today = datetime.strptime(args.anchor_date, "%Y-%m-%d") if args.anchor_date else None
+        print("=== Couchbase Test Data Generator ===")
+        print(f"Target: {BUCKET_NAME if args.output == 'couchbase' else args.out_dir}")
+        generate_scaled_dataset(patient_count, output=args.output, out_dir=args.out_dir, seed=args.seed, today=today,
+                                workers=args.workers, batch_size=args.batch_size, max_in_flight=args.in_flight,
+                                backend=args.backend, test_skew=args.test_skew, medicine_zipf=args.medicine_zipf)
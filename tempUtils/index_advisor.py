@@ -0,0 +1,393 @@
+import argparse
+import json
+import os
+import re
+import sys
+
+# EXPLAIN-based index advisor for SAMPLE_QUERIES.
+#
+# For every query the advisor looks at the plan (live via EXPLAIN, or from
+# recorded EXPLAIN JSON fixtures for offline runs), flags primary scans,
+# fetches after an index scan and intersect scans, and proposes a covering or
+# partial (`WHERE type = ...`) index shaped after the query's predicates. It
+# also flags INDEX_DEFINITIONS entries that are a key prefix of another one.
+
+# The plan walking is shared with the app's cost guard (query_guard.py, at the repository root)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from query_guard import INDEX_SCAN_OPERATORS, PRIMARY_SCAN_OPERATORS, iter_operators
+
+_IDENT = r"`?([A-Za-z_][\w-]*)`?"
+_FIELD_RE = re.compile(rf"^(?:{_IDENT}\.)?{_IDENT}$")
+_LITERAL_RE = re.compile(r"^(?:'[^']*'|\"[^\"]*\"|-?\d+(?:\.\d+)?|TRUE|FALSE|NULL|\?|\$\w+)$", re.IGNORECASE)
+_AND = r"\s+AND\s+"
+_COMMA = r"\s*,\s*"
+_STRING_RE = re.compile(r"^(?:'([^']*)'|\"([^\"]*)\")$")
+_NAME_UNSAFE_RE = re.compile(r"[^A-Za-z0-9_]")
+_KEYSPACE_RE = re.compile(r"\b(FROM|JOIN)\s+((?:`[^`]+`|\w+)(?:\.(?:`[^`]+`|\w+))*)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|LEFT\b|INNER\b|GROUP\b|ORDER\b|LIMIT\b)(\w+))?", re.IGNORECASE)
+
+# --- Plan analysis ---
+
+def analyze_plan(plan):
+    """Summarize the access paths of an EXPLAIN plan"""
+    if isinstance(plan, list):
+        plan = plan[0] if plan else {}
+    plan = plan.get("plan", plan)
+    summary = {"primary_scans": [], "index_scans": [], "covering": [], "fetch": False, "intersect_scan": False, "issues": []}
+    for op in iter_operators(plan):
+        name = op["#operator"]
+        alias = op.get("as") or op.get("keyspace", "")
+        if name in PRIMARY_SCAN_OPERATORS:
+            summary["primary_scans"].append(alias)
+        elif name in INDEX_SCAN_OPERATORS:
+            summary["index_scans"].append({"alias": alias, "index": op.get("index")})
+            if op.get("covers"):
+                summary["covering"].append(op.get("index"))
+        elif name == "Fetch":
+            summary["fetch"] = True
+        elif name == "IntersectScan":
+            summary["intersect_scan"] = True
+    if summary["primary_scans"]:
+        summary["issues"].append(f"PrimaryScan on {', '.join(a or '?' for a in summary['primary_scans'])}")
+    if summary["intersect_scan"]:
+        summary["issues"].append("IntersectScan: several indexes combined where one composite index would do")
+    if summary["fetch"] and summary["index_scans"]:
+        summary["issues"].append("Fetch after index scan (index is not covering)")
+    return summary
+
+# --- Query shape extraction ---
+
+def _split_top_level(text, separator):
+    """Split on a separator regex (e.g. AND, a comma) outside parentheses and quotes"""
+    parts, depth, quote, start = [], 0, None, 0
+    pattern = re.compile(separator, re.IGNORECASE)
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            quote = None if ch == quote else quote
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0:
+            match = pattern.match(text, i)
+            if match:
+                parts.append(text[start:i])
+                start = i = match.end()
+                continue
+        i += 1
+    parts.append(text[start:])
+    return [part.strip() for part in parts if part.strip()]
+
+def _clause(statement, start, stops):
+    match = re.search(rf"\b{start}\b(.*?)(?=\b(?:{'|'.join(stops)})\b|$)", statement, re.IGNORECASE | re.DOTALL)
+    return match.group(1).strip() if match else ""
+
+def _field(expr, default_alias):
+    match = _FIELD_RE.match(expr.strip())
+    if not match:
+        return None
+    alias, name = match.groups()
+    return (alias or default_alias, name)
+
+def extract_query_shape(statement):
+    """
+    Extract, per keyspace alias, the equality, range, join and ORDER BY fields
+    of a N1QL statement, plus whether its projection could be covered.
+    """
+    statement = " ".join(statement.split())
+    keyspaces = [(m.group(2), m.group(3) or "") for m in _KEYSPACE_RE.finditer(statement)]
+    aliases = [alias for _, alias in keyspaces]
+    default_alias = aliases[0] if len(aliases) == 1 else ""
+    shape = {
+        alias: {"keyspace": [part.strip("`") for part in re.findall(r"`[^`]+`|\w+", keyspace)],
+                "eq": {}, "range": [], "order": [], "project": [], "coverable": True}
+        for keyspace, alias in keyspaces
+    }
+
+    conditions = []
+    where = _clause(statement, "WHERE", ["GROUP BY", "ORDER BY", "LIMIT", "OFFSET"])
+    if where:
+        conditions.extend(_split_top_level(re.sub(r"\bBETWEEN\s+(\S+)\s+AND\s+", r"BETWEEN \1 ~ ", where, flags=re.IGNORECASE), _AND))
+    for on in re.findall(r"\bON\s+(.*?)(?=\b(?:LEFT|INNER|JOIN|WHERE|GROUP BY|ORDER BY|LIMIT)\b|$)", statement, re.IGNORECASE):
+        conditions.extend(_split_top_level(on.strip(), _AND))
+
+    for condition in conditions:
+        match = re.match(r"^(.+?)\s*(=|==|>=|<=|>|<|\bBETWEEN\b|\bLIKE\b)\s*(.+)$", condition, re.IGNORECASE)
+        if not match:
+            continue
+        left, op, right = match.group(1), match.group(2).upper(), match.group(3)
+        lfield, rfield = _field(left, default_alias), _field(right, default_alias)
+        if op in ("=", "==") and lfield and rfield and lfield[0] != rfield[0]:
+            # join predicate: the key is an equality lookup on whichever side is joined
+            for alias, name in (lfield, rfield):
+                if alias in shape and alias != aliases[0]:
+                    shape[alias]["eq"].setdefault(name, None)
+        elif op in ("=", "==") and lfield and _LITERAL_RE.match(right.strip()):
+            if lfield[0] in shape:
+                shape[lfield[0]]["eq"][lfield[1]] = right.strip()
+        elif lfield and lfield[0] in shape:
+            shape[lfield[0]]["range"].append(lfield[1])
+
+    order = _clause(statement, "ORDER BY", ["LIMIT", "OFFSET"])
+    for item in _split_top_level(order, _COMMA):
+        field = _field(re.sub(r"\s+(ASC|DESC)$", "", item, flags=re.IGNORECASE), default_alias)
+        if field and field[0] in shape:
+            shape[field[0]]["order"].append(field[1])
+
+    projection = _clause(statement, "SELECT", ["FROM"])
+    for item in _split_top_level(projection, _COMMA):
+        expr = re.sub(r"\s+AS\s+\w+$", "", item, flags=re.IGNORECASE).strip()
+        field = _field(expr, default_alias)
+        if field and field[0] in shape:
+            shape[field[0]]["project"].append(field[1])
+            continue
+        for alias in aliases:
+            bare = alias and re.search(rf"(?<![\w.]){alias}(?![\w.])|\b{alias}\.\*", expr)
+            if "*" == expr or bare or (not alias and "*" in expr):
+                shape[alias]["coverable"] = False
+    return shape
+
+# --- Recommendations ---
+
+def _strip(field):
+    return field.strip("`")
+
+def _index_keys(definition):
+    return [_strip(f) for f in definition["fields"]]
+
+def resolve_collection(keyspace, scope=None):
+    """(scope, collection) an index on this keyspace belongs to, or None for the bucket's default collection"""
+    if len(keyspace) == 3:
+        target = (keyspace[1], keyspace[2])
+    elif len(keyspace) == 2:
+        target = tuple(keyspace)
+    elif scope and keyspace:
+        # the statement ran with a query context of bucket.scope
+        target = (scope, keyspace[0])
+    else:
+        return None
+    return None if target == ("_default", "_default") else target
+
+def recommend_index(query_name, alias_shape, summary, definitions, scope=None):
+    """Propose a covering or partial index for one keyspace alias, or None when existing indexes suffice"""
+    collection = resolve_collection(alias_shape["keyspace"], scope)
+    definitions = [d for d in definitions if ((d["scope"], d["collection"]) if d.get("collection") else None) == collection]
+    eq = dict(alias_shape["eq"])
+    type_value = eq.pop("type", None)
+    # a string constant makes a partial index; a parameter ($1, ?) can only be an index key
+    type_match = _STRING_RE.match(type_value) if type_value else None
+    type_name = next(g for g in type_match.groups() if g is not None) if type_match else None
+    keys = list(eq)
+    for name in alias_shape["range"] + alias_shape["order"]:
+        if name not in keys and name != "type":
+            keys.append(name)
+    if not keys:
+        return None
+    needed = set(keys) | set(alias_shape["project"])
+    covering = alias_shape["coverable"] and bool(alias_shape["project"])
+    if covering:
+        keys += [name for name in alias_shape["project"] if name not in keys and name != "type"]
+
+    def serves(definition):
+        fields = _index_keys(definition)
+        if definition.get("where"):
+            if type_name is None or not any(f"{q}{type_name}{q}" in definition["where"] for q in "'\""):
+                return False
+        elif type_value is not None:
+            if not fields or fields[0] != "type":
+                return False
+            fields = fields[1:]
+        lead = [k for k in keys if k in eq]
+        return fields[: len(lead)] == lead and (not covering or needed <= set(fields) | {"type"})
+
+    has_issue = bool(summary["primary_scans"]) or summary["intersect_scan"] or (summary["fetch"] and covering)
+    has_issue = has_issue or any("does not lead" in issue for issue in summary["issues"])
+    if not has_issue and any(serves(d) for d in definitions):
+        return None
+
+    suffix = "_".join(keys[:3])
+    name = f"{type_name or 'any'}_{suffix}"
+    if collection:
+        name = f"{collection[1]}_{name}"
+    if type_value is not None and type_name is None:
+        keys = ["type"] + keys
+    recommendation = {
+        "name": "idx_adv_" + _NAME_UNSAFE_RE.sub("_", name),
+        "fields": [f"`{k}`" for k in keys],
+        "description": f"Advisor: {'covering' if covering else 'partial'} index for {query_name}",
+        "priority": "HIGH" if summary["primary_scans"] else "MEDIUM",
+    }
+    if type_name is not None:
+        recommendation["where"] = f"`type` = {type_value}"
+    if collection:
+        recommendation["scope"], recommendation["collection"] = collection
+    return recommendation
+
+def find_redundant_indexes(definitions):
+    """Indexes whose keys (and WHERE clause) are a prefix of another index's keys"""
+    redundant = []
+    for a in definitions:
+        for b in definitions:
+            if a is b or a.get("where") != b.get("where"):
+                continue
+            ka, kb = _index_keys(a), _index_keys(b)
+            if len(ka) < len(kb) and kb[: len(ka)] == ka:
+                redundant.append({"index": a["name"], "covered_by": b["name"]})
+                break
+    return redundant
+
+def advise(queries, plans, definitions, scopes=None):
+    """
+    Build the advisor report from {query name: statement} and {query name:
+    EXPLAIN output}; `scopes` gives the query context scope of workload queries.
+    """
+    scopes = scopes or {}
+    report = {"queries": {}, "recommendations": [], "redundant": find_redundant_indexes(definitions), "unused": []}
+    defined = {d["name"] for d in definitions}
+    used = set()
+    seen = set()
+    for name, statement in queries.items():
+        plan = plans.get(name)
+        if plan is None:
+            report["queries"][name] = {"error": "no plan available"}
+            continue
+        summary = analyze_plan(plan)
+        shape = extract_query_shape(statement)
+        if summary["fetch"] and not any(alias_shape["coverable"] for alias_shape in shape.values()):
+            # SELECT * / whole-document projections always need the Fetch
+            summary["issues"] = [i for i in summary["issues"] if not i.startswith("Fetch")]
+        by_name = {d["name"]: d for d in definitions}
+        for scan in summary["index_scans"]:
+            alias_shape = shape.get(scan["alias"]) or (next(iter(shape.values())) if len(shape) == 1 else None)
+            definition = by_name.get(scan["index"])
+            if not alias_shape or not definition:
+                continue
+            keys = [k for k in _index_keys(definition) if k != "type"]
+            predicates = set(alias_shape["eq"]) | set(alias_shape["range"])
+            if keys and keys[0] not in predicates:
+                summary["issues"].append(f"{scan['index']} does not lead with a predicate field of this query")
+        indexes = [scan["index"] for scan in summary["index_scans"]]
+        used.update(indexes)
+        entry = {
+            "indexes": indexes,
+            "undeclared_indexes": [i for i in indexes if i not in defined],
+            "covering": summary["covering"],
+            "issues": summary["issues"],
+            "recommendations": [],
+        }
+        for alias_shape in shape.values():
+            recommendation = recommend_index(name, alias_shape, summary, definitions, scopes.get(name))
+            if recommendation:
+                entry["recommendations"].append(recommendation["name"])
+                if recommendation["name"] not in seen:
+                    seen.add(recommendation["name"])
+                    report["recommendations"].append(recommendation)
+        report["queries"][name] = entry
+    if all(name in plans for name in queries):
+        report["unused"] = sorted(defined - used)
+    return report
+
+def format_report(report, bucket="<bucket>"):
+    """Render the advisor report as text"""
+    lines = ["=== INDEX ADVISOR ==="]
+    for name, entry in report["queries"].items():
+        if "error" in entry:
+            lines.append(f"\n{name}: {entry['error']}")
+            continue
+        status = "OK" if not entry["issues"] else "; ".join(entry["issues"])
+        lines.append(f"\n{name}: uses {', '.join(entry['indexes']) or 'no secondary index'} -> {status}")
+        for index in entry["undeclared_indexes"]:
+            lines.append(f"  ! {index} is not declared in INDEX_DEFINITIONS")
+        for recommendation in entry["recommendations"]:
+            lines.append(f"  + recommend {recommendation}")
+    if report["recommendations"]:
+        lines.append("\nRECOMMENDED INDEXES:")
+        for r in report["recommendations"]:
+            where = f" WHERE {r['where']}" if r.get("where") else ""
+            keyspace = f"`{bucket}`.`{r['scope']}`.`{r['collection']}`" if r.get("collection") else f"`{bucket}`"
+            lines.append(f"  CREATE INDEX {r['name']} ON {keyspace}({', '.join(r['fields'])}){where};  -- {r['description']}")
+    if report["redundant"]:
+        lines.append("\nREDUNDANT INDEXES (key prefix of another index):")
+        for r in report["redundant"]:
+            lines.append(f"  - {r['index']} (covered by {r['covered_by']})")
+    if report["unused"]:
+        lines.append("\nINDEXES NOT CHOSEN BY ANY SAMPLE QUERY:")
+        for name in report["unused"]:
+            lines.append(f"  - {name}")
+    return "\n".join(lines)
+
+# --- Plan sources ---
+
+def explain_queries(cluster, queries, scopes=None, bucket_name=None):
+    """Run EXPLAIN for every query (in its scope's query context, if any) and return {query name: plan}"""
+    plans = {}
+    scopes = scopes or {}
+    for name, statement in queries.items():
+        try:
+            target = cluster.bucket(bucket_name).scope(scopes[name]) if scopes.get(name) else cluster
+            plans[name] = list(target.query(f"EXPLAIN {statement}").rows())
+        except Exception as e:
+            print(f"Error explaining {name}: {e}")
+    return plans
+
+def load_workload(path):
+    """
+    Load the query shapes exported by `workload_log.py --export` and return
+    ({query name: statement}, {query name: scope})
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        shapes = json.load(f)
+    return ({s["name"]: s["statement"] for s in shapes}, {s["name"]: s.get("scope") for s in shapes})
+
+def load_fixtures(directory, queries):
+    """Load recorded EXPLAIN output (<query name>.json) for offline analysis"""
+    plans = {}
+    for name in queries:
+        path = os.path.join(directory, f"{name}.json")
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                plans[name] = json.load(f)
+    return plans
+
+def save_fixtures(directory, plans):
+    os.makedirs(directory, exist_ok=True)
+    for name, plan in plans.items():
+        with open(os.path.join(directory, f"{name}.json"), 'w', encoding='utf-8') as f:
+            json.dump(plan, f, indent=2)
+
+def main():
+    from create_indexes import BUCKET_NAME, INDEX_DEFINITIONS, SAMPLE_QUERIES, connect_to_couchbase
+
+    parser = argparse.ArgumentParser(description="EXPLAIN-based index advisor for SAMPLE_QUERIES and the agent's workload.")
+    parser.add_argument("--fixtures", help="analyze recorded EXPLAIN JSON files from this directory (offline)")
+    parser.add_argument("--record", help="run EXPLAIN live and save the plans to this directory")
+    parser.add_argument("--workload", help="also analyze the query shapes exported by workload_log.py --export")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    queries, scopes = dict(SAMPLE_QUERIES), {}
+    if args.workload:
+        workload_queries, scopes = load_workload(args.workload)
+        queries.update(workload_queries)
+
+    if args.fixtures:
+        plans = load_fixtures(args.fixtures, queries)
+    else:
+        cluster, _ = connect_to_couchbase()
+        if not cluster:
+            print("Failed to connect to Couchbase. Please check your configuration.")
+            return 2
+        plans = explain_queries(cluster, queries, scopes, BUCKET_NAME)
+        if args.record:
+            save_fixtures(args.record, plans)
+            print(f"Recorded {len(plans)} plans to {args.record}")
+
+    report = advise(queries, plans, INDEX_DEFINITIONS, scopes)
+    print(json.dumps(report, indent=2) if args.json else format_report(report, BUCKET_NAME))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
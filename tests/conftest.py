@@ -0,0 +1,10 @@
+"""
+The app's modules live at the top of the repository (and the tooling in
+`tempUtils/`), not in a package, so both directories go on sys.path.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "tempUtils")]
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from answer_cache import AnswerCache, compatible, content_words, is_follow_up
+from result_cache import ResultCache
+
+STATEMENT = "SELECT COUNT(*) FROM b p WHERE p.`type` = 'prescription' AND p.medicine_name = 'ACAMOL'"
+
+
+@pytest.fixture
+def cache():
+    cache = AnswerCache()
+    cache.store("How many patients use ACAMOL?", "42 patients", [STATEMENT], "v1")
+    return cache
+
+
+@pytest.mark.parametrize("question", [
+    "how many patients use acamol",
+    "How many ACAMOL users are there?",
+    "number of patients taking Acamol",
+])
+def test_paraphrases_are_answered(cache, question):
+    assert cache.lookup(question, "v1")["answer"] == "42 patients"
+
+
+@pytest.mark.parametrize("question", [
+    "How many patients use ADVIL?",
+    "How many patients don't use ACAMOL?",
+    "Which patients use ACAMOL?",
+])
+def test_different_questions_are_not_answered(cache, question):
+    assert cache.lookup(question, "v1") is None
+
+
+def test_numbers_and_opposites_must_match():
+    assert not compatible(content_words("male patients born 1980"), content_words("female patients born 1980"))
+    assert not compatible(content_words("patients born 1980"), content_words("patients born 1990"))
+    assert compatible(content_words("women born in 1980"), content_words("female patients born 1980"))
+
+
+def test_follow_ups_and_schema_changes_are_not_answered(cache):
+    assert is_follow_up("and their tests?")
+    assert cache.lookup("what about their ACAMOL use", "v1") is None
+    assert cache.lookup("how many patients use acamol", "v2") is None
+
+
+def test_answers_go_stale_with_the_result_cache_types_they_read():
+    results = ResultCache()
+    generations = asyncio.run(results.current_generations())
+    cache = AnswerCache()
+    cache.store("How many patients use ACAMOL?", "42 patients", [STATEMENT], "v1", results.data_version([STATEMENT], generations))
+
+    def is_stale(entry):
+        return not results.is_current(entry["data_version"], results._generations)
+
+    asyncio.run(results.invalidate(["test"]))
+    assert cache.lookup("how many patients use acamol", "v1", is_stale)["answer"] == "42 patients"
+    asyncio.run(results.invalidate(["prescription"]))
+    assert cache.lookup("how many patients use acamol", "v1", is_stale) is None
+    assert cache.stats["stale"] == 1
@@ -0,0 +1,258 @@
+import asyncio
+import json
+import os
+import random
+import re
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+import cb_discovery
+from cb_discovery import (
+    FieldStats,
+    HyperLogLog,
+    StreamingSchemaInference,
+    infer_key_pattern,
+    normalize_infer_result,
+    parse_scopes_and_collections,
+)
+from mcp_pool import decode_tool_result
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "mcp")
+
+
+def recording(name):
+    with open(os.path.join(FIXTURES, f"{name}.json"), encoding="utf-8") as f:
+        return CallToolResult.model_validate(json.load(f))
+
+
+def recorded(name):
+    # recorded MCP tool output, decoded the way the discovery decodes it
+    return decode_tool_result(recording(name))
+
+
+def test_parse_scopes_and_collections():
+    assert parse_scopes_and_collections(recorded("scopes_and_collections")) == {
+        "_default": ["_default"],
+        "_system": ["_mobile", "_query"],
+        "clinic": ["patients", "tests"],
+    }
+    # older servers list one row per collection
+    rows = [{"scope_name": "clinic", "collection_name": "patients"}, {"scope_name": "clinic", "name": "tests"}]
+    assert parse_scopes_and_collections(rows) == {"clinic": ["patients", "tests"]}
+
+
+def test_normalize_infer_result_merges_flavors_of_a_type():
+    schemas = normalize_infer_result(recorded("infer_default"), "_default")
+    assert [(schema["type"], schema["document_count"]) for schema in schemas] == [("patient", 100), ("test", 500)]
+    test = schemas[1]
+    # the imaging flavor, named only by its Flavor text, adds its own fields
+    assert {"sample_type", "test_type", "results"} <= set(test["properties"])
+
+    def keys(spec):
+        yield from spec
+        for child in spec.get("properties", {}).values():
+            yield from keys(child)
+        if isinstance(spec.get("items"), dict):
+            yield from keys(spec["items"])
+
+    for schema in schemas:
+        assert not [key for key in keys(schema) if key.startswith(("#", "%", "$"))]
+    assert test["properties"]["results"]["items"]["properties"]["result_id"]["type"] == "string"
+
+
+def test_infer_key_pattern_from_sampled_keys():
+    rows = recorded("key_sample_patient")
+    pattern = infer_key_pattern([(row["_key"], row["doc"]) for row in rows])
+    assert pattern == {
+        "template": "patient_{id}",
+        "fields": ["id"],
+        "examples": ["patient_142070181", "patient_233773662", "patient_330193295"],
+    }
+
+    # keys that follow no single template have no pattern
+    mixed = [(f"{row['doc']['gender']}::{i}", row["doc"]) for i, row in enumerate(rows)]
+    mixed.append(("legacy-0001", rows[0]["doc"]))
+    assert infer_key_pattern(mixed) is None
+
+
+def test_hyperloglog_estimate_is_within_its_error_bound():
+    for distinct in (100, 5000, 50000):
+        hll = HyperLogLog(precision=10)
+        for i in range(distinct):
+            hll.add(f"user-{i}")
+            hll.add(f"user-{i}")
+        # standard error is 1.04 / sqrt(2**precision); allow three of them
+        assert abs(hll.count() - distinct) / distinct < 3 * 1.04 / 32
+
+
+def test_hyperloglog_does_not_confuse_equal_looking_values_of_different_types():
+    hll = HyperLogLog()
+    for value in (1, "1", True, "true", None, "None"):
+        hll.add(value)
+    assert hll.count() == 6
+
+
+def test_reservoir_keeps_the_first_values_until_it_is_full():
+    stats = FieldStats(sample_size=5, max_fields=10, rng=random.Random(0))
+    for i in range(3):
+        stats.add(i)
+    assert stats.reservoir == [0, 1, 2]
+
+
+def test_reservoir_samples_every_position_uniformly():
+    rng = random.Random(42)
+    population, sample_size, runs = 100, 5, 2000
+    hits = [0] * population
+    for _ in range(runs):
+        stats = FieldStats(sample_size=sample_size, max_fields=10, rng=rng)
+        for i in range(population):
+            stats.add(i)
+        assert len(stats.reservoir) == sample_size
+        assert stats.seen == population
+        for value in stats.reservoir:
+            hits[value] += 1
+    expected = runs * sample_size / population
+    assert min(hits) > expected * 0.55 and max(hits) < expected * 1.45
+    # the tail of the stream is picked as often as its head
+    assert abs(sum(hits[:50]) - sum(hits[50:])) < runs * sample_size * 0.1
+
+
+def test_inference_is_reproducible_for_a_fixed_seed():
+    docs = [{"type": "patient", "age": i % 90, "tags": [f"t{i % 7}"]} for i in range(1000)]
+
+    def infer():
+        inference = StreamingSchemaInference(sample_size=5, seed=7, key_field=None)
+        inference.consume(dict(doc) for doc in docs)
+        return inference.schemas()
+
+    first = infer()
+    assert first == infer()
+    age = first[0]["properties"]["age"]
+    assert len(age["samples"]) <= 5
+    assert age["stats"]["cardinality"] == 90
+
+
+def text_result(text, error=False):
+    return CallToolResult(isError=error, content=[TextContent(type="text", text=text)])
+
+
+class FakeTool:
+    def __init__(self, name, server):
+        self.name = name
+        self.server = server
+
+    async def arun(self, **kwargs):
+        return self.server.answer(self.name, kwargs)
+
+
+class FakeServer:
+    """
+    Answers the discovery's tool calls from the recordings; `counts`,
+    `without_primary_index` and `failing` change what a collection reports.
+    """
+
+    def __init__(self):
+        self.counts = {("_default", "_default"): 100, ("clinic", "patients"): 100, ("clinic", "tests"): 500}
+        self.without_primary_index = set()
+        self.failing = set()
+        self.inferred = []
+
+    def answer(self, tool, kwargs):
+        if tool == cb_discovery.SCOPES_TOOL:
+            return recording("scopes_and_collections")
+        if tool == cb_discovery.SCHEMA_TOOL:
+            keyspace = (kwargs["scope_name"], kwargs["collection_name"])
+            self.inferred.append(keyspace)
+            if keyspace in self.failing:
+                return text_result("Error executing tool get_schema_for_collection: request timed out", error=True)
+            return recording("infer_default")
+        query = kwargs["query"]
+        keyspace = (kwargs["scope_name"], re.search(r"FROM `([^`]+)`", query).group(1))
+        if "COUNT(*)" in query:
+            return text_result(str(self.counts[keyspace]))
+        if "OBJECT_NAMES" in query:
+            if keyspace in self.without_primary_index:
+                return recording("no_primary_index")
+            return recording("fingerprint_sample_default")
+        return recording("key_sample_patient")
+
+    def get_all_tools(self):
+        return [FakeTool(name, self) for name in (cb_discovery.SCOPES_TOOL, cb_discovery.SCHEMA_TOOL, cb_discovery.QUERY_TOOL)]
+
+    async def connect_sse(self, **kwargs):
+        pass
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setenv("MCP_SERVER_URL", "http://mcp.invalid/sse")
+    monkeypatch.setattr(cb_discovery, "MCPClient", lambda **kwargs: server)
+    return server
+
+
+def discover(server, output, scopes=("_default", "clinic"), incremental=False):
+    server.inferred = []
+    asyncio.run(cb_discovery.run_direct_discovery(scopes=scopes, output=str(output), incremental=incremental))
+    return json.loads(output.read_text(encoding="utf-8"))
+
+
+def test_direct_discovery_stores_schemas_key_patterns_and_fingerprints(server, tmp_path):
+    schema = discover(server, tmp_path / "schema_context.json")
+    assert sorted((scope, collection) for scope in schema for collection in schema[scope]) == sorted(server.counts)
+    assert sorted(server.inferred) == sorted(server.counts)
+    tests = schema["clinic"]["tests"]
+    assert [entry["type"] for entry in tests["schemas"]] == ["patient", "test"]
+    assert tests["schemas"][0]["key_pattern"]["template"] == "patient_{id}"
+    assert tests["fingerprint"]["document_count"] == 500
+    assert tests["fingerprint"]["sample_max_cas"] == 1718000000000000512
+
+
+def test_incremental_discovery_of_an_unchanged_bucket_infers_nothing(server, tmp_path):
+    output = tmp_path / "schema_context.json"
+    first = discover(server, output)
+    os.utime(output, (1000, 1000))
+    assert discover(server, output, incremental=True) == first
+    assert server.inferred == []
+    assert output.stat().st_mtime == 1000
+
+
+def test_incremental_discovery_re_infers_only_changed_collections(server, tmp_path):
+    output = tmp_path / "schema_context.json"
+    first = discover(server, output)
+    server.counts[("clinic", "tests")] = 501
+    schema = discover(server, output, scopes=("clinic",), incremental=True)
+    assert server.inferred == [("clinic", "tests")]
+    assert schema["clinic"]["tests"]["fingerprint"]["document_count"] == 501
+    assert schema["clinic"]["patients"] == first["clinic"]["patients"]
+    # scopes outside this run are kept as they were
+    assert schema["_default"] == first["_default"]
+
+
+def test_collection_without_a_primary_index_is_fingerprinted_by_its_count(server, tmp_path):
+    output = tmp_path / "schema_context.json"
+    server.without_primary_index.add(("clinic", "tests"))
+    first = discover(server, output)
+    assert first["clinic"]["tests"]["fingerprint"] == {"document_count": 500, "key_set_hash": None, "sample_max_cas": None}
+
+    assert discover(server, output, incremental=True) == first
+    assert server.inferred == []
+
+    server.counts[("clinic", "tests")] = 499
+    discover(server, output, incremental=True)
+    assert server.inferred == [("clinic", "tests")]
+
+
+def test_failed_inference_keeps_the_last_known_schema(server, tmp_path):
+    output = tmp_path / "schema_context.json"
+    first = discover(server, output)
+    server.counts[("clinic", "patients")] = 101
+    server.failing.add(("clinic", "patients"))
+    schema = discover(server, output, incremental=True)
+    assert server.inferred == [("clinic", "patients")]
+    # the old fingerprint is kept too, so the next run tries again
+    assert schema == first
@@ -0,0 +1,65 @@
+import json
+
+from conversation_memory import QUESTION_MARKER, compact_history, digest_tool_result, split_turns
+
+
+def turn(number, answer_chars=40, tool_rows=0):
+    messages = [{"role": "user", "content": f"SCHEMA CONTEXT ...{QUESTION_MARKER}question {number}?"}]
+    if tool_rows:
+        call = {"id": f"call-{number}", "type": "function", "function": {"name": "query", "arguments": "{}"}}
+        rows = json.dumps([{"id": str(i), "name": "Carol Anderson"} for i in range(tool_rows)])
+        messages.append({"role": "assistant", "content": None, "tool_calls": [call]})
+        messages.append({"role": "tool", "tool_call_id": f"call-{number}", "content": rows})
+    messages.append({"role": "assistant", "content": f"answer {number} " + "x" * answer_chars})
+    return messages
+
+
+def test_tool_calls_stay_in_the_turn_of_their_results():
+    messages = turn(1, tool_rows=2) + turn(2)
+    turns = split_turns(messages)
+    assert [len(t) for t in turns] == [4, 2]
+    assert turns[0][1]["tool_calls"][0]["id"] == turns[0][2]["tool_call_id"]
+
+
+def test_history_within_budget_is_only_stripped_of_old_schema_context():
+    messages = turn(1) + turn(2)
+    history = compact_history(messages, token_budget=4000)
+    assert [m["content"] for m in history if m["role"] == "user"] == ["question 1?", messages[2]["content"]]
+    assert history[-2:] == messages[-2:]
+
+
+def test_turns_over_the_budget_go_into_the_summary():
+    messages = [m for number in range(1, 7) for m in turn(number, answer_chars=400)]
+    history = compact_history(messages, token_budget=600, summary_tokens=200)
+    summary = history[0]
+    assert summary["role"] == "system" and summary["content"].startswith("Summary of the earlier conversation:")
+    assert "- Q: question 1? -> A: answer 1" in summary["content"]
+    # the current turn is sent verbatim, the most recent older turns that fit are kept whole
+    assert history[-2:] == messages[-2:]
+    assert [m["content"] for m in history[1:-2] if m["role"] == "user"] == ["question 4?", "question 5?"]
+    assert "question 3?" in summary["content"] and "question 4?" not in summary["content"]
+
+
+def test_summary_notes_how_many_earlier_turns_it_leaves_out():
+    messages = [m for number in range(1, 21) for m in turn(number, answer_chars=400)]
+    history = compact_history(messages, token_budget=300, summary_tokens=120)
+    lines = history[0]["content"].splitlines()[1:]
+    shown = [line for line in lines if line.startswith("- Q:")]
+    assert lines[0] == f"- ({19 - len(shown)} earlier turns not shown)"
+    # the most recent of the summarised turns are the ones listed
+    assert shown[-1].startswith("- Q: question 19?")
+
+
+def test_large_tool_results_of_older_turns_are_digested():
+    messages = turn(1, tool_rows=200) + turn(2)
+    history = compact_history(messages, token_budget=4000, tool_result_chars=1500)
+    digest = next(m["content"] for m in history if m["role"] == "tool")
+    assert digest.startswith("[earlier tool result omitted: 200 rows, fields id, name, ")
+    assert history[1]["tool_calls"][0]["id"] == "call-1"
+
+
+def test_digest_of_a_shaped_result_keeps_its_row_count_and_columns():
+    shaped = 'rows: 1200 (first 50 shown)\ncolumns: ["id","name"]\n["1","Carol Anderson"]'
+    digest = digest_tool_result(shaped)
+    assert digest.startswith('[earlier tool result omitted: 1200 rows, fields "id","name", ')
+    assert f"{len(shaped)} chars" in digest
@@ -0,0 +1,109 @@
+import asyncio
+import os
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+import fast_path
+import prepared_statements
+import query_tools
+from fast_path import FastPath, render_rows
+from schema_registry import SchemaRegistry
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "schema_context.json")
+
+
+@pytest.fixture
+def fast(monkeypatch):
+    registry = SchemaRegistry(SCHEMA_PATH)
+    monkeypatch.setattr(fast_path, "get_schema_registry", lambda: registry)
+    return FastPath()
+
+
+def matched(fast, question):
+    found = fast.match(question)
+    return (found[0].name, found[2]) if found else None
+
+
+def test_patient_lookups(fast):
+    assert matched(fast, "show me patient 142070181") == ("patient_by_id", ["142070181"])
+    assert matched(fast, "Tests of patient 142070181?") == ("patient_tests", ["142070181"])
+    assert matched(fast, "patient 142070181's prescriptions") == ("patient_prescriptions", ["142070181"])
+
+
+def test_medicine_slot_only_takes_known_medicines(fast):
+    assert matched(fast, "how many aspirin prescriptions are there?") == ("medicine_prescription_count", ["ASPIRIN"])
+    assert matched(fast, "who is taking Warfarin") == ("medicine_prescriptions", ["WARFARIN"])
+    assert matched(fast, "show me female patients") is None
+    assert matched(fast, "how many chronic patients") is None
+
+
+def test_configured_medicines_replace_the_default(fast, monkeypatch):
+    monkeypatch.setenv("FAST_PATH_MEDICINES", "Insulin, Ozempic")
+    assert matched(fast, "patients on ozempic") == ("medicine_prescriptions", ["OZEMPIC"])
+    assert matched(fast, "patients on aspirin") is None
+
+
+def test_gender_and_years(fast):
+    assert matched(fast, "list women born between 1990 and 1980") == ("patients_by_gender_and_years", ["female", 1980, 1990])
+    assert matched(fast, "how many male patients were born from 1950 to 1960") == (
+        "patient_count_by_gender_and_years", ["male", 1950, 1960],
+    )
+    assert matched(fast, "what is the average age of patients") is None
+
+
+def test_patient_by_id_is_a_kv_get_with_the_shipped_schema(fast, monkeypatch):
+    class Store:
+        async def get_many(self, scope, collection, keys):
+            self.keys = keys
+            return {key: {"id": "142070181", "name": "Carol Anderson", "type": "patient"} for key in keys}
+
+    store = Store()
+    monkeypatch.setattr(fast_path, "get_kv_store", lambda: store)
+    answer = asyncio.run(fast.answer("show me patient 142070181"))
+    assert store.keys == ["patient_142070181"]
+    assert "Carol Anderson" in answer
+    assert fast.metrics.summary()["by_template"] == {"patient_by_id": 1}
+
+
+def test_result_cut_by_the_template_limit_is_shown_as_incomplete():
+    rows = [{"id": str(i)} for i in range(500)]
+    capped = render_rows("Patients born 1950-1990", rows, limit=500)
+    assert capped.startswith("**Patients born 1950-1990** (500+ found)")
+    assert capped.endswith("…and 480+ more.")
+    assert render_rows("Patients born 1950-1990", rows[:30], limit=500).startswith("**Patients born 1950-1990** (30 found)")
+
+
+class ErrorPool:
+    """MCP pool whose query tool prepares statements but answers every EXECUTE with an error result."""
+
+    def __init__(self):
+        self.statements = []
+
+    async def get_tools(self):
+        return []
+
+    async def call_tool(self, name, **kwargs):
+        self.statements.append(kwargs["query"])
+        if kwargs["query"].startswith("PREPARE"):
+            return CallToolResult(content=[TextContent(type="text", text='{"name": "cbmcp_x"}')])
+        return CallToolResult(isError=True, content=[TextContent(type="text", text="Error executing tool run_sql_plus_plus_query: timeout")])
+
+
+def test_error_result_falls_back_to_the_agent(fast, monkeypatch):
+    pool = ErrorPool()
+    monkeypatch.setenv("QUERY_CACHE_ENABLED", "false")
+    monkeypatch.setattr(prepared_statements, "_cache", None)
+    monkeypatch.setattr(query_tools, "get_pool", lambda: pool)
+    assert asyncio.run(fast.answer("list women born between 1980 and 1990")) is None
+    assert pool.statements[-1].startswith("EXECUTE")
+    assert fast.metrics.fallbacks == {"patients_by_gender_and_years": 1}
+
+
+def test_rows_that_are_not_objects_fall_back_to_the_agent(fast, monkeypatch):
+    async def run_prepared(scope, name, statement, params=()):
+        return [1200]
+
+    monkeypatch.setattr(fast_path, "run_prepared", run_prepared)
+    assert asyncio.run(fast.answer("how many male patients were born from 1950 to 1960")) is None
+    assert fast.metrics.fallbacks == {"patient_count_by_gender_and_years": 1}
@@ -0,0 +1,43 @@
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+from generate_test_data1 import MEDICINES, TEST_RESULTS, TEST_TYPES, shard_documents
+
+pytest.importorskip("numpy")
+
+TODAY = datetime(2025, 1, 1)
+
+
+def documents(backend, **skews):
+    by_type = {"patient": [], "test": [], "prescription": []}
+    for doc in shard_documents(0, 300, 7, TODAY, backend, **skews):
+        by_type[doc["type"]].append(doc)
+    return by_type
+
+
+def field_types(docs):
+    return {(key, type(value).__name__) for doc in docs for key, value in doc.items()}
+
+
+def test_numpy_documents_have_the_shape_of_the_python_ones():
+    python, vectorized = documents("python"), documents("numpy")
+    assert [p["id"] for p in python["patient"]] == [p["id"] for p in vectorized["patient"]]
+    for doc_type in python:
+        assert field_types(python[doc_type]) == field_types(vectorized[doc_type]), doc_type
+    for test in vectorized["test"]:
+        expected = [r["result_id"] for r in TEST_RESULTS.get(test["test_type"], [{"result_id": "status"}])]
+        assert [r["result_id"] for r in test["results"]] == expected
+        assert all(isinstance(r["result_value"], str) for r in test["results"])
+    dates = [t["result_date"] for t in python["test"] + vectorized["test"]]
+    assert "2023-01-02" <= min(dates) and max(dates) <= "2025-01-01"
+
+
+def test_distributions_are_configurable():
+    uniform = Counter(p["medicine_name"] for p in documents("numpy", medicine_zipf=0.0)["prescription"])
+    skewed = Counter(p["medicine_name"] for p in documents("numpy", medicine_zipf=3.0)["prescription"])
+    assert skewed[MEDICINES[0]] / sum(skewed.values()) > 0.7 > uniform[MEDICINES[0]] / sum(uniform.values())
+
+    tests = Counter(t["test_type"] for t in documents("numpy", test_skew=4.0)["test"])
+    assert tests.most_common(1)[0][0] == TEST_TYPES[0]
@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+
+from index_advisor import advise, analyze_plan, format_report, load_fixtures, recommend_index
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "explain")
+DEFINITIONS = [
+    {"name": "idx_patient_demographics", "fields": ["`type`", "`gender`", "`birth_date_year`"]},
+    {"name": "idx_test_type_date", "fields": ["`type`", "`test_type`", "`result_date`"]},
+    {"name": "idx_test_patient_date", "fields": ["`type`", "`patient_id`", "`result_date`"]},
+    {"name": "idx_largo_code", "fields": ["`type`", "`largo_code`"]},
+]
+
+
+@pytest.fixture(scope="module")
+def report():
+    # each fixture is recorded EXPLAIN output; its "text" is the explained statement
+    queries = {}
+    for file_name in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, file_name), encoding="utf-8") as f:
+            queries[file_name[:-len(".json")]] = json.load(f)[0]["text"]
+    return advise(queries, load_fixtures(FIXTURES, queries), DEFINITIONS)
+
+
+def create_statements(report):
+    return [line.strip().split(";")[0] for line in format_report(report, "test-bucket1").splitlines() if "CREATE INDEX" in line]
+
+
+def test_primary_scan_gets_a_partial_covering_index(report):
+    entry = report["queries"]["primary_scan"]
+    assert entry["issues"] == ["PrimaryScan on p"]
+    assert entry["recommendations"] == ["idx_adv_prescription_quantity_patient_id"]
+    assert (
+        "CREATE INDEX idx_adv_prescription_quantity_patient_id ON `test-bucket1`(`quantity`, `patient_id`) "
+        "WHERE `type` = 'prescription'"
+    ) in create_statements(report)
+
+
+def test_covering_index_needs_nothing(report):
+    entry = report["queries"]["covering_index"]
+    assert entry["covering"] == ["idx_patient_demographics"]
+    assert entry["issues"] == [] and entry["recommendations"] == []
+
+
+def test_intersect_scan_gets_one_composite_index(report):
+    entry = report["queries"]["intersect_scan"]
+    assert entry["indexes"] == ["idx_test_type_date", "idx_test_patient_date"]
+    assert entry["issues"][0].startswith("IntersectScan")
+    assert (
+        "CREATE INDEX idx_adv_test_test_type_patient_id_result_date ON `test-bucket1`"
+        "(`test_type`, `patient_id`, `result_date`, `results`) WHERE `type` = 'test'"
+    ) in create_statements(report)
+
+
+def test_double_quoted_type_gives_a_valid_index_name(report):
+    entry = report["queries"]["double_quoted_type"]
+    assert entry["issues"] == ["Fetch after index scan (index is not covering)"]
+    assert (
+        "CREATE INDEX idx_adv_patient_gender_birth_date_year_id ON `test-bucket1`"
+        "(`gender`, `birth_date_year`, `id`, `name`) WHERE `type` = \"patient\""
+    ) in create_statements(report)
+
+
+@pytest.mark.parametrize("parameter", ["$1", "?"])
+def test_parameterised_type_leads_the_keys_instead_of_a_partial_where(parameter):
+    shape = {"keyspace": ["test-bucket1"], "eq": {"type": parameter, "gender": "$2"}, "range": [], "order": [],
+             "project": [], "coverable": True}
+    summary = {"primary_scans": ["p"], "intersect_scan": False, "fetch": True, "issues": []}
+    recommendation = recommend_index("q", shape, summary, DEFINITIONS)
+    assert recommendation["name"] == "idx_adv_any_gender"
+    assert recommendation["fields"] == ["`type`", "`gender`"]
+    assert "where" not in recommendation
+
+
+def test_only_the_recommended_indexes_are_created_and_unused_ones_listed(report):
+    assert len(create_statements(report)) == 3
+    assert report["unused"] == ["idx_largo_code"]
+
+
+def test_plan_summary_of_a_primary_scan():
+    with open(os.path.join(FIXTURES, "primary_scan.json"), encoding="utf-8") as f:
+        summary = analyze_plan(json.load(f))
+    assert summary["primary_scans"] == ["p"] and summary["fetch"] and not summary["index_scans"]
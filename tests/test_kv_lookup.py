@@ -0,0 +1,41 @@
+import asyncio
+import os
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+from kv_lookup import McpKeyValueStore, build_keys
+from schema_registry import SchemaRegistry
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "schema_context.json")
+
+
+@pytest.fixture
+def snapshot():
+    return SchemaRegistry(SCHEMA_PATH).get()
+
+
+def test_ids_resolve_to_keys_with_the_shipped_schema(snapshot):
+    assert build_keys(snapshot, "patient", ["142070181", "233773662"]) == (
+        "_default", "_default", ["patient_142070181", "patient_233773662"],
+    )
+    assert build_keys(snapshot, "test", ["t3778fd8f"]) == ("_default", "_default", ["test_t3778fd8f"])
+
+
+def test_types_without_a_key_pattern_are_rejected(snapshot):
+    with pytest.raises(ValueError, match="no key pattern"):
+        build_keys(snapshot, "invoice", ["1"])
+
+
+def test_mcp_store_decodes_the_get_document_tool_result():
+    class Pool:
+        async def get_tools(self):
+            return []
+
+        async def call_tool(self, name, document_id, **kwargs):
+            if document_id == "patient_1":
+                return CallToolResult(content=[TextContent(type="text", text='{"type": "patient", "patient_id": "1"}')])
+            return CallToolResult(isError=True, content=[TextContent(type="text", text=f"Error executing tool get_document_by_id: {document_id} not found")])
+
+    documents = asyncio.run(McpKeyValueStore(Pool()).get_many("_default", "_default", ["patient_1", "patient_2"]))
+    assert documents == {"patient_1": {"type": "patient", "patient_id": "1"}, "patient_2": None}
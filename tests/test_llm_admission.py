@@ -0,0 +1,68 @@
+import asyncio
+
+from llm_admission import AdmissionScheduler
+
+SHORT = "how many patients?"
+LONG = "list every test of every patient " * 10
+
+
+def admission_order(turns):
+    """
+    Queues `turns` ((session, prompt) pairs, in that order) behind a turn
+    holding the only slot, then releases it and returns the sessions in the
+    order their turns were admitted.
+    """
+    order = []
+
+    async def run():
+        scheduler = AdmissionScheduler(requests_per_minute=600, max_concurrent_turns=1, short_turn_tokens=10)
+        holding, release = asyncio.Event(), asyncio.Event()
+
+        async def hold():
+            async with scheduler.admit("holder", SHORT):
+                holding.set()
+                await release.wait()
+
+        async def turn(session, prompt):
+            async with scheduler.admit(session, prompt):
+                order.append(session)
+
+        holder = asyncio.create_task(hold())
+        await holding.wait()
+        tasks = [asyncio.create_task(turn(session, prompt)) for session, prompt in turns]
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == len(turns)
+        release.set()
+        await asyncio.gather(holder, *tasks)
+
+    asyncio.run(run())
+    return order
+
+
+def test_sessions_are_admitted_round_robin():
+    turns = [("a", SHORT)] * 3 + [("b", SHORT)] * 2 + [("c", SHORT)]
+    assert admission_order(turns) == ["a", "b", "c", "a", "b", "a"]
+
+
+def test_short_prompts_are_admitted_before_long_ones():
+    turns = [("a", LONG), ("b", LONG), ("a", SHORT), ("c", SHORT), ("a", SHORT)]
+    # short turns first, each priority round robin across its own sessions
+    assert admission_order(turns) == ["a", "c", "a", "a", "b"]
+
+
+def test_a_short_prompt_queued_during_a_refill_wait_goes_first():
+    async def run():
+        scheduler = AdmissionScheduler(requests_per_minute=600, short_turn_tokens=10)
+        scheduler.requests.drain(0.1)
+        order = []
+
+        async def turn(session, prompt):
+            async with scheduler.admit(session, prompt):
+                order.append(session)
+
+        long_turn = asyncio.create_task(turn("a", LONG))
+        await asyncio.sleep(0.02)  # the long turn is the head, waiting for the bucket
+        await asyncio.gather(long_turn, turn("b", SHORT))
+        return order
+
+    assert asyncio.run(run()) == ["b", "a"]
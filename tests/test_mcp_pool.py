@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+from mcp_pool import MCPClientPool, _PooledConnection, decode_tool_result, tool_error
+
+
+def text_result(text, error=False):
+    return CallToolResult(isError=error, content=[TextContent(type="text", text=text)])
+
+
+class FakeTool:
+    def __init__(self, client):
+        self.name = "query"
+        self.client = client
+
+    async def arun(self, **kwargs):
+        return await self.client.answer(self.client, kwargs)
+
+
+class FakeClient:
+    def __init__(self, answer):
+        self.answer = answer
+        self.closed = False
+
+    def get_all_tools(self):
+        return [FakeTool(self)]
+
+    async def close(self):
+        self.closed = True
+
+
+def fake_pool(answer, size=4):
+    """A pool whose connections answer every call with `answer(client, kwargs)`."""
+    pool = MCPClientPool("http://mcp.invalid/sse", size=size)
+    pool.clients = []
+
+    async def connect():
+        client = FakeClient(answer)
+        pool.clients.append(client)
+        return _PooledConnection(client)
+
+    pool._connect = connect
+    return pool
+
+
+@pytest.mark.parametrize("result, error", [
+    (text_result('{"n": 1}'), None),
+    (text_result("Error executing tool run_sql_plus_plus_query: timeout", error=True), "Error executing tool run_sql_plus_plus_query: timeout"),
+    ('["Error executing tool run_sql_plus_plus_query: timeout"]', "Error executing tool run_sql_plus_plus_query: timeout"),
+    ("Error: doc_type is required", "Error: doc_type is required"),
+    (text_result('{"message": "failed"}', error=True), '{"message": "failed"}'),
+    ('["Error Smith", "Carol Anderson"]', None),
+    ([{"name": "Error Smith"}], None),
+])
+def test_tool_error(result, error):
+    assert tool_error(result) == error
+
+
+def test_connections_are_reused_after_release():
+    async def answer(client, kwargs):
+        return text_result(json.dumps(kwargs))
+
+    pool = fake_pool(answer)
+
+    async def calls():
+        return [await pool.call_tool("query", query=f"SELECT {i}") for i in range(3)]
+
+    results = asyncio.run(calls())
+    assert [decode_tool_result(result) for result in results] == [[{"query": f"SELECT {i}"}] for i in range(3)]
+    assert len(pool.clients) == 1 and len(pool._idle) == 1
+
+
+def test_borrowed_connections_are_bounded_by_the_pool_size():
+    active = {"now": 0, "max": 0}
+
+    async def answer(client, kwargs):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+        return text_result("[]")
+
+    pool = fake_pool(answer, size=2)
+
+    async def calls():
+        await asyncio.gather(*(pool.call_tool("query", query="SELECT 1") for _ in range(6)))
+
+    asyncio.run(calls())
+    assert active["max"] == 2
+    assert len(pool.clients) == 2
+
+
+def test_connection_failure_is_retried_once_on_a_new_connection():
+    async def answer(client, kwargs):
+        if client is pool.clients[0]:
+            # what the MCP client returns when the session died while the connection was idle
+            return text_result("ClosedResourceError during Tool Call. Arguments sent to Tool: {}.\nError: ", error=True)
+        return text_result('{"n": 1}')
+
+    pool = fake_pool(answer)
+    result = asyncio.run(pool.call_tool("query", query="SELECT 1"))
+    assert decode_tool_result(result) == [{"n": 1}]
+    assert len(pool.clients) == 2
+    assert pool.clients[0].closed and not pool.clients[1].closed
+    assert [conn.client for conn in pool._idle] == [pool.clients[1]]
+
+
+def test_raised_failure_is_retried_once_then_raised():
+    async def answer(client, kwargs):
+        raise ConnectionResetError("connection reset")
+
+    pool = fake_pool(answer)
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(pool.call_tool("query", query="SELECT 1"))
+    assert len(pool.clients) == 2
+    assert all(client.closed for client in pool.clients) and not pool._idle
+
+
+def test_server_errors_are_returned_without_retrying():
+    async def answer(client, kwargs):
+        return text_result("Error executing tool run_sql_plus_plus_query: syntax error (3000)", error=True)
+
+    pool = fake_pool(answer)
+    result = asyncio.run(pool.call_tool("query", query="SELEC 1"))
+    assert result.isError
+    assert len(pool.clients) == 1 and not pool.clients[0].closed
+
+
+def test_closed_pool_refuses_calls_and_closes_idle_connections():
+    async def answer(client, kwargs):
+        return text_result("[]")
+
+    pool = fake_pool(answer)
+
+    async def run():
+        await pool.call_tool("query", query="SELECT 1")
+        await pool.close()
+        await pool.call_tool("query", query="SELECT 1")
+
+    with pytest.raises(RuntimeError, match="closed"):
+        asyncio.run(run())
+    assert pool.clients[0].closed
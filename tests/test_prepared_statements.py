@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+from prepared_statements import PreparedStatementCache, _is_missing
+
+
+def error_result(message):
+    # what the MCP query tool returns for a failed statement: it does not raise
+    return CallToolResult(isError=True, content=[TextContent(type="text", text=f"Error executing tool run_sql_plus_plus_query: {message}")])
+
+
+@pytest.mark.parametrize("message, missing", [
+    ("code 4040: No such prepared statement: cbmcp_0123abcd", True),
+    ("No such prepared statement: cbmcp_0123abcd", True),
+    ("Keyspace not found in CB datastore: default:patients (12003)", False),
+    ("document not found", False),
+    ("patient 140401 has no tests", False),
+])
+def test_only_a_dropped_prepared_statement_counts_as_missing(message, missing):
+    assert _is_missing(RuntimeError(message)) is missing
+
+
+def test_dropped_statement_is_prepared_again_but_other_errors_raise():
+    cache = PreparedStatementCache()
+    statements = []
+    failure = {}
+
+    async def run(statement):
+        statements.append(statement)
+        if statement.startswith("EXECUTE") and failure:
+            raise RuntimeError(failure.pop("error"))
+        return [{"n": 1}]
+
+    text = "SELECT COUNT(*) AS n FROM patients p WHERE p.id = $1"
+    asyncio.run(cache.execute("s", text, ["1"], run, name="cbmcp_x"))
+    failure["error"] = "4040: No such prepared statement: cbmcp_x"
+    assert asyncio.run(cache.execute("s", text, ["1"], run, name="cbmcp_x")) == [{"n": 1}]
+    assert statements[-2:] == [f"PREPARE cbmcp_x FROM {text}", 'EXECUTE cbmcp_x USING ["1"]']
+    assert cache.stats["reprepared"] == 1
+
+    failure["error"] = "Keyspace not found in CB datastore: default:patients"
+    with pytest.raises(RuntimeError, match="Keyspace not found"):
+        asyncio.run(cache.execute("s", text, ["1"], run))
+
+
+def test_dropped_statement_reported_as_an_error_result_is_prepared_again():
+    cache = PreparedStatementCache()
+    statements = []
+    failure = {}
+
+    async def run(statement):
+        statements.append(statement)
+        if statement.startswith("EXECUTE") and failure:
+            return error_result(failure.pop("error"))
+        return [{"n": 1}]
+
+    text = "SELECT COUNT(*) AS n FROM patients p WHERE p.id = $1"
+    asyncio.run(cache.execute("s", text, ["1"], run, name="cbmcp_x"))
+    failure["error"] = "No such prepared statement: cbmcp_x (4040)"
+    assert asyncio.run(cache.execute("s", text, ["1"], run, name="cbmcp_x")) == [{"n": 1}]
+    assert statements[-2:] == [f"PREPARE cbmcp_x FROM {text}", 'EXECUTE cbmcp_x USING ["1"]']
+    assert cache.stats["reprepared"] == 1
+
+    # any other error result is the statement's own error
+    failure["error"] = "Keyspace not found in CB datastore: default:patients (12003)"
+    result = asyncio.run(cache.execute("s", text, ["1"], run, name="cbmcp_x"))
+    assert result.isError and cache.stats["reprepared"] == 1
+
+
+def test_prepare_answered_with_an_error_result_falls_back_to_the_ad_hoc_statement():
+    cache = PreparedStatementCache()
+    statements = []
+
+    async def run(statement):
+        statements.append(statement)
+        if statement.startswith("PREPARE"):
+            return error_result("syntax error - line 1, column 8 (3000)")
+        return [{"n": 1}]
+
+    text = "SELECT COUNT(*) AS n FROM patients p WHERE p.id = $1"
+    adhoc = "SELECT COUNT(*) AS n FROM patients p WHERE p.id = '1'"
+    assert asyncio.run(cache.execute("s", text, ["1"], run, fallback=adhoc)) == [{"n": 1}]
+    assert asyncio.run(cache.execute("s", text, ["1"], run, fallback=adhoc)) == [{"n": 1}]
+    assert statements == [f"PREPARE {statements[0].split()[1]} FROM {text}", adhoc, adhoc]
+    assert cache.stats["ad_hoc"] == 2
+
+    with pytest.raises(RuntimeError, match="syntax error"):
+        asyncio.run(PreparedStatementCache().execute("s", text, ["1"], run))
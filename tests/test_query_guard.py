@@ -0,0 +1,130 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+
+import pytest
+
+from mcp_pool import ToolFeedback
+from query_guard import QueryGuard, extract_plan, iter_operators
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "explain")
+
+
+def fixture(name):
+    # recorded EXPLAIN output; "text" is the explained statement
+    with open(os.path.join(FIXTURES, f"{name}.json"), encoding="utf-8") as f:
+        result = json.load(f)
+    return result[0]["text"], extract_plan(result)
+
+
+def operator(plan, name):
+    return next(op for op in iter_operators(plan) if op["#operator"] == name)
+
+
+def test_covering_and_intersect_scans_pass():
+    guard = QueryGuard()
+    for name in ("covering_index", "intersect_scan", "double_quoted_type"):
+        statement, plan = fixture(name)
+        assert guard.check(statement, plan) == []
+
+
+def test_primary_scan_is_rejected():
+    statement, plan = fixture("primary_scan")
+    reasons = QueryGuard().check(statement, plan)
+    assert len(reasons) == 1
+    assert "primary scan" in reasons[0] and "`p`" in reasons[0]
+
+
+def test_unbounded_index_scan_without_limit_is_rejected():
+    statement, plan = fixture("covering_index")
+    plan = copy.deepcopy(plan)
+    operator(plan, "IndexScan3")["spans"] = [{"range": []}]
+    reasons = QueryGuard().check(statement, plan)
+    assert len(reasons) == 1
+    assert "idx_patient_demographics` without bounds" in reasons[0]
+
+    # a Limit or GROUP operator bounds the result
+    for bounding in ("Limit", "InitialGroup"):
+        bounded = copy.deepcopy(plan)
+        bounded["~children"].append({"#operator": bounding})
+        assert QueryGuard().check(statement, bounded) == []
+
+
+def test_index_scan_estimated_above_max_rows_is_rejected():
+    statement, plan = fixture("double_quoted_type")
+    plan = copy.deepcopy(plan)
+    operator(plan, "IndexScan3")["optimizer_estimates"] = {"cardinality": 5000, "cost": 900}
+    assert "about 5000 rows" in QueryGuard(max_rows=1000).check(statement, plan)[0]
+    assert QueryGuard(max_rows=10000).check(statement, plan) == []
+
+
+def test_max_cost():
+    statement, plan = fixture("intersect_scan")
+    plan = copy.deepcopy(plan)
+    operator(plan, "Fetch")["optimizer_estimates"] = {"cost": 1234.5}
+    assert QueryGuard().check(statement, plan) == []
+    assert QueryGuard(max_cost=2000).check(statement, plan) == []
+    reasons = QueryGuard(max_cost=1000).check(statement, plan)
+    assert reasons == ["its estimated cost 1234 exceeds the limit of 1000; narrow the filters or project fewer fields"]
+
+
+@pytest.mark.parametrize("statement, expected", [
+    ("SELECT * FROM b WHERE type = 'x';", "SELECT * FROM b WHERE type = 'x' LIMIT 50"),
+    ("WITH a AS (SELECT 1) SELECT * FROM a", "WITH a AS (SELECT 1) SELECT * FROM a LIMIT 50"),
+    ("SELECT * FROM b LIMIT 10", None),
+    ("SELECT * FROM b LIMIT $1 OFFSET $2", None),
+    ("DELETE FROM b WHERE type = 'x'", None),
+])
+def test_add_limit(statement, expected):
+    assert QueryGuard(auto_limit=50).add_limit(statement) == expected
+
+
+def test_add_limit_is_off_by_default():
+    assert QueryGuard().add_limit("SELECT * FROM b") is None
+
+
+def run(guard, name, caplog):
+    statement, plan = fixture(name)
+    seen = []
+
+    async def call_next(kwargs):
+        seen.append(kwargs["query"])
+        return [{"plan": plan}] if kwargs["query"].startswith("EXPLAIN ") else [{"ok": 1}]
+
+    with caplog.at_level(logging.INFO, logger="query_guard"):
+        result = asyncio.run(guard.middleware({"query": statement}, call_next))
+    return result, seen
+
+
+def test_middleware_rejects_with_feedback_and_logs(caplog):
+    result, seen = run(QueryGuard(), "primary_scan", caplog)
+    assert isinstance(result, ToolFeedback)
+    assert len(seen) == 1 and seen[0].startswith("EXPLAIN ")
+    assert caplog.records[0].levelno == logging.WARNING
+    assert "rejected query" in caplog.records[0].getMessage()
+
+
+def test_middleware_runs_accepted_statements(caplog):
+    result, seen = run(QueryGuard(), "covering_index", caplog)
+    assert result == [{"ok": 1}]
+    assert seen[1] == fixture("covering_index")[0]
+    assert caplog.records == []
+
+
+def test_middleware_adds_the_automatic_limit_and_logs(caplog):
+    statement, plan = fixture("covering_index")
+    plan = copy.deepcopy(plan)
+    operator(plan, "IndexScan3")["spans"] = [{"range": []}]
+    seen = []
+
+    async def call_next(kwargs):
+        seen.append(kwargs["query"])
+        return [{"plan": plan}] if kwargs["query"].startswith("EXPLAIN ") else [{"ok": 1}]
+
+    with caplog.at_level(logging.INFO, logger="query_guard"):
+        result = asyncio.run(QueryGuard(auto_limit=50).middleware({"query": statement}, call_next))
+    assert result == [{"ok": 1}]
+    assert seen[1] == f"{statement} LIMIT 50"
+    assert caplog.records[0].levelno == logging.INFO
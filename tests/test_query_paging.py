@@ -0,0 +1,92 @@
+from query_paging import PAGE_KEY, count_query, cursor_after, page_query, plan_pages, split_keys
+
+
+def test_single_keyspace_filter_pages_by_document_key():
+    plan = plan_pages("SELECT p.name, p.gender FROM `_default` AS p WHERE p.type = 'patient';")
+    assert plan.kind == "keyset"
+    assert page_query(plan, 21) == (
+        f"SELECT p.name, p.gender, META(p).id AS {PAGE_KEY} FROM `_default` AS p "
+        "WHERE (p.type = 'patient') ORDER BY META(p).id LIMIT 21"
+    )
+    assert page_query(plan, 21, "patient::42") == (
+        f"SELECT p.name, p.gender, META(p).id AS {PAGE_KEY} FROM `_default` AS p "
+        "WHERE (p.type = 'patient') AND META(p).id > \"patient::42\" ORDER BY META(p).id LIMIT 21"
+    )
+
+
+def test_keyspace_without_alias_uses_meta_of_the_keyspace():
+    plan = plan_pages("SELECT * FROM b.s.patients")
+    assert plan.kind == "keyset"
+    assert page_query(plan, 5, "k") == f"SELECT *, META().id AS {PAGE_KEY} FROM b.s.patients WHERE META().id > \"k\" ORDER BY META().id LIMIT 5"
+
+
+def test_field_named_like_a_keyword_is_not_a_clause():
+    plan = plan_pages("SELECT p.`order`, p.order FROM b p WHERE p.x IN (SELECT RAW 1 FROM y LIMIT 1)")
+    assert plan.kind == "keyset"
+    assert plan.where == "p.x IN (SELECT RAW 1 FROM y LIMIT 1)"
+
+
+def test_own_order_by_is_kept_and_paged_within_its_limit():
+    plan = plan_pages("SELECT p.name FROM b p ORDER BY p.name LIMIT 100 OFFSET 10")
+    assert (plan.kind, plan.limit, plan.offset) == ("ordered", 100, 10)
+    assert page_query(plan, 21) == "SELECT p.name FROM b p ORDER BY p.name LIMIT 21 OFFSET 10"
+    assert page_query(plan, 21, 95) == "SELECT p.name FROM b p ORDER BY p.name LIMIT 5 OFFSET 105"
+    assert page_query(plan, 21, 100) is None
+
+
+def test_other_statements_get_an_enforced_order_within_their_own_limit():
+    plan = plan_pages("SELECT t.type, COUNT(*) AS n FROM b t GROUP BY t.type LIMIT 100 OFFSET 5")
+    assert plan.kind == "sorted"
+    assert page_query(plan, 21, 40) == (
+        "SELECT RAW q FROM (SELECT t.type, COUNT(*) AS n FROM b t GROUP BY t.type LIMIT 100 OFFSET 5) AS q "
+        "ORDER BY q LIMIT 21 OFFSET 40"
+    )
+    assert page_query(plan, 21, 90) == (
+        "SELECT RAW q FROM (SELECT t.type, COUNT(*) AS n FROM b t GROUP BY t.type LIMIT 100 OFFSET 5) AS q "
+        "ORDER BY q LIMIT 10 OFFSET 90"
+    )
+
+
+def test_limited_single_keyspace_filter_keeps_its_limit_inside_the_wrapped_query():
+    plan = plan_pages('SELECT p.name FROM patient p WHERE p.type="patient" LIMIT 200')
+    assert page_query(plan, 51) == (
+        'SELECT RAW q FROM (SELECT p.name FROM patient p WHERE p.type="patient" LIMIT 200) AS q ORDER BY q LIMIT 51 OFFSET 0'
+    )
+
+
+def test_statements_without_their_own_limit_are_only_keyset_paged():
+    # re-running them per page would read the whole result each time and hide the scan from the cost guard
+    assert plan_pages("SELECT t.type, COUNT(*) AS n FROM b t GROUP BY t.type") is None
+    assert plan_pages("SELECT p.name FROM b p ORDER BY p.name") is None
+    assert plan_pages("SELECT p.name, r.medicine_name FROM b p JOIN b r ON r.patient_id = p.id") is None
+
+
+def test_join_is_not_keyset_paged():
+    plan = plan_pages("SELECT p.name, r.medicine_name FROM b p JOIN b r ON r.patient_id = p.id WHERE p.type = 'patient' LIMIT 500")
+    assert plan.kind == "sorted"
+
+
+def test_count_query_counts_the_whole_result():
+    assert count_query(plan_pages("SELECT p.name FROM b p WHERE p.type = 'patient'")) == (
+        "SELECT RAW COUNT(*) FROM b p WHERE p.type = 'patient'"
+    )
+    assert count_query(plan_pages("SELECT p.name FROM b p ORDER BY p.name LIMIT 100")) == (
+        "SELECT RAW COUNT(*) FROM (SELECT p.name FROM b p ORDER BY p.name LIMIT 100) AS q"
+    )
+
+
+def test_statements_that_cannot_be_paged():
+    assert plan_pages("UPDATE b SET x = 1 WHERE y = 2") is None
+    assert plan_pages("SELECT a FROM b LIMIT $1") is None
+
+
+def test_keys_are_split_off_and_drive_the_next_cursor():
+    plan = plan_pages("SELECT p.id FROM b p")
+    rows, keys = split_keys(plan, [{"id": 1, PAGE_KEY: "k1"}, {"id": 2, PAGE_KEY: "k2"}])
+    assert rows == [{"id": 1}, {"id": 2}]
+    assert keys == ["k1", "k2"]
+    assert cursor_after(plan, None, keys, 2) == "k2"
+
+    sorted_plan = plan_pages("SELECT COUNT(*) FROM b LIMIT 1")
+    assert split_keys(sorted_plan, [{"n": 1}]) == ([{"n": 1}], [])
+    assert cursor_after(sorted_plan, 40, [], 20) == 60
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+import query_guard
+import result_shaping
+from mcp_pool import ToolFeedback
+from query_tools import chain, query_middlewares, record_outcome, record_statement, recording_statements
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "explain")
+
+
+def call(middleware, result, query="SELECT 1"):
+    async def call_next(kwargs):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return asyncio.run(middleware({"query": query}, call_next))
+
+
+def test_failed_tool_calls_are_counted_in_the_turn():
+    with recording_statements() as statements:
+        call(record_outcome, [{"n": 1}])
+        call(record_outcome, '{"documents": {}, "missing": []}')
+        assert statements.failures == 0
+        call(record_outcome, ToolFeedback("Query rejected: it scans the whole bucket."))
+        call(record_outcome, "Error: doc_type is required when passing ids.")
+        with pytest.raises(RuntimeError):
+            call(record_outcome, RuntimeError("connection reset"))
+    assert statements.failures == 3
+
+
+def test_error_results_count_as_failures():
+    error = CallToolResult(isError=True, content=[TextContent(type="text", text="Error executing tool run_sql_plus_plus_query: timeout")])
+    with recording_statements() as statements:
+        call(record_outcome, CallToolResult(content=[TextContent(type="text", text='{"n": 1}')]))
+        call(record_outcome, '["Carol Anderson", "Error Smith"]')
+        assert statements.failures == 0
+        call(record_outcome, error)
+        # the same error once a middleware re-encoded it as JSON rows
+        call(record_outcome, '["Error executing tool run_sql_plus_plus_query: timeout"]')
+    assert statements.failures == 2
+
+
+def test_error_result_passes_the_shaper_as_a_failure(agent_chain):
+    error = CallToolResult(isError=True, content=[TextContent(type="text", text="Error executing tool run_sql_plus_plus_query: timeout")])
+    with recording_statements() as statements:
+        result = agent_chain("SELECT p.name FROM `test-bucket1` p WHERE p.type = 'patient'", result=error)
+    assert result is error
+    assert statements.failures == 1
+
+
+def test_statements_are_recorded_only_inside_the_block():
+    call(record_statement, [], "SELECT 0")
+    with recording_statements() as statements:
+        call(record_statement, [], "SELECT 1")
+    assert statements == ["SELECT 1"]
+
+
+@pytest.fixture
+def agent_chain(monkeypatch):
+    # only the guard and the shaper, as configured from the environment
+    for name, value in {"QUERY_CACHE_ENABLED": "false", "WORKLOAD_LOG_PATH": "", "PREPARED_STATEMENTS_ENABLED": "false",
+                        "METRICS_ENABLED": "false", "RESULT_MAX_ROWS": "3"}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(query_guard, "_guard", None)
+    monkeypatch.setattr(result_shaping, "_shaper", None)
+    with open(os.path.join(FIXTURES, "covering_index.json"), encoding="utf-8") as f:
+        explained = json.load(f)
+    seen = []
+
+    def run(statement, unbounded=False, result=None):
+        plan = json.loads(json.dumps(explained[0]["plan"]))
+        if unbounded:
+            for op in query_guard.iter_operators(plan):
+                if "spans" in op:
+                    op["spans"] = [{"range": []}]
+
+        async def call_next(kwargs):
+            seen.append(kwargs["query"])
+            if kwargs["query"].startswith("EXPLAIN "):
+                return json.dumps([{"plan": plan}])
+            if result is not None:
+                return result
+            return json.dumps([{"name": f"n{i}", "__page_key": f"k{i}"} for i in range(4)])
+
+        # as instrument_tools builds it
+        return asyncio.run(chain([record_outcome] + query_middlewares())({"query": statement}, call_next))
+
+    run.seen = seen
+    return run
+
+
+def test_unbounded_select_is_rejected_before_it_is_paged(agent_chain):
+    statement = "SELECT p.name FROM `test-bucket1` p WHERE p.type = 'patient'"
+    result = agent_chain(statement, unbounded=True)
+    assert isinstance(result, ToolFeedback)
+    assert "without bounds" in str(result)
+    assert agent_chain.seen == [f"EXPLAIN {statement}"]
+
+
+def test_guarded_select_runs_as_its_first_page(agent_chain):
+    statement = "SELECT p.name FROM `test-bucket1` p WHERE p.type = 'patient'"
+    result = agent_chain(statement, unbounded=False)
+    assert result.has_more
+    assert agent_chain.seen[0] == f"EXPLAIN {statement}"
+    assert agent_chain.seen[1].endswith("ORDER BY META(p).id LIMIT 4")
+
+
+def test_workload_log_records_the_statement_as_the_agent_wrote_it(agent_chain, monkeypatch, tmp_path):
+    path = tmp_path / "workload.ndjson"
+    monkeypatch.setenv("WORKLOAD_LOG_PATH", str(path))
+    statement = "SELECT p.name FROM `test-bucket1` p WHERE p.type = 'patient'"
+    agent_chain(statement, unbounded=False)
+    with open(path, encoding="utf-8") as f:
+        logged = [json.loads(line)["statement"] for line in f]
+    # not the EXPLAIN, the keyset page or the COUNT(*) that ran for it
+    assert logged == [statement]
@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+from mcp.types import CallToolResult, TextContent
+
+from result_cache import DaprStateStore, ResultCache, cache_key, statement_types
+
+STATEMENT = "SELECT p.name FROM patients p WHERE p.`type` = 'patient' AND p.gender = 'female'"
+
+
+class MemoryStateStore(DaprStateStore):
+    """A state store that round-trips values through JSON, like the Dapr component."""
+
+    def __init__(self):
+        super().__init__("memory")
+        self.data = {}
+
+    def _get(self, key):
+        data = self.data.get(key)
+        return json.loads(data) if data else None
+
+    def _save(self, key, value, ttl):
+        self.data[key] = json.dumps(value, ensure_ascii=False, default=str)
+
+
+def run(cache, result):
+    calls = []
+
+    async def call_next(kwargs):
+        calls.append(kwargs["query"])
+        return result
+
+    value = asyncio.run(cache.middleware({"scope_name": "_default", "query": STATEMENT}, call_next))
+    return value, calls
+
+
+def test_error_text_is_not_cached():
+    cache = ResultCache()
+    assert run(cache, "Error executing query: index not found") == ("Error executing query: index not found", [STATEMENT])
+    assert run(cache, "Error executing query: index not found")[1] == [STATEMENT]
+    assert cache.stats["not_cached"] == 2
+
+
+def test_error_result_is_not_cached():
+    # decodes to ["Error executing tool ..."], which must not be replayed as rows
+    error = CallToolResult(isError=True, content=[TextContent(type="text", text="Error executing tool run_sql_plus_plus_query: timeout")])
+    cache = ResultCache()
+    assert run(cache, error) == (error, [STATEMENT])
+    assert run(cache, error)[1] == [STATEMENT]
+    assert cache.stats["not_cached"] == 2 and not cache._entries
+
+
+def test_rows_come_back_as_the_same_json_from_either_backend():
+    raw = ['{"name": "Carol Anderson", "ok": true, "x": null}', '{"name": "Nancy Adams", "ok": false, "x": 1}']
+    text = json.dumps([{"name": "Carol Anderson", "ok": True, "x": None}, {"name": "Nancy Adams", "ok": False, "x": 1}])
+    local = ResultCache()
+    assert run(local, raw) == (text, [STATEMENT])
+    assert run(local, raw) == (text, [])
+
+    store = MemoryStateStore()
+    run(ResultCache(store=store), raw)
+    # another replica only finds the entry in the state store
+    assert run(ResultCache(store=store), raw) == (text, [])
+
+
+def test_cached_hands_rows_to_direct_callers():
+    cache = ResultCache()
+
+    async def compute():
+        return '[{"n": 3}]'
+
+    assert asyncio.run(cache.cached("k", frozenset(["patient"]), compute)) == [{"n": 3}]
+    assert asyncio.run(cache.cached("k", frozenset(["patient"]), compute)) == [{"n": 3}]
+    assert cache.hit_rate == 0.5
+
+
+def test_writes_invalidate_the_types_they_touch():
+    cache = ResultCache()
+    run(cache, [{"name": "Carol Anderson"}])
+    key = cache_key("_default", STATEMENT)
+    asyncio.run(cache.invalidate(statement_types("UPDATE patients SET name = 'x' WHERE `type` IN ['patient', 'test']")))
+    assert key in cache._entries
+    assert run(cache, [{"name": "Carol Anderson"}])[1] == [STATEMENT]
@@ -0,0 +1,70 @@
+import asyncio
+import csv
+import json
+import os
+
+import result_pages
+from query_paging import PAGE_KEY, plan_pages
+
+
+def test_next_page_continues_after_the_last_key_through_the_guarded_runner(monkeypatch):
+    statements = []
+
+    async def run_checked(scope, statement, cached=True):
+        statements.append(statement)
+        return [{"id": i, PAGE_KEY: f"k{i}"} for i in (21, 22, 23)]
+
+    monkeypatch.setattr(result_pages, "run_checked", run_checked)
+    plan = plan_pages("SELECT p.id FROM b p")
+    page = asyncio.run(result_pages.fetch_page("s", plan, "k20", size=2))
+    assert statements == [f"SELECT p.id, META(p).id AS {PAGE_KEY} FROM b p WHERE META(p).id > \"k20\" ORDER BY META(p).id LIMIT 3"]
+    assert page == {"rows": [{"id": 21}, {"id": 22}], "has_more": True, "next": "k22"}
+
+
+def read_csv(path):
+    try:
+        with open(path, encoding="utf-8", newline="") as f:
+            return list(csv.DictReader(f))
+    finally:
+        os.remove(path)
+
+
+def test_export_streams_the_result_page_by_page_uncached(monkeypatch):
+    calls = []
+    keys = [f"k{i}" for i in range(5)]
+
+    async def run_checked(scope, statement, cached=True):
+        calls.append((statement, cached))
+        after = statement.split('META(p).id > "')[1].split('"')[0] if '"' in statement else ""
+        return [{"id": int(key[1:]), PAGE_KEY: key} for key in keys if key > after][:3]
+
+    monkeypatch.setattr(result_pages, "run_checked", run_checked)
+    monkeypatch.setenv("RESULT_EXPORT_PAGE_SIZE", "2")
+    written = read_csv(asyncio.run(result_pages.export_result("s", plan_pages("SELECT p.id FROM b p"), "csv")))
+    assert written == [{"id": str(i)} for i in range(5)]
+    assert [cached for _, cached in calls] == [False] * 3
+    assert [statement.endswith("LIMIT 3") for statement, _ in calls] == [True] * 3
+    assert 'META(p).id > "k3"' in calls[2][0]
+
+
+def test_export_of_an_unpaged_result_writes_the_rows_it_has(monkeypatch):
+    async def run_checked(scope, statement, cached=True):
+        raise AssertionError("not re-run")
+
+    monkeypatch.setattr(result_pages, "run_checked", run_checked)
+    rows = [{"id": 1, "results": [{"a": 1}]}, {"id": 2, "results": []}]
+    written = read_csv(asyncio.run(result_pages.export_result("s", None, "csv", rows)))
+    assert written == [{"id": "1", "results": json.dumps([{"a": 1}])}, {"id": "2", "results": "[]"}]
+
+
+def test_failed_export_leaves_no_file(monkeypatch):
+    async def run_checked(scope, statement, cached=True):
+        raise RuntimeError("QUERY NOT EXECUTED - rejected by the cost guard")
+
+    monkeypatch.setattr(result_pages, "run_checked", run_checked)
+    before = set(os.listdir(result_pages.tempfile.gettempdir()))
+    try:
+        asyncio.run(result_pages.export_result("s", plan_pages("SELECT * FROM b"), "ndjson"))
+    except RuntimeError:
+        pass
+    assert set(os.listdir(result_pages.tempfile.gettempdir())) == before
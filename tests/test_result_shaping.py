@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+from query_paging import PAGE_KEY
+from result_shaping import ResultShaper, ShapedResult
+
+
+def run_shaper(shaper, statement, rows, count=None):
+    seen = []
+
+    async def call_next(kwargs):
+        seen.append(kwargs["query"])
+        if kwargs["query"].startswith("SELECT RAW COUNT(*)"):
+            return json.dumps([count]) if count is not None else "Error: count failed"
+        return json.dumps(rows)
+
+    return asyncio.run(shaper.middleware({"scope_name": "s", "query": statement}, call_next)), seen
+
+
+def test_select_fetches_only_its_first_page():
+    shaper = ResultShaper(max_rows=3)
+    rows = [{"name": f"n{i}", PAGE_KEY: f"k{i}"} for i in range(4)]
+    result, seen = run_shaper(shaper, "SELECT p.name FROM b p WHERE p.type = 'patient'", rows)
+    assert seen[0] == f"SELECT p.name, META(p).id AS {PAGE_KEY} FROM b p WHERE (p.type = 'patient') ORDER BY META(p).id LIMIT 4"
+    assert isinstance(result, ShapedResult)
+    assert result.has_more
+    assert result.rows == [{"name": "n0"}, {"name": "n1"}, {"name": "n2"}]
+    assert result.keys == ["k0", "k1", "k2"]
+    assert result.startswith("rows: 3+ (only the first 3 were fetched; more rows exist)")
+    assert PAGE_KEY not in result
+
+
+def test_statement_bounded_by_its_own_limit_runs_as_written():
+    shaper = ResultShaper(max_rows=50)
+    result, seen = run_shaper(shaper, "SELECT p.name FROM b p LIMIT 10", [{"name": "a"}, {"name": "b"}])
+    assert seen == ["SELECT p.name FROM b p LIMIT 10"]
+    assert result.plan is None and not result.has_more
+
+
+def test_small_paged_result_is_returned_without_page_keys():
+    shaper = ResultShaper(max_rows=50)
+    result, _ = run_shaper(shaper, "SELECT p.name FROM b p", [{"name": "a", PAGE_KEY: "k"}])
+    assert json.loads(result) == [{"name": "a"}]
+
+
+def test_larger_result_reports_the_server_side_total():
+    shaper = ResultShaper(max_rows=3)
+    rows = [{"gender": "F" if i % 2 else "M", PAGE_KEY: f"k{i}"} for i in range(4)]
+    result, seen = run_shaper(shaper, "SELECT p.gender FROM b p WHERE p.type = 'patient'", rows, count=1200)
+    assert seen[1] == "SELECT RAW COUNT(*) FROM b p WHERE p.type = 'patient'"
+    assert result.startswith("rows: 1200 (only the first 3 were fetched)")
+    assert "aggregates of the first 3 rows only: " in result
+    assert result.has_more and result.rows == [{"gender": "M"}, {"gender": "F"}, {"gender": "M"}]
@@ -0,0 +1,91 @@
+import json
+import os
+
+import pytest
+
+from schema_registry import SchemaRegistry, flatten_properties
+
+SCHEMA = {
+    "_default": {
+        "_default": {
+            "schemas": [
+                {"type": "patient", "document_count": 10, "properties": {"name": {"type": "string"}}},
+                {
+                    "type": "test",
+                    "properties": {
+                        "results": {"type": "array", "items": {"properties": {"result_id": {"type": "string"}}}},
+                    },
+                },
+            ]
+        }
+    }
+}
+
+
+def write(path, data, mtime):
+    path.write_text(json.dumps(data), encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def test_snapshot_indexes_types_and_nested_property_paths(tmp_path):
+    path = tmp_path / "schema_context.json"
+    write(path, SCHEMA, 1000)
+    snapshot = SchemaRegistry(str(path)).get()
+    assert [entry.doc_type for entry in snapshot.entries] == ["patient", "test"]
+    assert snapshot.by_type["patient"][0].document_count == 10
+    assert [entry.doc_type for entry in snapshot.entries_for_property("result_id")] == ["test"]
+    assert [path for path, _ in snapshot.by_type["test"][0].fields] == ["results", "results[].result_id"]
+    with pytest.raises(TypeError):
+        snapshot.data["_default"]["extra"] = {}
+
+
+def test_flatten_properties_uses_dotted_and_array_paths():
+    properties = {"address": {"properties": {"city": {}}}, "tags": {"items": {"type": "string"}}}
+    assert [path for path, _ in flatten_properties(properties)] == ["address", "address.city", "tags"]
+
+
+def test_registry_reloads_only_when_the_digest_changes(tmp_path):
+    path = tmp_path / "schema_context.json"
+    write(path, SCHEMA, 1000)
+    registry = SchemaRegistry(str(path), check_interval=0)
+    first = registry.get()
+    assert registry.get() is first
+
+    # touching the file with identical content keeps the snapshot
+    write(path, SCHEMA, 2000)
+    assert registry.get() is first
+
+    changed = json.loads(json.dumps(SCHEMA))
+    changed["_default"]["_default"]["schemas"][0]["properties"]["gender"] = {"type": "string"}
+    write(path, changed, 3000)
+    second = registry.get()
+    assert second is not first and second.digest != first.digest
+    assert "gender" in second.by_property
+
+
+def test_registry_waits_for_the_check_interval(tmp_path):
+    path = tmp_path / "schema_context.json"
+    write(path, SCHEMA, 1000)
+    registry = SchemaRegistry(str(path), check_interval=3600)
+    first = registry.get()
+    write(path, {"_default": {}}, 2000)
+    assert registry.get() is first
+
+
+def test_registry_keeps_the_last_good_snapshot(tmp_path):
+    path = tmp_path / "schema_context.json"
+    write(path, SCHEMA, 1000)
+    registry = SchemaRegistry(str(path), check_interval=0)
+    first = registry.get()
+
+    path.write_text("{not json", encoding="utf-8")
+    os.utime(path, (2000, 2000))
+    assert registry.get() is first
+
+    path.unlink()
+    assert registry.get() is first
+
+
+def test_missing_schema_file_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        SchemaRegistry(str(tmp_path / "missing.json")).get()
@@ -0,0 +1,92 @@
+import json
+
+from schema_registry import SchemaSnapshot
+from schema_retriever import SchemaRetriever, estimate_tokens, tokenize
+
+
+def field(kind, *samples):
+    return {"type": kind, "samples": list(samples)}
+
+
+SCHEMA = {
+    "_default": {
+        "_default": {
+            "schemas": [
+                {
+                    "type": "patient",
+                    "document_count": 1000,
+                    "properties": {
+                        "name": field("string", "Carol Anderson", "James Smith"),
+                        "birth_date_year": field("number", 1980, 1955),
+                        "gender": field("string", "female", "male"),
+                        **{f"note_{i}": field("string", f"free text {i}") for i in range(20)},
+                    },
+                },
+                {
+                    "type": "test",
+                    "document_count": 5000,
+                    "properties": {
+                        "patient_id": field("string", "patient::1"),
+                        "test_type": field("string", "blood", "urine"),
+                        "results": {
+                            "type": "array",
+                            "items": {"properties": {"result_value": field("number", 4.2), "result_id": field("string", "r1")}},
+                        },
+                    },
+                },
+                {"type": "medicine", "document_count": 50, "properties": {"dosage": field("string", "10mg")}},
+            ]
+        }
+    }
+}
+
+
+def snapshot(data=SCHEMA):
+    text = json.dumps(data)
+    return SchemaSnapshot("schema_context.json", text, 0.0, str(hash(text)))
+
+
+def test_tokenize_normalises_plurals():
+    assert tokenize("Patients' blood-test RESULTS, categories and glass") == [
+        "patient", "blood", "test", "result", "category", "and", "glass",
+    ]
+
+
+def test_rank_puts_the_mentioned_type_and_fields_first():
+    retriever = SchemaRetriever(snapshot())
+    ranked = retriever.rank("average result value of blood tests")
+    assert ranked[0][0].doc_type == "test"
+    fields = [path for path, _ in ranked[0][2]]
+    assert set(fields[:2]) == {"test_type", "results[].result_value"}
+    assert "medicine" not in [entry.doc_type for entry, _, _ in ranked]
+
+    ranked = retriever.rank("how many female patients were born after 1980?")
+    assert ranked[0][0].doc_type == "patient"
+    assert {path for path, score in ranked[0][2] if score > 0} >= {"gender", "birth_date_year"}
+
+
+def test_rank_honours_top_k():
+    assert len(SchemaRetriever(snapshot(), top_k=1).rank("patient test medicine")) == 1
+
+
+def test_render_keeps_matched_fields_within_the_token_budget():
+    retriever = SchemaRetriever(snapshot(), token_budget=150)
+    text = retriever.render("female patients born in 1980")
+    assert estimate_tokens(text) <= 150
+    blocks = json.loads(text)
+    assert blocks[0]["type"] == "patient"
+    assert {"gender", "birth_date_year"} <= set(blocks[0]["fields"])
+    # the budget is too small for every unmatched field
+    assert len(blocks[0]["fields"]) < 23
+
+    everything = json.loads(SchemaRetriever(snapshot(), token_budget=10000).render("female patients born in 1980"))
+    assert len(everything[0]["fields"]) == 23
+
+
+def test_render_without_a_match_lists_an_overview_within_the_budget():
+    retriever = SchemaRetriever(snapshot(), token_budget=120)
+    text = retriever.render("hello there")
+    assert estimate_tokens(text) <= 120
+    overview = json.loads(text)
+    assert all(set(block) >= {"keyspace", "type", "fields"} for block in overview)
+    assert all(isinstance(block["fields"], list) for block in overview)
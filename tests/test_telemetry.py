@@ -0,0 +1,76 @@
+import asyncio
+import importlib
+from contextlib import contextmanager
+
+from starlette.testclient import TestClient
+
+import telemetry
+
+
+def test_n1ql_spans_carry_the_statement_shape_without_literals(monkeypatch):
+    spans = []
+    real_span = telemetry.span
+
+    @contextmanager
+    def recording_span(stage, **attributes):
+        with real_span(stage, **attributes) as current:
+            spans.append(current)
+            yield current
+
+    async def execute(kwargs):
+        return [{"name": "Carol Anderson"}]
+
+    monkeypatch.setattr(telemetry, "span", recording_span)
+    statement = "SELECT p.name FROM patients p WHERE p.type = 'patient' AND p.id = '142070181'"
+    asyncio.run(telemetry.n1ql_middleware({"query": statement, "scope_name": "_default"}, execute))
+    attributes = spans[0].attributes
+    assert "142070181" not in attributes["statement"]
+    assert attributes["statement"].endswith("p.id = ?")
+    assert attributes["kind"] == "SELECT"
+    assert "wall_ms" in attributes
+
+
+def test_llm_admission_waits_are_exported():
+    import llm_admission
+
+    async def take_turns():
+        scheduler = llm_admission.AdmissionScheduler(requests_per_minute=600, max_wait=1)
+        scheduler.requests.drain(0.05)  # the first turn waits for a refill
+        async with scheduler.admit("session", "hello"):
+            pass
+        scheduler.requests.drain(10)  # the second one longer than max_wait
+        try:
+            async with scheduler.admit("session", "hello"):
+                pass
+        except RuntimeError:
+            pass
+
+    asyncio.run(take_turns())
+    samples = "\n".join(llm_admission.LLM_ADMISSION_WAIT_SECONDS.samples())
+    assert 'cbmcp_llm_admission_wait_seconds_count{outcome="admitted"} 1' in samples
+    assert 'cbmcp_llm_admission_wait_seconds_count{outcome="timed_out"} 1' in samples
+
+
+def test_metrics_are_served_ahead_of_the_frontend_catch_all():
+    telemetry.mount_metrics_endpoint()
+    from chainlit.server import app
+
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "cbmcp_stage_seconds" in response.text
+
+
+def test_reimported_module_mounts_again_on_a_running_server():
+    telemetry.mount_metrics_endpoint()
+    from chainlit.server import app
+
+    client = TestClient(app)
+    assert client.get("/metrics").status_code == 200
+    # `chainlit run -w` re-imports the app (and with it this module) once the server is running
+    reloaded = importlib.reload(telemetry)
+    reloaded.mount_metrics_endpoint()
+    reloaded.ACTIVE_SESSIONS.inc()
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "cbmcp_active_sessions 1" in response.text
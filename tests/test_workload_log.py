@@ -0,0 +1,44 @@
+import pytest
+
+from workload_log import normalize_statement, parameterize_statement, shape_id
+
+
+def test_literals_become_parameters_but_document_types_stay():
+    assert parameterize_statement(
+        "select p.name from b p where p.`type` = 'patient' and p.id = \"142070181\" and p.birth_date_year > 1980 limit 10"
+    ) == (
+        "SELECT p.name FROM b p WHERE p.`type` = 'patient' AND p.id = $1 AND p.birth_date_year > $2 LIMIT $3",
+        ["142070181", 1980, 10],
+    )
+
+
+def test_type_literals_in_in_lists_stay():
+    text, params = parameterize_statement(
+        "SELECT COUNT(*) FROM b d WHERE d.type IN ['patient', 'test'] AND d.patient_id IN ['1', '2']"
+    )
+    assert text == "SELECT COUNT(*) FROM b d WHERE d.type IN ['patient', 'test'] AND d.patient_id IN [$1, $2]"
+    assert params == ["1", "2"]
+    assert normalize_statement("SELECT * FROM b WHERE `type` IN [\"patient\",\"test\"] AND id IN ['1', '2', '3']") == (
+        "SELECT * FROM b WHERE `type` IN [\"patient\",\"test\"] AND id IN [?]"
+    )
+
+
+def test_order_by_positions_stay_literal():
+    assert parameterize_statement("SELECT name, COUNT(*) FROM b GROUP BY name ORDER BY 2 DESC LIMIT 5") == (
+        "SELECT name, COUNT(*) FROM b GROUP BY name ORDER BY 2 DESC LIMIT $1", [5],
+    )
+
+
+@pytest.mark.parametrize("statement", [
+    "SELECT * FROM b WHERE id = 'x' -- comment",
+    "SELECT * FROM b WHERE name = 'O\\'Brien'",
+])
+def test_statements_that_cannot_be_rewritten_safely(statement):
+    assert parameterize_statement(statement) is None
+
+
+def test_same_shape_same_id():
+    first = normalize_statement("SELECT * FROM b WHERE type = 'patient' AND id = '1'")
+    second = normalize_statement("select *  from b where type = 'patient' and id = '2';")
+    assert first == second == "SELECT * FROM b WHERE type = 'patient' AND id = ?"
+    assert shape_id("s", first) == shape_id("s", second) != shape_id("t", first)
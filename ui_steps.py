@@ -0,0 +1,75 @@
+"""
+Live progress of an agent turn in the Chainlit UI.
+
+The Dapr conversation API answers in one piece, so the text of an answer
+cannot arrive token by token.  What the user waits for is the tool loop:
+every tool call the agent makes is shown as a Chainlit step while it runs
+(the SQL++ statement, then the row count and a preview of the rows; larger
+results follow as pages, see `result_pages.py`), and the answer message is
+sent as an empty placeholder before the agent starts and filled in by
+streaming once the answer is there.
+"""
+
+import json
+import re
+import time
+from typing import Any, Callable, Dict
+
+import chainlit as cl
+
+from mcp_pool import ToolFeedback, decode_tool_result, wrap_tool
+from query_tools import QUERY_TOOL, as_rows
+from result_pages import show_result
+from result_shaping import ShapedResult
+
+PREVIEW_ROWS = 5
+PREVIEW_CHARS = 2000
+
+_LINE_RE = re.compile(r"[^\n]*\n|[^\n]+")
+
+
+def _preview(value: Any) -> str:
+    text = value if isinstance(value, str) else json.dumps(value, indent=2, ensure_ascii=False, default=str)
+    return text if len(text) <= PREVIEW_CHARS else text[:PREVIEW_CHARS] + "\n..."
+
+
+def step_middleware(tool_name: str) -> Callable:
+    """Tool middleware (see `mcp_pool.wrap_tool`) that shows the call as a Chainlit step."""
+    is_query = tool_name == QUERY_TOOL
+
+    async def middleware(kwargs: Dict[str, Any], call_next: Callable) -> Any:
+        async with cl.Step(name=tool_name, type="tool", show_input="sql" if is_query else "json") as step:
+            step.input = kwargs.get("query", "") if is_query else json.dumps(kwargs, ensure_ascii=False, default=str)
+            started = time.perf_counter()
+            try:
+                result = await call_next(kwargs)
+            except Exception as e:
+                step.is_error = True
+                step.output = f"{type(e).__name__}: {e}"
+                raise
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if is_query and not isinstance(result, ToolFeedback):
+                # a shaped result carries the full rows; the LLM only got their compact encoding
+                rows = getattr(result, "rows", None) or as_rows(decode_tool_result(result))
+                count = f"{len(rows)}+" if getattr(result, "has_more", False) else str(len(rows))
+                step.output = f"{count} rows in {elapsed_ms:.0f} ms\n\n```json\n{_preview(rows[:PREVIEW_ROWS])}\n```"
+            else:
+                step.output = _preview(decode_tool_result(result))
+        if isinstance(result, ShapedResult):
+            # the user gets the rows as pages; further pages are fetched on demand
+            await show_result(kwargs.get("scope_name"), kwargs.get("query", ""), result)
+        return result
+
+    return middleware
+
+
+def show_tool_steps(tools: list) -> list:
+    """Returns the agent's tools with every call shown as a step of the current message."""
+    return [wrap_tool(tool, step_middleware(tool.name)) for tool in tools]
+
+
+async def stream_text(message: cl.Message, text: str):
+    """Streams `text` into an already sent (placeholder) message line by line, then finalises it."""
+    for line in _LINE_RE.findall(text):
+        await message.stream_token(line)
+    await message.update()
@@ -0,0 +1,256 @@
+"""
+Workload log of the N1QL statements the agent actually runs.
+
+Every statement the agent sends to the MCP query tool is normalised (literals
+replaced by `?`, whitespace and keyword case folded) and appended to an NDJSON
+file together with its scope and latency.  It is logged as the agent wrote
+it: the first page and `COUNT(*)` the result shaper runs instead, and the
+further pages and exports the app fetches, are rewrites of it and not logged.  Running this module aggregates the
+log by query shape and frequency and can export the top shapes for
+`tempUtils/create_indexes.py --workload`, so index recommendations follow
+what users really ask rather than `SAMPLE_QUERIES`.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from mcp_pool import ToolFeedback
+
+DEFAULT_WORKLOAD_LOG_PATH = "workload_log.ndjson"
+
+# literals compared with these fields are part of the query shape (they pick the document type)
+SHAPE_FIELDS = ("type",)
+
+_KEYWORDS = {
+    "select", "from", "where", "and", "or", "not", "in", "is", "null", "missing", "valued", "like",
+    "between", "join", "left", "inner", "outer", "on", "keys", "as", "order", "by", "group", "having",
+    "limit", "offset", "asc", "desc", "distinct", "raw", "element", "value", "unnest", "nest", "let",
+    "any", "every", "satisfies", "end", "within", "array", "for", "when", "then", "case", "else",
+    "exists", "true", "false", "use", "index", "union", "all", "intersect", "except",
+}
+
+_TOKEN_RE = re.compile(
+    r"(?P<ident>`[^`]*`)"
+    r"|(?P<string>'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\")"
+    r"|(?P<number>(?<![\w$])-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?(?![\w]))"
+    r"|(?P<word>[A-Za-z_][\w$]*)"
+    r"|(?P<space>\s+)"
+    r"|(?P<other>.)",
+    re.DOTALL,
+)
+_SHAPE_FIELD_RE = re.compile(
+    rf"(?:^|[\s.(])(?:{'|'.join(rf'`?{re.escape(f)}`?' for f in SHAPE_FIELDS)})\s*==?\s*$", re.IGNORECASE
+)
+# `type IN [...]`: every literal of the list picks a document type
+_SHAPE_LIST_RE = re.compile(
+    rf"(?:^|[\s.(])(?:{'|'.join(rf'`?{re.escape(f)}`?' for f in SHAPE_FIELDS)})\s+IN\s*$", re.IGNORECASE
+)
+_LIST_RE = re.compile(r"\[\s*\?(?:\s*,\s*\?)+\s*\]")
+# numbers in these clauses can be positions (ORDER BY 1), which parameters cannot replace
+_POSITIONAL_CLAUSES = {"order", "group"}
+_CLAUSES = {"select", "from", "where", "order", "group", "having", "limit", "offset", "let", "on", "keys"}
+
+
+def normalize_statement(statement: str) -> str:
+    """
+    Returns the shape of a N1QL statement: literals become `?` (except the
+    document type), keywords are upper-cased and whitespace is collapsed.
+    """
+    parts: List[str] = []
+    shape_list = False
+    for match in _TOKEN_RE.finditer(statement.strip().rstrip(";")):
+        kind, text = match.lastgroup, match.group()
+        if kind == "space":
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        elif kind == "string":
+            parts.append(text if shape_list or _SHAPE_FIELD_RE.search("".join(parts[-6:])) else "?")
+        elif kind == "number":
+            parts.append("?")
+        elif kind == "word" and text.lower() in _KEYWORDS:
+            parts.append(text.upper())
+        else:
+            if kind == "other" and text in "[]":
+                shape_list = text == "[" and bool(_SHAPE_LIST_RE.search("".join(parts[-6:])))
+            parts.append(text)
+    return _LIST_RE.sub("[?]", "".join(parts).strip())
+
+
+def parameterize_statement(statement: str) -> Optional[Tuple[str, List[Any]]]:
+    """
+    Splits a N1QL statement into a normalised text with positional parameters
+    ($1, $2, ...) in place of its literals, and the literal values.  Document
+    type literals stay in the text so plans can still use partial indexes.
+    Returns None for statements it cannot rewrite safely (comments, escapes).
+    """
+    parts: List[str] = []
+    params: List[Any] = []
+    clause = None
+    shape_list = False
+    for match in _TOKEN_RE.finditer(statement.strip().rstrip(";")):
+        kind, text = match.lastgroup, match.group()
+        if kind == "space":
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        elif kind == "string" and not (shape_list or _SHAPE_FIELD_RE.search("".join(parts[-6:]))):
+            if "\\" in text and text[0] == "'":
+                return None
+            try:
+                params.append(json.loads(text) if text[0] == '"' else text[1:-1].replace("''", "'"))
+            except ValueError:
+                return None
+            parts.append(f"${len(params)}")
+        elif kind == "number" and clause not in _POSITIONAL_CLAUSES:
+            if text[0] == "-":
+                # keep the sign as an operator so `a -1` stays a subtraction
+                parts.append(" -" if parts and parts[-1] == "-" else "-")
+                text = text[1:]
+            params.append(json.loads(text))
+            parts.append(f"${len(params)}")
+        elif kind == "word" and text.lower() in _KEYWORDS:
+            clause = text.lower() if text.lower() in _CLAUSES else clause
+            parts.append(text.upper())
+        elif kind == "other" and text in "-*" and parts and parts[-1] + text in ("--", "/*"):
+            return None
+        else:
+            if kind == "other" and text in "[]":
+                shape_list = text == "[" and bool(_SHAPE_LIST_RE.search("".join(parts[-6:])))
+            parts.append(text)
+    return "".join(parts).strip(), params
+
+
+def shape_id(scope: Optional[str], normalized: str) -> str:
+    """Stable identifier of a query shape within a scope."""
+    return hashlib.sha1(f"{scope or ''}\n{normalized}".encode("utf-8")).hexdigest()[:12]
+
+
+class WorkloadLog:
+    """Appends one NDJSON record per executed statement; literals never reach the file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, scope: Optional[str], statement: str, duration_ms: float, error: Optional[str] = None):
+        normalized = normalize_statement(statement)
+        entry = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "shape_id": shape_id(scope, normalized),
+            "scope": scope,
+            "statement": normalized,
+            "duration_ms": round(duration_ms, 3),
+        }
+        if error:
+            entry["error"] = error
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            print(f"Warning: could not write workload log {self.path}: {e}")
+
+    async def middleware(self, kwargs: Dict[str, Any], call_next: Callable) -> Any:
+        """Query-tool middleware (see `mcp_pool.wrap_tool`) that logs every executed statement."""
+        started = time.perf_counter()
+        try:
+            result = await call_next(kwargs)
+        except Exception as e:
+            self.record(kwargs.get("scope_name"), kwargs.get("query", ""), (time.perf_counter() - started) * 1000, type(e).__name__)
+            raise
+        # a ToolFeedback means an inner middleware answered without running the statement
+        error = "not executed" if isinstance(result, ToolFeedback) else None
+        self.record(kwargs.get("scope_name"), kwargs.get("query", ""), (time.perf_counter() - started) * 1000, error)
+        return result
+
+
+_workload_log: Optional[WorkloadLog] = None
+
+
+def get_workload_log() -> Optional[WorkloadLog]:
+    """Returns the process-wide log, or None when WORKLOAD_LOG_PATH is set to an empty value."""
+    global _workload_log
+    path = os.getenv("WORKLOAD_LOG_PATH", DEFAULT_WORKLOAD_LOG_PATH)
+    if not path:
+        return None
+    if _workload_log is None or _workload_log.path != path:
+        _workload_log = WorkloadLog(path)
+    return _workload_log
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def aggregate(path: str) -> List[Dict[str, Any]]:
+    """Groups the log by query shape, most frequent first."""
+    shapes: Dict[str, Dict[str, Any]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            shape = shapes.setdefault(entry["shape_id"], {
+                "shape_id": entry["shape_id"],
+                "scope": entry.get("scope"),
+                "statement": entry["statement"],
+                "count": 0,
+                "errors": 0,
+                "durations": [],
+                "first_seen": entry["ts"],
+            })
+            shape["count"] += 1
+            shape["errors"] += 1 if entry.get("error") else 0
+            shape["durations"].append(entry.get("duration_ms", 0.0))
+            shape["last_seen"] = entry["ts"]
+    results = []
+    for shape in shapes.values():
+        durations = shape.pop("durations")
+        shape["mean_ms"] = round(sum(durations) / len(durations), 3)
+        shape["p95_ms"] = round(_percentile(durations, 95), 3)
+        shape["total_ms"] = round(sum(durations), 3)
+        results.append(shape)
+    return sorted(results, key=lambda s: (-s["count"], -s["total_ms"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate the agent's query workload log by query shape.")
+    parser.add_argument("--path", default=os.getenv("WORKLOAD_LOG_PATH") or DEFAULT_WORKLOAD_LOG_PATH, help="workload log (NDJSON)")
+    parser.add_argument("--top", type=int, default=20, help="number of shapes to show/export")
+    parser.add_argument("--min-count", type=int, default=1, help="ignore shapes seen fewer times than this")
+    parser.add_argument("--export", help="write the top shapes as JSON for create_indexes.py --workload")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"❌ Workload log not found: {args.path}")
+        return 1
+    shapes = [s for s in aggregate(args.path) if s["count"] >= args.min_count][: args.top]
+    total = sum(s["count"] for s in shapes)
+    print(f"📊 {len(shapes)} query shapes ({total} executions) from {args.path}")
+    for position, shape in enumerate(shapes, 1):
+        print(f"\n{position:>3}. x{shape['count']:<6} p95 {shape['p95_ms']:>9.1f} ms  errors {shape['errors']:<4} scope {shape['scope']}")
+        print(f"     {shape['statement']}")
+
+    if args.export:
+        exported = [
+            {"name": f"workload_{position:02d}_{shape['shape_id'][:8]}", **shape}
+            for position, shape in enumerate(shapes, 1)
+        ]
+        with open(args.export, "w", encoding="utf-8") as f:
+            json.dump(exported, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Exported {len(exported)} shapes to {args.export}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())